@@ -0,0 +1,201 @@
+"""
+Admission control for the inference endpoints
+
+Each worker process admits at most MAX_INFLIGHT recognitions at a time and
+lets at most MAX_QUEUE more wait for a slot. Anything beyond that, or a
+request that waited longer than QUEUE_TIMEOUT seconds, is refused right away
+with 503 + Retry-After instead of queueing behind work the client will have
+given up on. Cheap endpoints (/health, /ready, preflights) don't go through
+admission, so they keep answering under load.
+
+    admission = AdmissionController.from_env()
+    try:
+        with admission.admit():
+            ...inference...
+    except Overloaded as e:
+        ...503 with Retry-After: e.retry_after...
+
+Requests can also carry a time budget (X-Request-Timeout-Ms header, default
+REQUEST_TIMEOUT_MS). The Deadline is checked while queued and between the
+pipeline stages; work for a client that has already given up is dropped
+and counted per stage.
+"""
+import math
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+# Budget for requests without the header; the web client gives up after 30 s
+DEFAULT_TIMEOUT_MS = float(os.environ.get("REQUEST_TIMEOUT_MS", 30000))
+
+# Requests dropped because their deadline passed, by pipeline stage
+expired = Counter()
+_expired_lock = threading.Lock()
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; retry_after is in whole seconds."""
+
+    def __init__(self, retry_after, reason="queue full"):
+        super().__init__(f"Server overloaded ({reason}), retry in {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's time budget ran out before `stage`."""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Absolute expiry time (time.monotonic) of one request."""
+
+    def __init__(self, timeout_ms):
+        self.expires = time.monotonic() + timeout_ms / 1000.0
+
+    @classmethod
+    def from_header(cls, value):
+        """Deadline from an X-Request-Timeout-Ms value, or the default budget."""
+        try:
+            timeout_ms = float(value)
+        except (TypeError, ValueError):
+            timeout_ms = DEFAULT_TIMEOUT_MS
+        if not timeout_ms > 0:
+            timeout_ms = DEFAULT_TIMEOUT_MS
+        return cls(min(timeout_ms, DEFAULT_TIMEOUT_MS * 10))
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def check(self, stage):
+        """Raise DeadlineExceeded (and count it) if the budget is spent."""
+        if time.monotonic() >= self.expires:
+            with _expired_lock:
+                expired[stage] += 1
+            raise DeadlineExceeded(stage)
+
+
+class AdmissionController:
+    """
+    Bounded in-flight + bounded queue, per process.
+
+    Threaded servers use admit(), which waits for a slot. The ASGI server
+    reserves a place on the event loop with reserve() (never blocks) and,
+    on the executor thread that runs the work, calls begin() and release().
+    """
+
+    def __init__(self, max_inflight=2, max_queue=4, queue_timeout=10.0):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.inflight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Moving average of the time a request holds a slot, for Retry-After
+        self._service_s = 0.5
+
+    @classmethod
+    def from_env(cls, default_inflight=2):
+        return cls(max_inflight=int(os.environ.get("MAX_INFLIGHT", default_inflight)),
+                   max_queue=int(os.environ.get("MAX_QUEUE", 4)),
+                   queue_timeout=float(os.environ.get("QUEUE_TIMEOUT", 10.0)))
+
+    def retry_after(self):
+        """Seconds until a slot is likely free: queue drain time, 1-30 s."""
+        drain = self._service_s * (self.queued + 1) / max(self.max_inflight, 1)
+        return min(30, max(1, math.ceil(drain)))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        if reason == "queue timeout":
+            self.timed_out += 1
+        return Overloaded(self.retry_after(), reason)
+
+    def reserve(self):
+        """Take a queue place without blocking. Returns a ticket for begin()."""
+        with self._cond:
+            if self.inflight + self.queued >= self.max_inflight + self.max_queue:
+                raise self._reject("queue full")
+            self.queued += 1
+            return time.monotonic()
+
+    def cancel(self, ticket):
+        """Give a reserved place back without running (e.g. the client left)."""
+        with self._cond:
+            self.queued -= 1
+            self._cond.notify()
+
+    def begin(self, ticket, wait=False, deadline=None):
+        """
+        Move a reserved request from the queue to in-flight. With wait=True,
+        block until a slot frees up; either way a request that has been
+        queued longer than queue_timeout is shed, and one whose Deadline
+        passed in the queue raises DeadlineExceeded. Returns the start time.
+        """
+        queue_deadline = ticket + self.queue_timeout
+        if deadline is not None:
+            queue_deadline = min(queue_deadline, deadline.expires)
+        with self._cond:
+            try:
+                while wait and self.inflight >= self.max_inflight:
+                    remaining = queue_deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if deadline is not None:
+                    deadline.check("queue")
+                still_full = wait and self.inflight >= self.max_inflight
+                if still_full or (not wait and time.monotonic() >= ticket + self.queue_timeout):
+                    raise self._reject("queue timeout")
+            except BaseException:
+                self.queued -= 1
+                raise
+            self.queued -= 1
+            self.inflight += 1
+            self.admitted += 1
+        return time.monotonic()
+
+    def release(self, started):
+        with self._cond:
+            self.inflight -= 1
+            self._service_s = 0.8 * self._service_s + 0.2 * (time.monotonic() - started)
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self, deadline=None):
+        """
+        Reserve, wait for a slot, run the block, release. Raises Overloaded,
+        or DeadlineExceeded if `deadline` passes while waiting.
+        """
+        started = self.begin(self.reserve(), wait=True, deadline=deadline)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    @property
+    def saturated(self):
+        """True when the next request would be refused."""
+        return self.inflight + self.queued >= self.max_inflight + self.max_queue
+
+    def snapshot(self):
+        return {
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_service_ms": round(self._service_s * 1000, 1),
+            "expired": dict(expired),
+        }
@@ -1,22 +1,39 @@
 """
 Flask API server for facial recognition - Clean Dropbox version
+
+Heavy dependencies (numpy, cv2, insightface/onnxruntime, requests) are only
+imported by the background warm-up or on first use, so the process answers
+/health and preflights within milliseconds of starting. /ready reports when
+the models and gallery are loaded.
+
+Import-time profile:  python -X importtime -c "import api_server"
 """
-from flask import Flask, request, jsonify, make_response
+import time
+_process_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, make_response
 from flask_cors import CORS
 from pathlib import Path
-import cv2
-import numpy as np
 import base64
 import json
 import sys
 import os
-import time
-import requests
+import threading
+
+from admission import (DEADLINE_HEADER, AdmissionController, Deadline,
+                       DeadlineExceeded, Overloaded)
 
 # --- Force-set Dropbox model URLs (for local debugging or fallback) ---
 os.environ["W600K_URL"] = "https://www.dropbox.com/scl/fi/pocojod1lg0tv6ipv3y9g/w600k_r50.onnx?rlkey=dfrstynu59w4kzppfapnyxqwo&st=v0k5q59a&dl=1"
 os.environ["SCRFD_URL"] = "https://www.dropbox.com/scl/fi/wls097vickm7v2avxk5g2/scrfd_10g_bnkps.onnx?rlkey=yy2cc9p9wxbm75zfb6947djok&st=fo6wwtyf&dl=1"
 
+# Expected SHA-256 of the models, by filename; downloads that don't match are
+# discarded. Nothing is pinned yet: fill in `sha256sum models/*.onnx` of the
+# vetted files (download_model logs the checksum of every unpinned file).
+# W600K_SHA256 / SCRFD_SHA256 / LIGHT_DETECTOR_SHA256 set or override an
+# entry. Unpinned files are only size- and HTML-checked.
+MODEL_SHA256 = {}
+
 # Optional: confirm for logs
 print("🔗 W600K_URL set to:", os.environ["W600K_URL"])
 print("🔗 SCRFD_URL set to:", os.environ["SCRFD_URL"])
@@ -25,64 +42,19 @@ print("🔗 SCRFD_URL set to:", os.environ["SCRFD_URL"])
 # Add the facial_reco directory to the path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from utils import FaceEngine, load_face_db, find_best_match
-
-def download_from_dropbox(url, filepath, expected_min_size_mb=1):
-    """Download file from Dropbox with direct download link"""
-    max_retries = 3
-    
-    # Ensure Dropbox URL uses direct download
-    if 'dropbox.com' in url:
-        if '&dl=0' in url:
-            url = url.replace('&dl=0', '&dl=1')
-        elif '&dl=1' not in url:
-            url = url + ('&' if '?' in url else '?') + 'dl=1'
-    
-    for attempt in range(max_retries):
-        try:
-            print(f"📥 Downloading {filepath.name} (attempt {attempt + 1}/{max_retries})...")
-            print(f"🔗 URL: {url}")
-            
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            
-            print("💾 Saving file...")
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            file_size_mb = filepath.stat().st_size / (1024 * 1024)
-            print(f"📊 Downloaded file size: {file_size_mb:.2f} MB")
-            
-            if file_size_mb >= expected_min_size_mb:
-                # Check it's not HTML
-                with open(filepath, 'rb') as f:
-                    header = f.read(100)
-                    if b'<html' in header.lower():
-                        print("❌ Downloaded HTML instead of file!")
-                        filepath.unlink()
-                        continue
-                
-                print(f"✅ Successfully downloaded {filepath.name}")
-                return True
-            else:
-                print(f"❌ File too small ({file_size_mb:.2f} MB < {expected_min_size_mb} MB)")
-                filepath.unlink()
-                
-        except Exception as e:
-            print(f"❌ Download failed: {e}")
-            if filepath.exists():
-                filepath.unlink()
-            
-        if attempt < max_retries - 1:
-            print("🔄 Retrying in 5 seconds...")
-            time.sleep(5)
-    
-    return False
+# Optional detector cascade: a small SCRFD model in models/ (e.g.
+# scrfd_2.5g_bnkps.onnx) tried first, SCRFD-10G only when it isn't confident
+LIGHT_DETECTOR = os.environ.get("LIGHT_DETECTOR")
+LIGHT_INPUT_SIZE = int(os.environ.get("LIGHT_INPUT_SIZE", 320))
+LIGHT_MIN_SCORE = float(os.environ.get("LIGHT_MIN_SCORE", 0.6))
+# Set to 0 to use insightface's own SCRFD post-processing (see scrfd_fast.py)
+SCRFD_FAST_POSTPROCESS = os.environ.get("SCRFD_FAST_POSTPROCESS", "1") != "0"
 
 def ensure_models():
-    """Ensure required model files exist; download if missing."""
+    """Ensure required model files exist; download missing ones concurrently."""
+    from model_download import download_models
+    from shared_gallery import lock_exclusive
+    
     models_dir = Path(__file__).parent / "models"
     models_dir.mkdir(exist_ok=True)
     
@@ -92,31 +64,41 @@ def ensure_models():
     print(f"🔗 W600K_URL: {'SET' if W600K_URL else 'NOT SET'}")
     print(f"🔗 SCRFD_URL: {'SET' if SCRFD_URL else 'NOT SET'}")
     
-    # Download w600k_r50.onnx
-    w600k_path = models_dir / "w600k_r50.onnx"
-    if not w600k_path.exists():
-        if W600K_URL:
-            print("⬇️ Downloading w600k_r50.onnx...")
-            success = download_from_dropbox(W600K_URL, w600k_path, expected_min_size_mb=50)
-            if not success:
-                print("❌ Failed to download w600k_r50.onnx")
+    models = [
+        # (filename, url, expected_min_size_mb, sha256 env var)
+        ("w600k_r50.onnx", W600K_URL, 50, "W600K_SHA256"),
+        ("scrfd_10g_bnkps.onnx", SCRFD_URL, 10, "SCRFD_SHA256"),
+    ]
+    if LIGHT_DETECTOR:
+        models.append((LIGHT_DETECTOR, os.environ.get("LIGHT_DETECTOR_URL"), 1,
+                       "LIGHT_DETECTOR_SHA256"))
+    
+    specs = []
+    for filename, url, min_size_mb, sha_env in models:
+        path = models_dir / filename
+        if path.exists():
+            print(f"✅ {filename} already exists")
+        elif url:
+            print(f"⬇️ Downloading {filename}...")
+            specs.append({
+                "url": url,
+                "filepath": path,
+                "expected_min_size_mb": min_size_mb,
+                "sha256": os.environ.get(sha_env) or MODEL_SHA256.get(filename),
+            })
         else:
-            print("⚠️ W600K_URL not set")
-    else:
-        print("✅ w600k_r50.onnx already exists")
+            print(f"⚠️ URL for {filename} not set")
     
-    # Download scrfd_10g_bnkps.onnx
-    scrfd_path = models_dir / "scrfd_10g_bnkps.onnx"
-    if not scrfd_path.exists():
-        if SCRFD_URL:
-            print("⬇️ Downloading scrfd_10g_bnkps.onnx...")
-            success = download_from_dropbox(SCRFD_URL, scrfd_path, expected_min_size_mb=10)
+    if not specs:
+        return
+    
+    # Every worker warms up on its own; only one of them downloads at a time
+    with open(models_dir / ".download.lock", "w") as lock_file:
+        lock_exclusive(lock_file)
+        specs = [spec for spec in specs if not spec["filepath"].exists()]
+        for path, success in download_models(specs).items():
             if not success:
-                print("❌ Failed to download scrfd_10g_bnkps.onnx")
-        else:
-            print("⚠️ SCRFD_URL not set")
-    else:
-        print("✅ scrfd_10g_bnkps.onnx already exists")
+                print(f"❌ Failed to download {Path(path).name}")
 
 app = Flask(__name__)
 
@@ -125,8 +107,8 @@ CORS(app, resources={
     r"/*": {
         "origins": "*",
         "methods": ["GET", "POST", "OPTIONS", "PUT", "DELETE"],
-        "allow_headers": ["Content-Type", "Accept", "Authorization"],
-        "expose_headers": ["Content-Type"],
+        "allow_headers": ["Content-Type", "Accept", "Authorization", "X-Request-Timeout-Ms"],
+        "expose_headers": ["Content-Type", "Retry-After"],
         "supports_credentials": False,
         "max_age": 3600
     }
@@ -137,7 +119,7 @@ CORS(app, resources={
 def after_request(response):
     # Ensure CORS headers are set (redundant but safe)
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept, Authorization'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept, Authorization, X-Request-Timeout-Ms'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS, PUT, DELETE'
     response.headers['Access-Control-Max-Age'] = '3600'
     
@@ -159,60 +141,557 @@ def handle_error(e):
     response.headers['Access-Control-Allow-Origin'] = '*'
     return response
 
+# SCRFD input size; uploads are decoded no larger than needed for it
+DET_INPUT_SIZE = (640, 640)
+# Most images accepted by a single /embed request
+MAX_EMBED_BATCH = int(os.environ.get("MAX_EMBED_BATCH", 32))
+
 # Initialize face engine and database (lazy loading)
-face_engine = None
+# ENGINE_POOL_SIZE engines per process, see engine_pool.py
+engine_pool = None
 face_db = None
+precision_warned = False
+face_gallery = None
+shared_gallery = None
+store_follower = None
+namespace_galleries = None
+sharded_gallery = None
+replica_follower = None
+engine_lock = threading.Lock()
+# Per-worker limits on concurrent/queued inference (MAX_INFLIGHT, MAX_QUEUE,
+# QUEUE_TIMEOUT); run gunicorn with more threads than MAX_INFLIGHT + MAX_QUEUE
+# so health checks always find a free thread
+admission = AdmissionController.from_env()
+
+# Background warm-up: imports, model download, engine + gallery load
+warmup_state = {'status': 'pending', 'error': None, 'timings_ms': {}}
+warmup_lock = threading.Lock()
+
+def engine_stubbed():
+    """FACE_ENGINE_STUB=1 swaps the models for stub_engine.StubFaceEngine"""
+    return os.environ.get("FACE_ENGINE_STUB", "").lower() in ("1", "true", "yes")
 
-def get_face_engine():
-    """Lazy load face engine"""
-    global face_engine
-    if face_engine is None:
+def get_engine_pool():
+    """Lazy load the face engine pool (once, even if requests race the warm-up)"""
+    global engine_pool
+    if engine_pool is not None:
+        return engine_pool
+    with engine_lock:
+        if engine_pool is not None:
+            return engine_pool
+        from engine_pool import EnginePool
+        if engine_stubbed():
+            # Serving-layer benchmarks (loadtest.py): no models involved
+            from stub_engine import StubFaceEngine
+            engine_pool = EnginePool.from_env(
+                lambda threads: StubFaceEngine(det_input_size=DET_INPUT_SIZE))
+            return engine_pool
+        from utils import FaceEngine
+        
         models_dir = os.path.join(os.path.dirname(__file__), 'models')
         detector_path = os.path.join(models_dir, 'scrfd_10g_bnkps.onnx')
         recognizer_path = os.path.join(models_dir, 'w600k_r50.onnx')
         
-        face_engine = FaceEngine(
+        engine_pool = EnginePool.from_env(lambda threads: FaceEngine(
             detector_path=detector_path,
             recognizer_path=recognizer_path,
             ctx_id=0,
-            det_input_size=(640, 640)
-        )
-    return face_engine
+            det_input_size=DET_INPUT_SIZE,
+            light_detector_path=os.path.join(models_dir, LIGHT_DETECTOR) if LIGHT_DETECTOR else None,
+            light_input_size=(LIGHT_INPUT_SIZE, LIGHT_INPUT_SIZE),
+            light_min_score=LIGHT_MIN_SCORE,
+            fast_postprocess=SCRFD_FAST_POSTPROCESS,
+            intra_op_threads=threads
+        ))
+    return engine_pool
+
+def _timed_step(name, fn):
+    started = time.perf_counter()
+    result = fn()
+    warmup_state['timings_ms'][name] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+def warm_up():
+    """Import heavy modules, fetch models and load engine + gallery"""
+    warmup_state['status'] = 'warming'
+    try:
+        _timed_step('import_numpy', lambda: __import__('numpy'))
+        _timed_step('import_cv2', lambda: __import__('cv2'))
+        if not engine_stubbed():
+            _timed_step('import_insightface', lambda: __import__('insightface.model_zoo'))
+            _timed_step('ensure_models', ensure_models)
+        _timed_step('load_engine', get_engine_pool)
+        _timed_step('load_gallery', get_gallery)
+        warmup_state['status'] = 'ready'
+        print(f"✅ Warm-up complete: {warmup_state['timings_ms']}")
+    except Exception as e:
+        warmup_state['status'] = 'failed'
+        warmup_state['error'] = str(e)
+        print(f"❌ Warm-up failed: {e}")
+        import traceback
+        traceback.print_exc()
+
+def start_warmup():
+    """Start the warm-up thread once per process"""
+    with warmup_lock:
+        if warmup_state['status'] != 'pending':
+            return
+        warmup_state['status'] = 'warming'
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
+def readiness_payload(controller=None):
+    """
+    Readiness state shared by the Flask and ASGI /ready endpoints.
+
+    Also 503 while the admission queue is full, so load balancers steer new
+    requests to other instances, with the queue depth in 'load'.
+    """
+    controller = controller or admission
+    status = warmup_state['status']
+    if status == 'ready' and controller.saturated:
+        status = 'overloaded'
+    body = {
+        'status': status,
+        'ready': status == 'ready',
+        'startup_ms': startup_ms,
+        'timings_ms': warmup_state['timings_ms'],
+        'load': controller.snapshot(),
+    }
+    if engine_pool is not None:
+        body['engine'] = engine_pool.stats()
+        body['engine_pool'] = engine_pool.snapshot()
+    if namespace_galleries is not None:
+        body['namespaces'] = namespace_galleries.snapshot()
+    if sharded_gallery is not None:
+        body['shards'] = sharded_gallery.snapshot()
+    if warmup_state['error']:
+        body['error'] = warmup_state['error']
+    return body, (200 if status == 'ready' else 503)
+
+def expired_payload(e):
+    """504 body for a request whose deadline passed (the client has left)"""
+    return {'error': 'Request deadline exceeded', 'stage': e.stage}, 504
+
+def overloaded_payload(e):
+    """503 body and headers for a shed request"""
+    body = {'error': 'Server busy, please retry', 'reason': e.reason, 'retry_after': e.retry_after}
+    return body, 503, {'Retry-After': str(e.retry_after)}
+
+def read_face_db():
+    """Parse the face database from GALLERY_STORE, FACE_DB_JSON or database.json (uncached)"""
+    from utils import load_face_db
+    
+    store_path = os.environ.get("GALLERY_STORE")
+    db_env = os.environ.get("FACE_DB_JSON")
+    if store_path:
+        from gallery_store import GalleryStore
+        db = GalleryStore(store_path).load_db()
+        print(f"✅ Loaded face database from {store_path} ({len(db)} users)")
+    elif db_env:
+        try:
+            db = json.loads(db_env)
+            print(f"✅ Loaded face database from environment ({len(db)} users)")
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Failed to parse FACE_DB_JSON: {e}")
+            db = {}
+    else:
+        # Fall back to file
+        db_path = os.path.join(os.path.dirname(__file__), 'database.json')
+        db = load_face_db(db_path)
+        if db:
+            print(f"✅ Loaded face database from file ({len(db)} users)")
+    return db
+
+def face_db_source():
+    """(mtime, digest) of the database read_face_db() reads, see shared_gallery"""
+    from shared_gallery import source_of_file, source_of_text
+    store_path = os.environ.get("GALLERY_STORE")
+    if store_path:
+        from gallery_store import GalleryStore
+        # The change feed position identifies the store's content
+        mtime = max(os.path.getmtime(p) for p in (store_path, store_path + "-wal")
+                    if os.path.exists(p))
+        seq = GalleryStore(store_path).last_seq()
+        return mtime, source_of_text(f"{os.path.abspath(store_path)}:{seq}")[1]
+    if os.environ.get("FACE_DB_JSON"):
+        return source_of_text(os.environ["FACE_DB_JSON"])
+    return source_of_file(os.path.join(os.path.dirname(__file__), 'database.json'))
 
 def get_face_db():
     """Lazy load face database"""
     global face_db
     if face_db is None:
-        # Try environment variable first
-        db_env = os.environ.get("FACE_DB_JSON")
-        if db_env:
-            try:
-                face_db = json.loads(db_env)
-                print(f"✅ Loaded face database from environment ({len(face_db)} users)")
-            except json.JSONDecodeError as e:
-                print(f"⚠️ Failed to parse FACE_DB_JSON: {e}")
-                face_db = {}
-        else:
-            # Fall back to file
-            db_path = os.path.join(os.path.dirname(__file__), 'database.json')
-            face_db = load_face_db(db_path)
-            if face_db:
-                print(f"✅ Loaded face database from file ({len(face_db)} users)")
+        face_db = read_face_db()
     return face_db
 
-def base64_to_image(base64_string):
-    """Convert base64 string to OpenCV image"""
+def get_gallery(namespace=None):
+    """
+    Gallery used for matching.
+
+    With SHARED_GALLERY=1 the normalized matrix lives in shared memory: the
+    first worker parses the database and publishes it, every other worker
+    attaches to the same read-only segment and follows generation swaps made
+    with `python shared_gallery.py publish`.
+
+    With GALLERY_STORE=<sqlite file> the gallery follows the store's change
+    feed (see gallery_store.py), checked every GALLERY_STORE_POLL seconds.
+
+    With GALLERY_REPLICA=<release dir or URL> the gallery follows versioned
+    snapshots and deltas written by gallery_replica.py, checked every
+    GALLERY_REPLICA_POLL seconds.
+
+    With MATCHER_SHARDS=host:port,... matching is done by shard processes
+    (see shard_matcher.py) and this worker holds no embeddings at all.
+
+    A `namespace` selects that namespace's gallery from GALLERY_NAMESPACE_DIR
+    instead (see namespaces.py); raises UnknownNamespace if there is none.
+    """
+    global face_gallery, shared_gallery, store_follower, namespace_galleries, sharded_gallery
+    global replica_follower
+    if namespace is not None:
+        from namespaces import NamespaceGalleries, UnknownNamespace
+        if namespace_galleries is None:
+            namespace_galleries = NamespaceGalleries.from_env()
+            if namespace_galleries is None:
+                raise UnknownNamespace("Gallery namespaces are not enabled (GALLERY_NAMESPACE_DIR)")
+        return namespace_galleries.get(namespace)
+
+    if os.environ.get("MATCHER_SHARDS"):
+        if sharded_gallery is None:
+            from shard_matcher import ShardedGallery
+            sharded_gallery = ShardedGallery.from_env()
+        return sharded_gallery
+
+    if os.environ.get("SHARED_GALLERY", "").lower() in ("1", "true", "yes"):
+        if shared_gallery is None:
+            from shared_gallery import SharedGallery, DEFAULT_PREFIX
+            gallery = SharedGallery(os.environ.get("SHARED_GALLERY_PREFIX", DEFAULT_PREFIX))
+            # Republishes a segment left over from an older database
+            gallery.get_or_publish(read_face_db, face_db_source())
+            shared_gallery = gallery
+        # Only the publishing worker parses the DB, and it doesn't keep it
+        return quantized(shared_gallery.get_or_publish(read_face_db))
+    
+    if os.environ.get("GALLERY_REPLICA"):
+        # Pull new versions as deltas: enrollments ship without a redeploy
+        if replica_follower is None:
+            import tempfile
+            from gallery_replica import ReplicaSource
+            from gallery_store import GalleryFollower
+            cache_dir = os.environ.get("GALLERY_REPLICA_CACHE",
+                                       os.path.join(tempfile.gettempdir(), "mq_gallery_replica"))
+            replica_follower = GalleryFollower(ReplicaSource(os.environ["GALLERY_REPLICA"], cache_dir),
+                                               float(os.environ.get("GALLERY_REPLICA_POLL", "10")))
+        return replica_follower.current()
+    
+    if os.environ.get("GALLERY_STORE"):
+        # Follow the store's change feed: enrollments show up without a restart
+        if store_follower is None:
+            from gallery_store import GalleryStore, GalleryFollower
+            store_follower = GalleryFollower(GalleryStore(os.environ["GALLERY_STORE"]),
+                                             float(os.environ.get("GALLERY_STORE_POLL", "1.0")))
+        return store_follower.current()
+    
+    if face_gallery is None:
+        from utils import Gallery
+        if gallery_precision() == "int8":
+            # Neither the parsed DB nor the float32 matrix stays in this worker
+            face_gallery = quantized(Gallery.from_db(read_face_db() or {}))
+        else:
+            face_gallery = Gallery.from_db(get_face_db() or {})
+    return face_gallery
+
+def gallery_precision():
+    """GALLERY_PRECISION: float32 (default) or int8."""
+    global precision_warned
+    precision = os.environ.get("GALLERY_PRECISION", "float32").lower()
+    if precision not in ("float32", "int8"):
+        if not precision_warned:
+            print(f"⚠️ GALLERY_PRECISION={precision} not supported, using float32")
+            precision_warned = True
+        precision = "float32"
+    return precision
+
+def quantized(gallery):
+    """
+    With GALLERY_PRECISION=int8, scan int8 codes of the gallery and re-rank
+    the best GALLERY_CANDIDATES rows against the exact float32 matrix. Codes
+    and matrix are mmap'd from GALLERY_CACHE_DIR (see
+    shared_gallery.open_quantized), so the workers share one copy. Built once
+    per gallery (i.e. per shared generation).
+    """
+    if gallery is None or gallery_precision() != "int8":
+        return gallery
+    cached = getattr(gallery, "_quantized", None)
+    if cached is None:
+        import tempfile
+        from shared_gallery import open_quantized
+        cache_dir = os.environ.get("GALLERY_CACHE_DIR",
+                                   os.path.join(tempfile.gettempdir(), "mq_gallery_cache"))
+        cached = open_quantized(gallery, cache_dir,
+                                int(os.environ.get("GALLERY_CANDIDATES", "32")))
+        gallery._quantized = cached
+    return cached
+
+def base64_to_bytes(base64_string):
+    """Strip an optional data-URL prefix and base64-decode"""
+    if ',' in base64_string:
+        base64_string = base64_string.split(',')[1]
+    return base64.b64decode(base64_string)
+
+def base64_to_image(base64_string, target_size=None):
+    """
+    Convert base64 string to OpenCV image.
+    
+    With a target_size, large JPEGs are decoded directly at 1/2, 1/4 or 1/8
+    size (see utils.decode_image) and (image, scale) is returned instead.
+    """
+    from utils import decode_image
     try:
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        image_data = base64.b64decode(base64_string)
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        return img
+        img, scale = decode_image(base64_to_bytes(base64_string), target_size)
     except Exception as e:
         print(f"Error decoding image: {e}")
-        return None
+        img, scale = None, 1.0
+    if target_size is None:
+        return img
+    return img, scale
+
+def recognize_payload(data, deadline=None):
+    """
+    Run the recognition pipeline on a parsed /recognize JSON body.
+
+    Returns (response_dict, status_code) so the Flask routes and the ASGI
+    server (async_server.py) share the same behaviour.
+
+    With a `deadline` (admission.Deadline), DeadlineExceeded is raised
+    between decode, detect, embed and match once the budget is spent.
+
+    Besides a plain 'image', clients that run their own face detector can
+    send either 'aligned' (a 112x112 crop aligned to the ArcFace template) or
+    'image' + 'landmarks' (5 [x, y] points); the server detector is skipped.
+    """
+    from namespaces import UnknownNamespace
+    from shard_matcher import ShardsUnavailable
+    from utils import FaceInputError
+    
+    if 'image' not in data and 'aligned' not in data:
+        print("❌ No image in JSON data")
+        return {'error': 'No image provided'}, 400
+
+    deadline = deadline or Deadline.from_header(None)
+    deadline.check("decode")
+    if 'aligned' in data:
+        image, scale = base64_to_image(data['aligned']), 1.0
+    else:
+        # Decode image (oversized JPEGs are scaled down while decoding)
+        image, scale = base64_to_image(data['image'], target_size=DET_INPUT_SIZE)
+    if image is None:
+        return {'error': 'Failed to decode image'}, 400
+    
+    print(f"✅ Image decoded: {image.shape} (1/{scale:.0f} scale)")
+    
+    # Get face engine and database with error handling
+    print("🔧 Loading face engine...")
+    try:
+        pool = get_engine_pool()
+        print("✅ Face engine loaded")
+    except Exception as e:
+        print(f"❌ Failed to load face engine: {e}")
+        import traceback
+        traceback.print_exc()
+        return {'error': f'Failed to load face engine: {str(e)}'}, 500
+    
+    print("📚 Loading face database...")
+    namespace = data.get('namespace')
+    try:
+        db = get_gallery(namespace)
+        users = len(db) if db is not None else 0
+        print(f"✅ Face database loaded ({users} users"
+              f"{f' in {namespace}' if namespace is not None else ''})")
+    except UnknownNamespace as e:
+        print(f"⚠️ {e}")
+        return {'error': str(e)}, 404
+    except ShardsUnavailable as e:
+        print(f"⚠️ Sharded gallery unavailable: {e}")
+        return {'error': f'Matching unavailable: {e}'}, 503
+    except Exception as e:
+        print(f"❌ Failed to load database: {e}")
+        import traceback
+        traceback.print_exc()
+        return {'error': f'Failed to load database: {str(e)}'}, 500
+    
+    if not users:
+        print("❌ Database is empty")
+        return {'error': 'Face database is empty'}, 500
+    
+    # Extract face embedding
+    print("🔍 Extracting face embedding...")
+    deadline.check("detect")
+    try:
+        bbox = None
+        # Engine checked out only for detection + embedding (waits or 503 if all busy)
+        with pool.engine(deadline) as engine:
+            if 'aligned' in data:
+                emb = engine.embed_aligned_crop(image)
+            elif 'landmarks' in data:
+                emb = engine.embed_with_landmarks(
+                    image, data['landmarks'], scale=scale,
+                    full_res=lambda: base64_to_image(data['image'])
+                )
+            else:
+                # Full-size decode only if the face is too small to align from the
+                # reduced image. An 'roi' hint (e.g. the bbox from the previous
+                # response) limits detection to that region, full frame on a miss.
+                emb, bbox = engine.get_face(
+                    image, scale=scale,
+                    full_res=lambda: base64_to_image(data['image']),
+                    roi=data.get('roi'),
+                    checkpoint=deadline.check
+                )
+        if emb is None:
+            print("⚠️ No face detected in image")
+            return {
+                'success': False,
+                'message': 'No face detected in the image'
+            }, 200
+        print(f"✅ Face embedding extracted: shape {emb.shape}")
+    except (DeadlineExceeded, Overloaded):
+        raise
+    except FaceInputError as e:
+        print(f"⚠️ Rejected client-supplied face: {e}")
+        return {'error': f'Invalid face input: {e}'}, 400
+    except Exception as e:
+        print(f"❌ Failed to extract embedding: {e}")
+        import traceback
+        traceback.print_exc()
+        return {'error': f'Failed to extract face embedding: {str(e)}'}, 500
+    
+    # Find best match
+    print("🔎 Finding best match...")
+    deadline.check("match")
+    try:
+        threshold = data.get('threshold', 0.45)
+        username, score = db.match(emb, threshold=threshold)
+        print(f"🎯 Match result: username={username}, score={score}")
+    except ShardsUnavailable as e:
+        print(f"⚠️ Sharded match failed: {e}")
+        return {'error': f'Matching unavailable: {e}'}, 503
+    except Exception as e:
+        print(f"❌ Failed to find match: {e}")
+        import traceback
+        traceback.print_exc()
+        return {'error': f'Failed to find match: {str(e)}'}, 500
+    
+    if username is None:
+        print(f"⚠️ No match found (best score: {score})")
+        body = {
+            'success': False,
+            'message': f'No match found (best similarity = {score:.3f})',
+            'similarity': float(score)
+        }
+    else:
+        print(f"✅ Match found: {username} (similarity: {score})")
+        body = {
+            'success': True,
+            'username': username,
+            'similarity': float(score),
+            'message': f'Recognized user: {username} (similarity = {score:.3f})'
+        }
+    
+    # Face box in original image coordinates; clients can send it back as
+    # the next request's 'roi'
+    if bbox is not None:
+        body['bbox'] = [round(float(v), 1) for v in bbox[:4]]
+    return body, 200
+
+def embed_payload(data, binary=False, deadline=None):
+    """
+    Run the /embed pipeline on a parsed JSON body.
+    
+    Accepts 'images' (list of base64 images, largest face of each) or
+    'aligned' (list of 112x112 ArcFace-aligned crops), plus an optional
+    'dtype' of float32 (default) or float16. All faces are embedded in one
+    recognizer call. The embeddings are encoded with embedding_codec; with
+    binary=True the raw blob is returned, otherwise a dict carrying it as
+    base64.
+    
+    Returns (payload, status_code); 400 naming the first input that can't be
+    decoded. Raises DeadlineExceeded between images
+    and before the recognizer call once `deadline` has passed, Overloaded
+    if no pooled engine frees up in time.
+    """
+    from embedding_codec import DTYPES, encode_embeddings
+    from utils import MIN_FEATURE_NORM, aligned_crop_problem
+    
+    aligned_mode = 'aligned' in data
+    items = data.get('aligned') if aligned_mode else data.get('images', data.get('image'))
+    if isinstance(items, str):
+        items = [items]
+    if not items or not isinstance(items, list):
+        return {'error': 'No images provided'}, 400
+    if len(items) > MAX_EMBED_BATCH:
+        return {'error': f'Too many images (max {MAX_EMBED_BATCH} per request)'}, 400
+    
+    dtype = data.get('dtype', 'float32')
+    if dtype not in DTYPES:
+        return {'error': f'dtype must be one of {sorted(DTYPES)}'}, 400
+    
+    try:
+        pool = get_engine_pool()
+    except Exception as e:
+        print(f"❌ Failed to load face engine: {e}")
+        import traceback
+        traceback.print_exc()
+        return {'error': f'Failed to load face engine: {str(e)}'}, 500
+    
+    # Detect + align every input, then one batched recognizer call
+    deadline = deadline or Deadline.from_header(None)
+    with pool.engine(deadline) as engine:
+        crops = []
+        for index, item in enumerate(items):
+            deadline.check("detect")
+            if aligned_mode:
+                image = crop = base64_to_image(item)
+                if aligned_crop_problem(crop):
+                    crop = None
+            else:
+                image, scale = base64_to_image(item, target_size=DET_INPUT_SIZE)
+                crop = None
+                if image is not None:
+                    crop = engine.align_face(
+                        image, scale=scale,
+                        full_res=lambda item=item: base64_to_image(item)
+                    )[0]
+            if image is None:
+                # Not "no face": the blob has no way to say the input was bad
+                return {'error': f'Could not decode image {index}', 'index': index}, 400
+            crops.append(crop)
+    
+        found = [i for i, crop in enumerate(crops) if crop is not None]
+        deadline.check("embed")
+        embs, norms = engine.embed_batch([crops[i] for i in found], return_norms=True)
+    results = [None] * len(items)
+    for row, i in enumerate(found):
+        if aligned_mode and norms[row] < MIN_FEATURE_NORM:
+            continue
+        results[i] = embs[row]
+    print(f"🧬 Embedded {len(found)}/{len(items)} inputs ({dtype})")
+    
+    blob = encode_embeddings(results, dtype=dtype)
+    if binary:
+        return blob, 200
+    return {
+        'count': len(items),
+        'dim': 512,
+        'dtype': dtype,
+        'faces': [emb is not None for emb in results],
+        'embeddings': base64.b64encode(blob).decode('ascii')
+    }, 200
+
+def wants_binary(accept_header, data):
+    """Binary /embed response if asked for by Accept header or 'format'"""
+    from embedding_codec import CONTENT_TYPE
+    return CONTENT_TYPE in (accept_header or '') or data.get('format') == 'binary'
 
 @app.route('/', methods=['GET', 'HEAD', 'OPTIONS'])
 def index():
@@ -233,8 +712,10 @@ def index():
         'version': '1.0',
         'endpoints': {
             'health': '/health',
+            'ready': '/ready',
             'debug': '/debug',
-            'recognize': '/recognize (POST)'
+            'recognize': '/recognize (POST)',
+            'embed': '/embed (POST)'
         }
     })
 
@@ -251,6 +732,19 @@ def health():
     print(f"🏥 Health check - Method: {request.method}, Origin: {request.headers.get('Origin', 'None')}")
     return jsonify({'status': 'ok', 'message': 'Facial recognition API is running'})
 
+@app.route('/ready', methods=['GET', 'OPTIONS'])
+def ready():
+    """Readiness check - 200 once models and gallery are loaded, 503 before"""
+    if request.method == 'OPTIONS':
+        resp = make_response('', 204)
+        resp.headers['Access-Control-Allow-Origin'] = '*'
+        resp.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept'
+        return resp
+    
+    body, status = readiness_payload()
+    return jsonify(body), status
+
 @app.route('/debug', methods=['GET', 'POST', 'OPTIONS'])
 def debug():
     """Debug endpoint to test CORS"""
@@ -283,7 +777,7 @@ def recognize():
         resp = make_response('', 204)
         resp.headers['Access-Control-Allow-Origin'] = '*'  # Allow all origins
         resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept, Authorization'
+        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept, Authorization, X-Request-Timeout-Ms'
         resp.headers['Access-Control-Max-Age'] = '3600'
         print(f"   Returning 204 with CORS headers")
         return resp
@@ -304,87 +798,21 @@ def recognize():
         if not data:
             print("❌ No JSON data received")
             return jsonify({'error': 'No JSON data provided'}), 400
-            
-        if 'image' not in data:
-            print("❌ No image in JSON data")
-            return jsonify({'error': 'No image provided'}), 400
         
-        # Decode image
-        image = base64_to_image(data['image'])
-        if image is None:
-            return jsonify({'error': 'Failed to decode image'}), 400
-        
-        print(f"✅ Image decoded: {image.shape}")
-        
-        # Get face engine and database with error handling
-        print("🔧 Loading face engine...")
-        try:
-            engine = get_face_engine()
-            print("✅ Face engine loaded")
-        except Exception as e:
-            print(f"❌ Failed to load face engine: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f'Failed to load face engine: {str(e)}'}), 500
-        
-        print("📚 Loading face database...")
-        try:
-            db = get_face_db()
-            print(f"✅ Face database loaded ({len(db) if db else 0} users)")
-        except Exception as e:
-            print(f"❌ Failed to load database: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f'Failed to load database: {str(e)}'}), 500
-        
-        if not db:
-            print("❌ Database is empty")
-            return jsonify({'error': 'Face database is empty'}), 500
-        
-        # Extract face embedding
-        print("🔍 Extracting face embedding...")
-        try:
-            emb = engine.get_face_embedding(image)
-            if emb is None:
-                print("⚠️ No face detected in image")
-                return jsonify({
-                    'success': False,
-                    'message': 'No face detected in the image'
-                }), 200
-            print(f"✅ Face embedding extracted: shape {emb.shape}")
-        except Exception as e:
-            print(f"❌ Failed to extract embedding: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f'Failed to extract face embedding: {str(e)}'}), 500
-        
-        # Find best match
-        print("🔎 Finding best match...")
-        try:
-            threshold = data.get('threshold', 0.45)
-            username, score = find_best_match(emb, db, threshold=threshold)
-            print(f"🎯 Match result: username={username}, score={score}")
-        except Exception as e:
-            print(f"❌ Failed to find match: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f'Failed to find match: {str(e)}'}), 500
-        
-        if username is None:
-            print(f"⚠️ No match found (best score: {score})")
-            return jsonify({
-                'success': False,
-                'message': f'No match found (best similarity = {score:.3f})',
-                'similarity': float(score)
-            }), 200
-        
-        print(f"✅ Match found: {username} (similarity: {score})")
-        return jsonify({
-            'success': True,
-            'username': username,
-            'similarity': float(score),
-            'message': f'Recognized user: {username} (similarity = {score:.3f})'
-        }), 200
+        deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+        with admission.admit(deadline):
+            body, status = recognize_payload(data, deadline)
+        return jsonify(body), status
+    
+    except DeadlineExceeded as e:
+        print(f"⌛ Dropping /recognize: {e}")
+        body, status = expired_payload(e)
+        return jsonify(body), status
+    
+    except Overloaded as e:
+        print(f"⏳ Shedding /recognize: {e}")
+        body, status, headers = overloaded_payload(e)
+        return jsonify(body), status, headers
         
     except Exception as e:
         print(f"❌ Recognition error: {e}")
@@ -392,6 +820,64 @@ def recognize():
         traceback.print_exc()
         return jsonify({'error': str(e), 'type': type(e).__name__}), 500
 
+@app.route('/embed', methods=['POST', 'OPTIONS'])
+def embed():
+    """Return ArcFace embeddings for a batch of images, compactly encoded"""
+    if request.method == 'OPTIONS':
+        resp = make_response('', 204)
+        resp.headers['Access-Control-Allow-Origin'] = '*'
+        resp.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Accept, Authorization, X-Request-Timeout-Ms'
+        resp.headers['Access-Control-Max-Age'] = '3600'
+        return resp
+    
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
+        
+        binary = wants_binary(request.headers.get('Accept'), data)
+        deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+        with admission.admit(deadline):
+            payload, status = embed_payload(data, binary=binary, deadline=deadline)
+        if isinstance(payload, bytes):
+            from embedding_codec import CONTENT_TYPE
+            return Response(payload, status=status, mimetype=CONTENT_TYPE)
+        return jsonify(payload), status
+    
+    except DeadlineExceeded as e:
+        print(f"⌛ Dropping /embed: {e}")
+        body, status = expired_payload(e)
+        return jsonify(body), status
+    
+    except Overloaded as e:
+        print(f"⏳ Shedding /embed: {e}")
+        body, status, headers = overloaded_payload(e)
+        return jsonify(body), status, headers
+    
+    except Exception as e:
+        print(f"❌ Embedding error: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'type': type(e).__name__}), 500
+
+@app.route('/admin/profile', methods=['GET'])
+def admin_profile():
+    """Sample this worker's stacks for ?seconds= (requires ADMIN_TOKEN; 404 when unset)"""
+    from profiler import admin_token, profile_response
+    token = admin_token(request.headers.get('Authorization', ''),
+                        request.headers.get('X-Admin-Token', ''))
+    body, status, content_type = profile_response(request.args, token)
+    return Response(body, status=status, content_type=content_type)
+
+startup_ms = round((time.perf_counter() - _process_started) * 1000, 1)
+print(f"⏱️ api_server imported in {startup_ms} ms")
+
+# Under gunicorn/uvicorn, load models in the background so liveness checks
+# are answered right away; WARMUP_ON_START=0 keeps everything lazy.
+if __name__ != "__main__" and os.environ.get("WARMUP_ON_START", "1") != "0":
+    start_warmup()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     
@@ -442,4 +928,5 @@ if __name__ == "__main__":
     print("=" * 60)
     print()
     
+    start_warmup()
     app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
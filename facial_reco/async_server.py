@@ -0,0 +1,328 @@
+"""
+ASGI server for facial recognition - async front-end for the same endpoints
+
+Serves `/`, `/health`, `/ready`, `/recognize` and `/embed` like api_server.py, but request bodies
+are received on the event loop and the CPU-bound FaceEngine work runs on a
+bounded thread pool, so health checks and OPTIONS preflights stay responsive
+while inference saturates the CPUs.
+
+Run with:
+    uvicorn async_server:app --workers 2 --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the facial_reco directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from admission import (DEADLINE_HEADER, AdmissionController, Deadline,
+                       DeadlineExceeded, Overloaded)
+from api_server import (embed_payload, expired_payload, overloaded_payload,
+                        readiness_payload, recognize_payload, wants_binary)
+
+# Number of threads running decode + inference per process. ONNX Runtime and
+# OpenCV release the GIL, so these run truly in parallel.
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", os.cpu_count() or 2))
+# Reject bodies larger than this before buffering them completely.
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", 16 * 1024 * 1024))
+
+# One in-flight slot per inference thread by default; MAX_QUEUE bounds what may
+# wait in the executor queue, the rest is shed with 503 before the body is read
+admission = AdmissionController.from_env(default_inflight=INFERENCE_THREADS)
+# run_admitted doesn't wait for a slot (that would park an executor thread),
+# so the pool size is what enforces MAX_INFLIGHT
+inference_executor = ThreadPoolExecutor(max_workers=max(1, admission.max_inflight),
+                                        thread_name_prefix="inference")
+
+CORS_HEADERS = {
+    b"access-control-allow-origin": b"*",
+    b"access-control-allow-headers": b"Content-Type, Accept, Authorization, X-Request-Timeout-Ms",
+    b"access-control-allow-methods": b"GET, POST, OPTIONS, PUT, DELETE",
+    b"access-control-max-age": b"3600",
+    b"access-control-expose-headers": b"Retry-After",
+}
+
+
+async def send_response(send, status, body=b"", content_type=b"application/json",
+                        extra_headers=None):
+    """Send a complete HTTP response with the CORS headers attached."""
+    merged = dict(CORS_HEADERS)
+    merged.update(extra_headers or {})
+    if status != 204:
+        merged[b"content-type"] = content_type
+    merged[b"content-length"] = str(len(body)).encode()
+    headers = list(merged.items())
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, payload, status=200, extra_headers=None):
+    await send_response(send, status, json.dumps(payload).encode("utf-8"),
+                        extra_headers=extra_headers)
+
+
+def encode_headers(headers):
+    """{'Retry-After': '3'} -> ASGI header dict (or None)."""
+    if not headers:
+        return None
+    return {k.lower().encode("latin-1"): str(v).encode("latin-1") for k, v in headers.items()}
+
+
+async def send_preflight(send, methods):
+    await send_response(send, 204, extra_headers={
+        b"access-control-allow-methods": methods,
+    })
+
+
+async def read_body(receive, limit=MAX_BODY_BYTES):
+    """
+    Receive the request body chunk by chunk without blocking the event loop.
+
+    Returns the body bytes, or None if it exceeds `limit` or the client
+    disconnected mid-upload.
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def handle_recognize_body(body, deadline):
+    """Parse a /recognize body and run the shared pipeline (executor thread)."""
+    try:
+        data = json.loads(body) if body else None
+    except (ValueError, UnicodeDecodeError):
+        data = None
+    if not data or not isinstance(data, dict):
+        print("❌ No JSON data received")
+        return {'error': 'No JSON data provided'}, 400
+    try:
+        return recognize_payload(data, deadline)
+    except (DeadlineExceeded, Overloaded):
+        raise
+    except Exception as e:
+        print(f"❌ Recognition error: {e}")
+        traceback.print_exc()
+        return {'error': str(e), 'type': type(e).__name__}, 500
+
+
+def handle_embed_body(body, accept, deadline):
+    """Parse an /embed body and run the shared pipeline (executor thread)."""
+    try:
+        data = json.loads(body) if body else None
+    except (ValueError, UnicodeDecodeError):
+        data = None
+    if not data or not isinstance(data, dict):
+        return {'error': 'No JSON data provided'}, 400
+    try:
+        return embed_payload(data, binary=wants_binary(accept, data), deadline=deadline)
+    except (DeadlineExceeded, Overloaded):
+        raise
+    except Exception as e:
+        print(f"❌ Embedding error: {e}")
+        traceback.print_exc()
+        return {'error': str(e), 'type': type(e).__name__}, 500
+
+
+def run_admitted(ticket, deadline, handler, *args):
+    """
+    Executor thread: start the reserved request unless it waited too long
+    or its deadline passed in the queue, then run handler(*args, deadline).
+    """
+    try:
+        started = admission.begin(ticket, deadline=deadline)
+    except Overloaded as e:
+        print(f"⏳ Shedding request: {e}")
+        return overloaded_payload(e)
+    except DeadlineExceeded as e:
+        print(f"⌛ Dropping request: {e}")
+        return (*expired_payload(e), None)
+    try:
+        return (*handler(*args, deadline), None)
+    except DeadlineExceeded as e:
+        print(f"⌛ Dropping request: {e}")
+        return (*expired_payload(e), None)
+    except Overloaded as e:
+        # No pooled engine freed up in time
+        print(f"⏳ Shedding request: {e}")
+        return overloaded_payload(e)
+    finally:
+        admission.release(started)
+
+
+async def send_overloaded(send, e):
+    payload, status, headers = overloaded_payload(e)
+    await send_json(send, payload, status, extra_headers=encode_headers(headers))
+
+
+def header(scope, name):
+    """First value of a request header, decoded, or ''."""
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+async def index(scope, receive, send):
+    method = scope["method"]
+    if method == "OPTIONS":
+        return await send_preflight(send, b"GET, HEAD, OPTIONS")
+    if method == "HEAD":
+        return await send_response(send, 200)
+    if method != "GET":
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+    await send_json(send, {
+        'status': 'ok',
+        'message': 'Facial Recognition API',
+        'version': '1.0',
+        'endpoints': {
+            'health': '/health',
+            'ready': '/ready',
+            'recognize': '/recognize (POST)',
+            'embed': '/embed (POST)'
+        }
+    })
+
+
+async def health(scope, receive, send):
+    method = scope["method"]
+    if method == "OPTIONS":
+        return await send_preflight(send, b"GET, OPTIONS")
+    if method != "GET":
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+    await send_json(send, {'status': 'ok', 'message': 'Facial recognition API is running'})
+
+
+async def ready(scope, receive, send):
+    method = scope["method"]
+    if method == "OPTIONS":
+        return await send_preflight(send, b"GET, OPTIONS")
+    if method != "GET":
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+    payload, status = readiness_payload(admission)
+    await send_json(send, payload, status)
+
+
+async def recognize(scope, receive, send):
+    method = scope["method"]
+    if method == "OPTIONS":
+        return await send_preflight(send, b"POST, OPTIONS")
+    if method != "POST":
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+
+    deadline = Deadline.from_header(header(scope, DEADLINE_HEADER.lower().encode()) or None)
+    try:
+        ticket = admission.reserve()
+    except Overloaded as e:
+        return await send_overloaded(send, e)
+    body = await read_body(receive)
+    if body is None:
+        admission.cancel(ticket)
+        return await send_json(send, {'error': 'Request body too large or incomplete'}, 413)
+
+    loop = asyncio.get_running_loop()
+    payload, status, headers = await loop.run_in_executor(
+        inference_executor, run_admitted, ticket, deadline, handle_recognize_body, body)
+    await send_json(send, payload, status, extra_headers=encode_headers(headers))
+
+
+async def embed(scope, receive, send):
+    method = scope["method"]
+    if method == "OPTIONS":
+        return await send_preflight(send, b"POST, OPTIONS")
+    if method != "POST":
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+
+    deadline = Deadline.from_header(header(scope, DEADLINE_HEADER.lower().encode()) or None)
+    try:
+        ticket = admission.reserve()
+    except Overloaded as e:
+        return await send_overloaded(send, e)
+    body = await read_body(receive)
+    if body is None:
+        admission.cancel(ticket)
+        return await send_json(send, {'error': 'Request body too large or incomplete'}, 413)
+
+    loop = asyncio.get_running_loop()
+    payload, status, headers = await loop.run_in_executor(
+        inference_executor, run_admitted, ticket, deadline, handle_embed_body,
+        body, header(scope, b"accept"))
+    if isinstance(payload, bytes):
+        from embedding_codec import CONTENT_TYPE
+        return await send_response(send, status, payload,
+                                   content_type=CONTENT_TYPE.encode("latin-1"))
+    await send_json(send, payload, status, extra_headers=encode_headers(headers))
+
+
+async def admin_profile(scope, receive, send):
+    if scope["method"] != "GET":
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+    from urllib.parse import parse_qsl
+    from profiler import admin_token, profile_response
+    params = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    token = admin_token(header(scope, b"authorization"), header(scope, b"x-admin-token"))
+    # Sample from the loop's default executor, not an inference thread
+    loop = asyncio.get_running_loop()
+    body, status, content_type = await loop.run_in_executor(None, profile_response, params, token)
+    await send_response(send, status, body, content_type=content_type.encode())
+
+
+ROUTES = {
+    "/": index,
+    "/health": health,
+    "/ready": ready,
+    "/recognize": recognize,
+    "/embed": embed,
+    "/admin/profile": admin_profile,
+}
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            print(f"🚀 Async API ready ({max(1, admission.max_inflight)} inference threads)")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            inference_executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        return await lifespan(scope, receive, send)
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get(scope["path"].rstrip("/") or "/")
+    if handler is None:
+        return await send_json(send, {'error': 'Not found'}, 404)
+    try:
+        await handler(scope, receive, send)
+    except Exception as e:
+        print(f"❌ ERROR CAUGHT: {str(e)}")
+        traceback.print_exc()
+        await send_json(send, {'error': str(e)}, 500)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    port = int(os.environ.get("PORT", 5000))
+    print(f"\n🌐 Async API will be available at http://0.0.0.0:{port}")
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
@@ -0,0 +1,104 @@
+"""
+Benchmark reduced-precision gallery matching against exact float32
+
+Builds a synthetic gallery with ArcFace-like structure (identities share a
+low-rank component, so impostor similarities spread around 0.1-0.4 instead of
+being orthogonal), then compares utils.QuantizedGallery (int8 scan + exact
+re-rank, mmap'd as in the API via shared_gallery.open_quantized) with the
+exact Gallery, whose results are first checked against find_best_match
+itself.
+
+Usage:
+    python bench_gallery.py --users 200000 --queries 2000 --candidates 32
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from shared_gallery import open_quantized
+from utils import Gallery, find_best_match
+
+
+def synthetic_gallery(users, dim, rank, seed):
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((rank, dim)).astype(np.float32)
+    shared = rng.standard_normal((users, rank)).astype(np.float32) @ basis / np.sqrt(rank)
+    own = rng.standard_normal((users, dim)).astype(np.float32)
+    matrix = 0.8 * shared + own
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return [f"user{i}" for i in range(users)], matrix.astype(np.float32)
+
+
+def synthetic_queries(matrix, count, seed):
+    """Half genuine (target similarity ~0.35-0.8 to one user), half impostors."""
+    rng = np.random.default_rng(seed + 1)
+    users, dim = matrix.shape
+    targets = rng.integers(0, users, count)
+    noise = rng.standard_normal((count, dim)).astype(np.float32)
+    noise /= np.linalg.norm(noise, axis=1, keepdims=True)
+    cos = rng.uniform(0.35, 0.8, count).astype(np.float32)[:, None]
+    queries = cos * matrix[targets] + np.sqrt(1 - cos ** 2) * noise
+    impostor = np.arange(count) % 2 == 1
+    queries[impostor] = noise[impostor]
+    return queries.astype(np.float32)
+
+
+def timed_matches(gallery, queries, threshold):
+    started = time.perf_counter()
+    results = [gallery.match(q, threshold=threshold) for q in queries]
+    return results, (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--rank", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--candidates", type=int, default=32)
+    parser.add_argument("--threshold", type=float, default=0.45)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    usernames, matrix = synthetic_gallery(args.users, args.dim, args.rank, args.seed)
+    queries = synthetic_queries(matrix, args.queries, args.seed)
+    exact = Gallery(usernames, matrix)
+
+    # The vectorized Gallery must agree with the reference implementation
+    check_users = min(args.users, 2000)
+    db = {usernames[i]: {"embedding": matrix[i].tolist()} for i in range(check_users)}
+    small = Gallery(usernames[:check_users], matrix[:check_users])
+    for q in queries[:50]:
+        ref_user, ref_sim = find_best_match(q, db, threshold=args.threshold)
+        user, sim = small.match(q, threshold=args.threshold)
+        assert user == ref_user and abs(sim - ref_sim) < 1e-4, (user, ref_user, sim, ref_sim)
+
+    truth, exact_ms = timed_matches(exact, queries, threshold=-1.0)
+    truth_users = [u for u, _ in truth]
+    truth_sims = np.array([s for _, s in truth])
+    accepted = truth_sims >= args.threshold
+
+    print(f"Gallery: {args.users} users x {args.dim} dims, {args.queries} queries "
+          f"({accepted.sum()} above threshold {args.threshold})")
+    print(f"{'mode':<10}{'scan MB':>10}{'ms/query':>10}{'recall@1':>10}"
+          f"{'decision':>10}{'max |dsim|':>12}")
+    print(f"{'float32':<10}{matrix.nbytes / 2**20:>10.1f}{exact_ms:>10.2f}"
+          f"{1.0:>10.4f}{1.0:>10.4f}{0.0:>12.2e}")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        quantized = open_quantized(exact, cache_dir, args.candidates)
+        results, ms = timed_matches(quantized, queries, threshold=-1.0)
+        users = [u for u, _ in results]
+        sims = np.array([s for _, s in results])
+        recall = np.mean([u == t for u, t in zip(users, truth_users)])
+        decision = np.mean((sims >= args.threshold) == accepted)
+        err = np.max(np.abs(sims - truth_sims))
+        print(f"{'int8':<10}{quantized.nbytes / 2**20:>10.1f}{ms:>10.2f}"
+              f"{recall:>10.4f}{decision:>10.4f}{err:>12.2e}")
+        del quantized
+
+
+if __name__ == "__main__":
+    main()
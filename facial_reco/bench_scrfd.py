@@ -0,0 +1,188 @@
+"""
+Benchmark SCRFD post-processing: insightface RetinaFace.detect vs scrfd_fast
+
+No model file is needed: a fake ONNX session returns SCRFD-10G-shaped outputs
+(9 outputs, strides 8/16/32, 2 anchors, landmarks) with low-score noise
+everywhere and a cluster of confident anchors around each synthetic face.
+The outputs are computed once per input size. The session stamps the time
+run() returns, so "post ms" is exactly the work after the network: decoding,
+sorting, NMS and the largest-face pick. "total ms" adds the preprocessing
+(resize, pad, blobFromImage), which is the same code in both.
+
+insightface's model_zoo.get_model() loads SCRFD .onnx files as
+model_zoo.retinaface.RetinaFace, so that is the reference by default;
+--detector scrfd uses scrfd.SCRFD instead. Results of FastSCRFD.detect and
+detect_largest are checked against its detect() (and FaceEngine's
+largest-area pick) before timing.
+
+Usage:
+    python bench_scrfd.py --input-size 640 --faces 1 --frames 500
+    python bench_scrfd.py --input-size 320 --faces 3 --detector scrfd
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from scrfd_fast import FastSCRFD
+
+STRIDES = (8, 16, 32)
+ANCHORS = 2
+
+
+class FakeSession:
+    """Just enough of onnxruntime.InferenceSession for insightface's RetinaFace / SCRFD."""
+
+    def __init__(self, faces, seed=0):
+        self.faces = faces
+        self.seed = seed
+        self._outputs = {}
+
+    def set_providers(self, providers):
+        pass
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input.1", shape=[1, 3, "?", "?"])]
+
+    def get_outputs(self):
+        # scores, then boxes, then landmarks, one per stride; 2-D (not batched)
+        return [SimpleNamespace(name=f"out{i}", shape=["?", 1]) for i in range(9)]
+
+    def synthesize(self, height, width):
+        rng = np.random.default_rng(self.seed)
+        scores, boxes, kpss = [], [], []
+        for stride in STRIDES:
+            h, w = height // stride, width // stride
+            centers = np.stack(np.mgrid[:h, :w][::-1], axis=-1).reshape(-1, 2)
+            centers = np.repeat(centers, ANCHORS, axis=0).astype(np.float32) * stride
+            n = len(centers)
+            score = rng.uniform(0.0, 0.3, (n, 1)).astype(np.float32)
+            box = rng.uniform(0.5, 3.0, (n, 4)).astype(np.float32)
+            kps = rng.uniform(-2.0, 2.0, (n, 10)).astype(np.float32)
+            for x1, y1, x2, y2 in self.faces(height, width):
+                cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+                # Anchors near the face centre fire, more on strides that fit the face
+                near = (np.abs(centers[:, 0] - cx) < (x2 - x1) / 8) & \
+                       (np.abs(centers[:, 1] - cy) < (y2 - y1) / 8)
+                fit = np.exp(-abs(np.log((x2 - x1) / (stride * 8))))
+                score[near, 0] = np.maximum(score[near, 0],
+                                            np.clip(0.3 + 0.6 * fit + rng.normal(0, 0.05, near.sum()),
+                                                    0, 1))
+                c = centers[near]
+                jitter = rng.normal(0, 2.0, (len(c), 4))
+                box[near] = (np.stack([c[:, 0] - x1, c[:, 1] - y1, x2 - c[:, 0], y2 - c[:, 1]], 1)
+                             + jitter) / stride
+                template = np.array([[0.34, 0.46], [0.66, 0.46], [0.5, 0.64],
+                                     [0.37, 0.82], [0.63, 0.82]], np.float32)
+                points = template * [x2 - x1, y2 - y1] + [x1, y1]
+                kps[near] = ((points[None] - c[:, None]).reshape(len(c), 10)
+                             + rng.normal(0, 1.0, (len(c), 10))) / stride
+            scores.append(score)
+            boxes.append(box)
+            kpss.append(kps)
+        return scores + boxes + kpss
+
+    def run(self, output_names, feeds):
+        blob = next(iter(feeds.values()))
+        key = blob.shape[2:]
+        if key not in self._outputs:
+            self._outputs[key] = self.synthesize(*key)
+        # Keep the blob alive so freeing it isn't counted as post-processing
+        self.last_feeds = feeds
+        self.returned = time.perf_counter()
+        return self._outputs[key]
+
+
+def face_layout(count):
+    """Boxes (in network input pixels) for `count` faces of decreasing size."""
+    def faces(height, width):
+        boxes = []
+        for i in range(count):
+            side = min(height, width) * 0.45 / (i + 1)
+            x1 = width * (0.1 + 0.8 * i / max(count, 1))
+            y1 = height * 0.15
+            boxes.append((x1, y1, min(x1 + side, width - 1), y1 + side))
+        return boxes
+    return faces
+
+
+def insightface_detector(name, session):
+    """The insightface class FaceEngine would get for an SCRFD model ("retinaface"), or scrfd.SCRFD."""
+    if name == "scrfd":
+        from insightface.model_zoo.scrfd import SCRFD
+        return SCRFD(session=session)
+    from insightface.model_zoo.retinaface import RetinaFace
+    return RetinaFace(session=session)
+
+
+def largest(dets, kpss):
+    if len(dets) == 0:
+        return None, None
+    areas = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+    idx = int(np.argmax(areas))
+    return dets[idx], kpss[idx]
+
+
+def per_frame_ms(fn, session, frames):
+    """Median (total, post-processing) ms per call."""
+    fn()
+    totals, posts = [], []
+    for _ in range(frames):
+        started = time.perf_counter()
+        fn()
+        ended = time.perf_counter()
+        totals.append(ended - started)
+        posts.append(ended - session.returned)
+    return np.median(totals) * 1000, np.median(posts) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--input-size", type=int, default=640)
+    parser.add_argument("--image-size", default="480x640", help="HxW of the frame")
+    parser.add_argument("--faces", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--detector", choices=("retinaface", "scrfd"), default="retinaface",
+                        help="insightface class to compare against (get_model loads retinaface)")
+    args = parser.parse_args()
+
+    session = FakeSession(face_layout(args.faces), args.seed)
+    model = insightface_detector(args.detector, session)
+    model.prepare(-1, input_size=(args.input_size, args.input_size), det_thresh=0.5)
+    fast = FastSCRFD(model)
+
+    height, width = (int(v) for v in args.image_size.lower().split("x"))
+    frame = np.random.default_rng(args.seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    size = (args.input_size, args.input_size)
+
+    ref_dets, ref_kpss = model.detect(frame, input_size=size, max_num=0)
+    dets, kpss = fast.detect(frame, input_size=size)
+    assert len(ref_dets) == len(dets) == args.faces, (len(ref_dets), len(dets))
+    assert np.allclose(ref_dets, dets, atol=1e-3) and np.allclose(ref_kpss, kpss, atol=1e-3)
+    ref_box, ref_kps = largest(ref_dets, ref_kpss)
+    box, kps = fast.detect_largest(frame, input_size=size)
+    if ref_box is None:
+        assert box is None and kps is None
+    else:
+        assert np.allclose(ref_box, box, atol=1e-3) and np.allclose(ref_kps, kps, atol=1e-3)
+
+    candidates = len(fast._run(frame, size)[0])
+    anchors = sum(len(c) for _, c in fast.anchor_centers(size))
+    print(f"{type(model).__name__} {size[0]}x{size[1]}, frame {height}x{width}: {anchors} anchors, "
+          f"{candidates} above det_thresh, {args.faces} face(s) after NMS - outputs match")
+
+    rows = [
+        ("insightface detect + largest", lambda: largest(*model.detect(frame, input_size=size))),
+        ("FastSCRFD.detect + largest", lambda: largest(*fast.detect(frame, input_size=size))),
+        ("FastSCRFD.detect_largest", lambda: fast.detect_largest(frame, input_size=size)),
+    ]
+    print(f"{'':<30}{'total ms':>10}{'post ms':>10}")
+    for name, fn in rows:
+        total, post = per_frame_ms(fn, session, args.frames)
+        print(f"{name:<30}{total:>10.3f}{post:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compact binary encoding for batches of face embeddings
+
+Used by the /embed endpoint so other services can take ArcFace vectors
+without JSON float lists. Layout (little-endian):
+
+    offset  size   field
+    0       4      magic b"MQEM"
+    4       1      version (1)
+    5       1      dtype code: 1 = float32, 2 = float16
+    6       2      reserved (0)
+    8       4      count  - number of inputs in the batch
+    12      4      dim    - embedding dimension (512 for w600k_r50)
+    16      count  present flags, 1 byte per input (0 = no face found)
+    ...            zero padding up to a multiple of 4 bytes
+    ...            count x dim values; rows without a face are all zero
+
+Vectors are L2-normalized, so float16 keeps cosine similarities to ~1e-3.
+
+Decoding with numpy only:
+    matrix, present = decode_embeddings(blob)
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b"MQEM"
+VERSION = 1
+HEADER = struct.Struct("<4sBBHII")
+
+DTYPES = {
+    "float32": (1, np.dtype("<f4")),
+    "float16": (2, np.dtype("<f2")),
+}
+_CODES = {code: dtype for code, dtype in DTYPES.values()}
+
+CONTENT_TYPE = "application/octet-stream"
+
+
+def encode_embeddings(embeddings, dtype="float32", dim=512):
+    """
+    Encode a list of embeddings (each array-like of `dim` values, or None
+    when no face was found) into the binary format above.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {sorted(DTYPES)}")
+    code, np_dtype = DTYPES[dtype]
+    count = len(embeddings)
+
+    matrix = np.zeros((count, dim), dtype=np_dtype)
+    present = np.zeros(count, dtype=np.uint8)
+    for i, emb in enumerate(embeddings):
+        if emb is None:
+            continue
+        matrix[i] = np.asarray(emb, dtype=np.float32).ravel()
+        present[i] = 1
+
+    padding = (-count) % 4
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, code, 0, count, dim),
+        present.tobytes(),
+        b"\0" * padding,
+        matrix.tobytes(),
+    ])
+
+
+def decode_embeddings(blob):
+    """
+    Decode the binary format. Returns ((count, dim) float32 matrix,
+    boolean present mask).
+    """
+    magic, version, code, _, count, dim = HEADER.unpack_from(blob, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not an embedding blob")
+    if code not in _CODES:
+        raise ValueError(f"Unknown dtype code {code}")
+    offset = HEADER.size
+    present = np.frombuffer(blob, dtype=np.uint8, count=count, offset=offset).astype(bool)
+    offset += count + (-count) % 4
+    matrix = np.frombuffer(blob, dtype=_CODES[code], count=count * dim, offset=offset)
+    return matrix.reshape(count, dim).astype(np.float32), present
@@ -0,0 +1,124 @@
+"""
+Pool of FaceEngine instances for multi-threaded workers
+
+A worker serving several requests at once either shares one engine - every
+ONNX Runtime session then runs its intra-op pool over all cores, and
+concurrent requests fight over them - or gives each concurrent request its
+own engine with a share of the cores:
+
+    ENGINE_POOL_SIZE=4 ENGINE_INTRA_OP_THREADS=2   # 8 cores, 4 requests at once
+
+Each engine can be checked out by at most ENGINE_SLOTS requests at a time
+(default 1 with several engines; with a single engine, one per core as
+before). A request that finds no free slot waits up to
+ENGINE_CHECKOUT_TIMEOUT seconds (or its deadline) and is then shed with
+admission.Overloaded, i.e. 503 + Retry-After.
+
+    pool = EnginePool.from_env(lambda threads: FaceEngine(..., intra_op_threads=threads))
+    with pool.engine(deadline) as engine:
+        emb, bbox = engine.get_face(img)
+
+All engines are built when the pool is created; create it once per process
+(api_server does so under engine_lock).
+"""
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from admission import Overloaded
+
+
+class EnginePool:
+    """`size` engines, each checked out by at most `slots` requests at a time."""
+
+    def __init__(self, factory, size=1, slots=1, intra_op_threads=0, checkout_timeout=30.0):
+        self.size = max(1, size)
+        self.slots = max(1, slots)
+        self.intra_op_threads = intra_op_threads
+        self.checkout_timeout = checkout_timeout
+        started = time.perf_counter()
+        self.engines = [factory(intra_op_threads) for _ in range(self.size)]
+        print(f"🧠 Engine pool: {self.size} x {self.slots} slot(s), "
+              f"{intra_op_threads or 'default'} ORT threads each "
+              f"({(time.perf_counter() - started) * 1000:.0f} ms)")
+        self._cond = threading.Condition()
+        self._active = [0] * self.size
+        self.waiting = 0
+        self.checkouts = 0
+        self.waited = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_env(cls, factory):
+        """ENGINE_POOL_SIZE, ENGINE_SLOTS, ENGINE_INTRA_OP_THREADS, ENGINE_CHECKOUT_TIMEOUT."""
+        cores = os.cpu_count() or 1
+        size = max(1, int(os.environ.get("ENGINE_POOL_SIZE", 1)))
+        slots = int(os.environ.get("ENGINE_SLOTS", 1 if size > 1 else cores))
+        # A single engine keeps ORT's default; several split the cores
+        threads = int(os.environ.get("ENGINE_INTRA_OP_THREADS",
+                                     0 if size == 1 else max(1, cores // size)))
+        return cls(factory, size=size, slots=slots, intra_op_threads=threads,
+                   checkout_timeout=float(os.environ.get("ENGINE_CHECKOUT_TIMEOUT", 30.0)))
+
+    def checkout(self, deadline=None):
+        """Index of the least busy engine with a free slot; waits for one if needed."""
+        timeout = self.checkout_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline.remaining())
+        until = time.monotonic() + timeout
+        with self._cond:
+            index = min(range(self.size), key=self._active.__getitem__)
+            if self._active[index] >= self.slots:
+                self.waited += 1
+                self.waiting += 1
+                try:
+                    while self._active[index] >= self.slots:
+                        remaining = until - time.monotonic()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            if deadline is not None:
+                                deadline.check("engine")
+                            raise Overloaded(1, "no free engine")
+                        self._cond.wait(remaining)
+                        index = min(range(self.size), key=self._active.__getitem__)
+                finally:
+                    self.waiting -= 1
+            self._active[index] += 1
+            self.checkouts += 1
+        return index
+
+    def checkin(self, index):
+        with self._cond:
+            self._active[index] -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def engine(self, deadline=None):
+        """Check an engine out for the duration of the block."""
+        index = self.checkout(deadline)
+        try:
+            yield self.engines[index]
+        finally:
+            self.checkin(index)
+
+    def stats(self):
+        """FaceEngine.stats summed over the pool's engines."""
+        total = Counter()
+        for engine in self.engines:
+            total.update(getattr(engine, "stats", {}))
+        return dict(total)
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "slots": self.slots,
+                "intra_op_threads": self.intra_op_threads,
+                "active": list(self._active),
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "waited": self.waited,
+                "timed_out": self.timed_out,
+            }
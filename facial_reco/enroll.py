@@ -0,0 +1,224 @@
+"""
+Bulk offline enrollment from image folders
+
+Enrolls every user found in a directory tree laid out as
+
+    photos/
+        alice/  001.jpg 002.jpg ...
+        bob/    ...
+
+Users are processed in parallel by a process pool; each worker loads its own
+FaceEngine once and embeds a user's aligned faces in batched recognizer calls.
+Finished users are appended to a checkpoint file as they complete, so an
+interrupted run picks up where it stopped. The database is written once, at
+the end, with an atomic replace - or, with --store, each user is committed to
+the SQLite gallery store as soon as it finishes.
+
+Usage:
+    python enroll.py photos/ --db database.json --workers 4
+    python enroll.py photos/ --aggregate cluster --min-samples 5
+    python enroll.py photos/ --store gallery.db
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from register import load_db, save_db
+from utils import MIN_FEATURE_NORM, average_embeddings, decode_image, pool_worker_engine
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Per-process engine, created by the pool initializer
+_engine = None
+
+
+def list_users(root):
+    """Returns {username: [image paths]} for every sub-directory of root."""
+    users = {}
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            continue
+        images = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                  if f.lower().endswith(IMAGE_EXTENSIONS)]
+        if images:
+            users[name] = images
+    return users
+
+
+def aggregate(embeddings, method="mean", outlier_sim=0.4):
+    """
+    Combine a user's (N, 512) embeddings into one normalized template.
+
+    "mean" averages everything. "cluster" first drops samples whose cosine
+    similarity to the medoid (the sample closest to all others) is below
+    outlier_sim - mislabeled photos, other people in group shots - and
+    averages the rest. Returns (template, samples used).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if method == "cluster" and len(embeddings) > 2:
+        sims = embeddings @ embeddings.T
+        medoid = embeddings[int(np.argmax(sims.sum(axis=1)))]
+        embeddings = embeddings[embeddings @ medoid >= outlier_sim]
+    return average_embeddings(list(embeddings)), len(embeddings)
+
+
+def _init_worker(detector_path, recognizer_path, ctx_id):
+    global _engine
+    _engine = pool_worker_engine(detector_path, recognizer_path, ctx_id)
+
+
+def _read_image(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    img, scale = decode_image(data)
+    return img, scale, lambda: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def embed_user(username, paths, batch_size=16, min_feature_norm=MIN_FEATURE_NORM):
+    """
+    Runs in a worker: align the largest face of every image, embed the crops
+    batch_size at a time. Returns (username, list of embeddings, stats).
+    """
+    stats = {"images": len(paths), "unreadable": 0, "no_face": 0, "low_quality": 0}
+    embeddings = []
+    crops = []
+
+    def flush():
+        embs, norms = _engine.embed_batch(crops, return_norms=True)
+        for emb, norm in zip(embs, norms):
+            if norm < min_feature_norm:
+                stats["low_quality"] += 1
+            else:
+                embeddings.append(emb.tolist())
+        crops.clear()
+
+    for path in paths:
+        try:
+            img, scale, full_res = _read_image(path)
+        except OSError:
+            img = None
+        if img is None:
+            stats["unreadable"] += 1
+            continue
+        crop, _ = _engine.align_face(img, scale=scale, full_res=full_res)
+        if crop is None:
+            stats["no_face"] += 1
+            continue
+        crops.append(crop)
+        if len(crops) >= batch_size:
+            flush()
+    if crops:
+        flush()
+    return username, embeddings, stats
+
+
+def load_checkpoint(path):
+    """Returns {username: checkpoint entry} for users finished by an earlier run."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            done[entry["username"]] = entry
+    return done
+
+
+def make_record(embeddings, args):
+    template, used = aggregate(embeddings, args.aggregate, args.outlier_sim)
+    if template is None or used < args.min_samples:
+        return None
+    return {
+        "embedding": template.tolist(),
+        "model": "w600k_r50",
+        "detector": "scrfd_10g_bnkps",
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "samples": used,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk enrollment from username/*.jpg folders")
+    parser.add_argument("root", help="directory with one sub-directory of images per user")
+    parser.add_argument("--db", default="database.json")
+    parser.add_argument("--store", default=None,
+                        help="SQLite gallery store to write to instead of --db")
+    parser.add_argument("--checkpoint", default=None,
+                        help="progress file (default: <db or store>.enroll.jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch", type=int, default=16, help="crops per recognizer call")
+    parser.add_argument("--aggregate", choices=("mean", "cluster"), default="mean")
+    parser.add_argument("--outlier-sim", type=float, default=0.4,
+                        help="with --aggregate cluster, drop samples below this similarity")
+    parser.add_argument("--min-samples", type=int, default=1)
+    parser.add_argument("--overwrite", action="store_true",
+                        help="re-enroll users already present in the database")
+    parser.add_argument("--detector", default="models/scrfd_10g_bnkps.onnx")
+    parser.add_argument("--recognizer", default="models/w600k_r50.onnx")
+    parser.add_argument("--ctx-id", type=int, default=0)
+    args = parser.parse_args()
+
+    target = args.store or args.db
+    checkpoint_path = args.checkpoint or target + ".enroll.jsonl"
+    users = list_users(args.root)
+    if args.store:
+        from gallery_store import GalleryStore
+        store = db = GalleryStore(args.store)
+    else:
+        store, db = None, load_db(args.db)
+    done = load_checkpoint(checkpoint_path)
+
+    todo = {u: paths for u, paths in users.items()
+            if u not in done and (args.overwrite or u not in db)}
+    skipped = len(users) - len(todo) - len([u for u in done if u in users])
+    print(f"📂 {len(users)} users in {args.root}: {len(todo)} to process, "
+          f"{len(done)} from checkpoint, {skipped} already enrolled")
+
+    started = time.perf_counter()
+    images = 0
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                initargs=(args.detector, args.recognizer, args.ctx_id)) as pool:
+        futures = [pool.submit(embed_user, u, paths, args.batch) for u, paths in todo.items()]
+        for n, future in enumerate(as_completed(futures), 1):
+            username, embeddings, stats = future.result()
+            record = make_record(embeddings, args)
+            if store is not None and record:
+                store.put(username, record)
+            entry = {"username": username, "record": record, "stats": stats}
+            checkpoint.write(json.dumps(entry) + "\n")
+            checkpoint.flush()
+            done[username] = entry
+
+            images += stats["images"]
+            rate = images / max(time.perf_counter() - started, 1e-9)
+            status = f"✅ {record['samples']} samples" if record else "⚠️ not enrolled"
+            print(f"[{n}/{len(todo)}] {username}: {status} "
+                  f"(no face {stats['no_face']}, low quality {stats['low_quality']}, "
+                  f"unreadable {stats['unreadable']}) - {rate:.1f} img/s", flush=True)
+
+    enrolled = {u: e["record"] for u, e in done.items() if e.get("record") and u in users}
+    failed = sorted(u for u, e in done.items() if not e.get("record") and u in users)
+    if store is None:
+        db.update(enrolled)
+        save_db(db, args.db)
+    os.remove(checkpoint_path)
+
+    print(f"✅ Enrolled {len(enrolled)} users into {target} ({len(db)} total)")
+    if failed:
+        print(f"⚠️ Not enrolled (too few usable faces): {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Duplicate and collision audit of the gallery
+
+Computes the similarity of every enrolled user to every other one, in blocks
+of the normalized embedding matrix (S = A @ B.T per block pair, upper
+triangle only). Row blocks are processed by a thread pool; each worker folds
+every block's results into the shared nearest-neighbour tables (N x 2) and
+the kept pairs (at most --max-pairs) as soon as the block is done, so memory
+is those plus about workers x block^2 floats of block products in flight.
+The BLAS calls release the GIL, and each worker's BLAS is limited to one
+thread when threadpoolctl is available so the pool doesn't oversubscribe the
+cores.
+
+Reports:
+- every pair at or above --pair-threshold (default: the 0.45 match
+  threshold): the same person enrolled twice, or lookalikes that can be
+  mistaken for each other. All are counted; the --max-pairs most similar
+  are kept
+- for each user, the nearest other user; the distribution of that
+  similarity, how many users are within --margin below the threshold, and
+  the closest pairs
+
+Usage:
+    python gallery_audit.py --db database.json -o pairs.jsonl
+    python gallery_audit.py --store gallery.db --pair-threshold 0.6 --json
+    python gallery_audit.py --synthetic 200000 --workers 8   # timing only
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+from utils import build_gallery_matrix, load_face_db
+
+
+def _blas_limit():
+    """Context manager limiting BLAS to one thread, if threadpoolctl is installed."""
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return nullcontext()
+    return threadpool_limits(limits=1, user_api="blas")
+
+
+def _top2(sims):
+    """Best two values and column indices of each row of a block, as (n, 2) tables."""
+    rows = np.arange(len(sims))
+    first = sims.argmax(axis=1)
+    best = sims[rows, first]
+    # Mask the best column, take the max again, put it back
+    sims[rows, first] = -np.inf
+    second = sims.argmax(axis=1)
+    runner_up = sims[rows, second]
+    sims[rows, first] = best
+    return np.stack([best, runner_up], axis=1), np.stack([first, second], axis=1)
+
+
+def merge_top2(vals, idx, new_vals, new_idx):
+    """Combine two (n, 2) top-2 tables into one."""
+    all_vals = np.concatenate([vals, new_vals], axis=1)
+    all_idx = np.concatenate([idx, new_idx], axis=1)
+    order = np.argsort(-all_vals, axis=1)[:, :2]
+    return np.take_along_axis(all_vals, order, axis=1), np.take_along_axis(all_idx, order, axis=1)
+
+
+class AuditResults:
+    """
+    Nearest-neighbour tables and the most similar pairs, shared by the
+    workers; every add is one block's worth, under a lock.
+    """
+
+    def __init__(self, n, max_pairs):
+        self.vals = np.full((n, 2), -np.inf, dtype=np.float32)
+        self.idx = np.full((n, 2), -1, dtype=np.int64)
+        self.max_pairs = max_pairs
+        # Min-heap of (sim, i, j): the weakest kept pair is on top
+        self.heap = []
+        self.found = 0
+        self._lock = threading.Lock()
+
+    def floor(self):
+        """Similarity a new pair must beat to be kept, once max_pairs are kept."""
+        with self._lock:
+            if len(self.heap) < self.max_pairs:
+                return -np.inf
+            return self.heap[0][0] if self.heap else np.inf
+
+    def add_top2(self, offset, new_vals, new_idx):
+        rows = slice(offset, offset + len(new_vals))
+        with self._lock:
+            self.vals[rows], self.idx[rows] = merge_top2(self.vals[rows], self.idx[rows],
+                                                         new_vals, new_idx)
+
+    def add_pairs(self, pairs, found):
+        with self._lock:
+            self.found += found
+            for i, j, sim in pairs:
+                entry = (sim, i, j)
+                if len(self.heap) < self.max_pairs:
+                    heapq.heappush(self.heap, entry)
+                elif self.heap and entry > self.heap[0]:
+                    heapq.heapreplace(self.heap, entry)
+
+    def pairs(self):
+        """Kept pairs [(i, j, sim)], most similar first."""
+        return [(i, j, sim) for sim, i, j in sorted(self.heap, reverse=True)]
+
+
+def _block_pairs(sims, start, col, pair_threshold, floor, max_pairs):
+    """
+    Pairs of one block product at or above pair_threshold: (count, the up to
+    max_pairs most similar of them that beat `floor`, as [(i, j, sim)]).
+    """
+    mask = sims >= pair_threshold
+    if col == start:
+        mask = np.triu(mask, k=1)  # count each pair once
+    rows, cols = np.nonzero(mask)
+    found = len(rows)
+    values = sims[rows, cols]
+    keep = np.flatnonzero(values > floor)
+    if len(keep) > max_pairs:
+        keep = keep[np.argpartition(-values[keep], max_pairs - 1)[:max_pairs]] \
+            if max_pairs > 0 else keep[:0]
+    pairs = [(start + int(rows[k]), col + int(cols[k]), float(values[k])) for k in keep]
+    return found, pairs
+
+
+def audit_row_block(matrix, start, block, pair_threshold, results):
+    """
+    Compares rows [start, start + block) with themselves and every later row,
+    adding each block product's top-2 updates and pairs (i < j) to `results`.
+    """
+    n = len(matrix)
+    end = min(start + block, n)
+    rows = matrix[start:end]
+    for col in range(start, n, block):
+        col_end = min(col + block, n)
+        sims = rows @ matrix[col:col_end].T
+        if col == start:
+            # Same block: ignore self-similarity
+            np.fill_diagonal(sims, -np.inf)
+        if sims.shape[1] >= 2:
+            vals, idx = _top2(sims)
+        else:
+            vals = np.pad(sims, ((0, 0), (0, 1)), constant_values=-np.inf)
+            idx = np.zeros((len(sims), 2), dtype=np.int64)
+        results.add_top2(start, vals, idx + col)
+
+        # Only a block whose best score clears the threshold can hold pairs
+        if vals[:, 0].max() >= pair_threshold:
+            found, pairs = _block_pairs(sims, start, col, pair_threshold, results.floor(),
+                                        results.max_pairs)
+            results.add_pairs(pairs, found)
+
+        if col != start:
+            # The mirrored half of the block: later rows' view of these rows
+            mirrored = np.ascontiguousarray(sims.T)
+            if mirrored.shape[1] >= 2:
+                vals, idx = _top2(mirrored)
+            else:
+                vals = np.pad(mirrored, ((0, 0), (0, 1)), constant_values=-np.inf)
+                idx = np.zeros((len(mirrored), 2), dtype=np.int64)
+            results.add_top2(col, vals, idx + start)
+
+
+def audit(matrix, pair_threshold=0.45, block=2048, workers=None, max_pairs=100000):
+    """
+    All-pairs self-similarity of a normalized (N, D) float32 matrix.
+
+    Returns (nn_sim (N,), nn_idx (N,), second_sim (N,), the max_pairs most
+    similar pairs at or above pair_threshold, most similar first, number of
+    such pairs); nn_* is each row's nearest other row, -inf when the gallery
+    has a single user.
+    """
+    n = len(matrix)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    results = AuditResults(n, max_pairs)
+
+    def run(start):
+        with _blas_limit():
+            audit_row_block(matrix, start, block, pair_threshold, results)
+
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Workers merge as they go: nothing but the futures waits in the pool
+        for future in [pool.submit(run, start) for start in range(0, n, block)]:
+            future.result()
+
+    return results.vals[:, 0], results.idx[:, 0], results.vals[:, 1], results.pairs(), \
+        results.found
+
+
+def summarize(usernames, nn_sim, nn_idx, second_sim, pairs, found, threshold, margin, top):
+    finite = nn_sim[np.isfinite(nn_sim)]
+    percentiles = {}
+    if len(finite):
+        for p in (50, 90, 99, 99.9):
+            percentiles[f"p{p:g}"] = round(float(np.percentile(finite, p)), 4)
+        percentiles["max"] = round(float(finite.max()), 4)
+    # Mutual nearest neighbours would show up twice; list each pair once
+    closest, seen = [], set()
+    for i in np.argsort(-nn_sim):
+        if len(closest) >= top or nn_idx[i] < 0:
+            break
+        pair = frozenset((int(i), int(nn_idx[i])))
+        if pair not in seen:
+            seen.add(pair)
+            closest.append(i)
+    return {
+        "users": len(usernames),
+        "threshold": threshold,
+        "pairs_above_threshold": int(found),
+        "users_with_neighbour_above_threshold": int((nn_sim >= threshold).sum()),
+        f"users_within_{margin:g}_below_threshold": int(((nn_sim < threshold) &
+                                                         (nn_sim >= threshold - margin)).sum()),
+        "nearest_neighbour_similarity": percentiles,
+        # How clearly the nearest neighbour stands out from the second one
+        "median_gap_to_second": round(float(np.median((nn_sim - second_sim)[np.isfinite(second_sim)])), 4)
+        if np.isfinite(second_sim).any() else None,
+        "closest": [{"user": usernames[i], "neighbour": usernames[nn_idx[i]],
+                     "similarity": round(float(nn_sim[i]), 4),
+                     "margin": round(float(threshold - nn_sim[i]), 4)}
+                    for i in closest],
+        "pairs": len(pairs),
+    }
+
+
+def load_matrix(args):
+    if args.synthetic:
+        from bench_gallery import synthetic_gallery
+        return synthetic_gallery(args.synthetic, 512, 32, 0)
+    if args.store:
+        from gallery_store import GalleryStore
+        _, rows = GalleryStore(args.store).snapshot()
+        db = {u: {"embedding": vec} for u, vec in rows}
+    else:
+        db = load_face_db(args.db)
+    return build_gallery_matrix(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate and near-collision users in the gallery")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", default="database.json")
+    source.add_argument("--store", default=None, help="SQLite gallery store instead of --db")
+    source.add_argument("--synthetic", type=int, default=0,
+                        help="audit N synthetic users (for timing)")
+    parser.add_argument("--threshold", type=float, default=0.45, help="recognition threshold")
+    parser.add_argument("--pair-threshold", type=float, default=None,
+                        help="report pairs at or above this similarity (default: --threshold)")
+    parser.add_argument("--margin", type=float, default=0.05,
+                        help="count users whose nearest neighbour is this close below the threshold")
+    parser.add_argument("--block", type=int, default=2048, help="rows per block")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-pairs", type=int, default=100000,
+                        help="most similar pairs to keep (all are counted)")
+    parser.add_argument("--top", type=int, default=20, help="closest users to list in the summary")
+    parser.add_argument("-o", "--output", default=None, help="write the pairs here as JSON lines")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+    pair_threshold = args.threshold if args.pair_threshold is None else args.pair_threshold
+
+    usernames, matrix = load_matrix(args)
+    if len(usernames) < 2:
+        print("⚠️ Fewer than 2 users in the gallery, nothing to audit", file=sys.stderr)
+        return 0
+
+    started = time.perf_counter()
+    nn_sim, nn_idx, second_sim, pairs, found = audit(matrix, pair_threshold, args.block,
+                                                     args.workers, args.max_pairs)
+    elapsed = time.perf_counter() - started
+    print(f"🔍 {len(usernames)} users, {len(usernames) * (len(usernames) - 1) // 2} pairs "
+          f"compared in {elapsed:.1f}s ({args.workers} workers, block {args.block})", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for i, j, sim in pairs:
+                f.write(json.dumps({"user_a": usernames[i], "user_b": usernames[j],
+                                    "similarity": round(sim, 4)}) + "\n")
+    summary = summarize(usernames, nn_sim, nn_idx, second_sim, pairs, found,
+                        args.threshold, args.margin, args.top)
+    summary["seconds"] = round(elapsed, 2)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+    print(f"Pairs >= {pair_threshold:g}: {found}" +
+          (f" (kept {len(pairs)})" if found > len(pairs) else "") +
+          (f", written to {args.output}" if args.output else ""))
+    print(f"Users whose nearest neighbour is >= {args.threshold:g}: "
+          f"{summary['users_with_neighbour_above_threshold']}")
+    print(f"Users within {args.margin:g} below it: "
+          f"{summary[f'users_within_{args.margin:g}_below_threshold']}")
+    print("Nearest-neighbour similarity: " +
+          ", ".join(f"{k} {v}" for k, v in summary["nearest_neighbour_similarity"].items()))
+    for row in summary["closest"]:
+        flag = "⚠️" if row["margin"] <= 0 else "  "
+        print(f"{flag} {row['user']} ~ {row['neighbour']}: {row['similarity']:.4f} "
+              f"(margin {row['margin']:+.4f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
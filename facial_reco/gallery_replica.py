@@ -0,0 +1,308 @@
+"""
+Versioned gallery snapshots and delta replication
+
+Instead of shipping database.json with every deploy (or squeezing it into
+FACE_DB_JSON), a publisher writes numbered gallery versions to a release
+directory, which nodes read directly or through any static file server:
+
+    manifest.json          current version + the files below, with sha256
+    snapshot-<v>.gal       the whole gallery at version v (shared_gallery's
+                           blob format, mmap-able)
+    delta-<v>.mqd          what changed from v-1 to v: upserted users with
+                           their vectors, removed usernames
+
+A node (GALLERY_REPLICA=<dir or URL>) follows the manifest with
+gallery_store.GalleryFollower, so deltas are applied in place exactly like
+store changes: a node that is behind fetches only the deltas since its
+version. It reloads from a snapshot only when it has none yet or the
+publisher has pruned the deltas it would need. Downloaded files are
+immutable and cached in GALLERY_REPLICA_CACHE, so a restarted node starts
+from its newest cached snapshot and replays the cached deltas.
+
+A new snapshot is written every --snapshot-every versions, or sooner once
+the deltas since the last one add up to half its size. Older files beyond
+--keep-snapshots snapshots are pruned.
+
+CLI:
+    python gallery_replica.py publish releases/ --db database.json
+    python gallery_replica.py publish releases/ --store gallery.db
+    python gallery_replica.py info releases/            # or an http(s) URL
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+from shared_gallery import ALIGN, load_gallery_file, save_gallery_file
+from utils import build_gallery_matrix, load_face_db
+
+MANIFEST = "manifest.json"
+DELTA_MAGIC = b"MQDLT001"
+# magic, from version, to version, dim, upsert count, names_len
+DELTA_HEADER = struct.Struct("<8sQQIQQ")
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def pack_delta(from_version, to_version, upserts, removes, dim):
+    """Delta blob: upserts is [(username, normalized vector)], removes [username]."""
+    names = json.dumps({"upsert": [u for u, _ in upserts], "remove": list(removes)}).encode("utf-8")
+    offset = _align(DELTA_HEADER.size + len(names))
+    buf = bytearray(offset + len(upserts) * dim * 4)
+    DELTA_HEADER.pack_into(buf, 0, DELTA_MAGIC, from_version, to_version, dim, len(upserts), len(names))
+    buf[DELTA_HEADER.size:DELTA_HEADER.size + len(names)] = names
+    if upserts:
+        matrix = np.ndarray((len(upserts), dim), dtype=np.float32, buffer=buf, offset=offset)
+        matrix[:] = np.stack([v for _, v in upserts])
+    return bytes(buf)
+
+
+def unpack_delta(buf):
+    """Returns (from version, to version, [(username, vector or None)]), removals as None."""
+    magic, from_version, to_version, dim, count, names_len = DELTA_HEADER.unpack_from(buf, 0)
+    if magic != DELTA_MAGIC:
+        raise ValueError("Not a gallery delta (bad magic)")
+    names = json.loads(bytes(buf[DELTA_HEADER.size:DELTA_HEADER.size + names_len]).decode("utf-8"))
+    offset = _align(DELTA_HEADER.size + names_len)
+    matrix = np.frombuffer(buf, dtype=np.float32, count=count * dim, offset=offset).reshape(count, dim)
+    changes = list(zip(names["upsert"], matrix)) + [(u, None) for u in names["remove"]]
+    return from_version, to_version, changes
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".replica-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class ReplicaSource:
+    """
+    A release directory or URL seen through the store interface that
+    GalleryFollower expects: snapshot(), last_seq(), changes_since(seq),
+    with the gallery version as the sequence number.
+    """
+
+    def __init__(self, location, cache_dir=None, timeout=10.0):
+        self.location = location.rstrip("/")
+        self.remote = self.location.startswith(("http://", "https://"))
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self._manifest = None
+        # Last version handed to the follower; reported if the manifest can't be read
+        self._version = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _read(self, name):
+        if self.remote:
+            import requests
+            response = requests.get(f"{self.location}/{name}", timeout=self.timeout)
+            response.raise_for_status()
+            return response.content
+        with open(os.path.join(self.location, name), "rb") as f:
+            return f.read()
+
+    def manifest(self):
+        try:
+            self._manifest = json.loads(self._read(MANIFEST))
+        except FileNotFoundError:
+            self._manifest = {"version": 0, "snapshots": [], "deltas": []}
+        return self._manifest
+
+    def _fetch(self, entry):
+        """Bytes of a snapshot / delta file, from the cache when possible, checksum-verified."""
+        cached = os.path.join(self.cache_dir, entry["file"]) if self.cache_dir else None
+        if cached and os.path.exists(cached):
+            with open(cached, "rb") as f:
+                data = f.read()
+            if _sha256(data) == entry["sha256"]:
+                return data
+        data = self._read(entry["file"])
+        if _sha256(data) != entry["sha256"]:
+            raise ValueError(f"Checksum mismatch for {entry['file']}")
+        if cached:
+            _write_atomic(cached, data)
+        return data
+
+    def _cached(self, entry):
+        return bool(self.cache_dir) and os.path.exists(os.path.join(self.cache_dir, entry["file"]))
+
+    def _deltas(self, manifest, after, upto):
+        """Changes of versions after+1..upto, oldest first, or None if a delta is missing."""
+        by_to = {d["to"]: d for d in manifest["deltas"]}
+        changes = []
+        for version in range(after + 1, upto + 1):
+            entry = by_to.get(version)
+            if entry is None or entry["from"] != version - 1:
+                return None
+            changes.extend(unpack_delta(self._fetch(entry))[2])
+        return changes
+
+    def snapshot(self):
+        """(version, [(username, vector)]) at the manifest's current version."""
+        manifest = self.manifest()
+        if not manifest["snapshots"]:
+            return 0, []
+        # Prefer a snapshot we already have on disk, if deltas lead from it
+        # to the current version; otherwise the newest one
+        candidates = sorted(manifest["snapshots"], key=lambda s: (self._cached(s), s["version"]),
+                            reverse=True)
+        for entry in candidates:
+            changes = self._deltas(manifest, entry["version"], manifest["version"])
+            if changes is not None:
+                break
+        else:
+            raise ValueError("Manifest has no snapshot that deltas lead to the current version")
+
+        data = self._fetch(entry)
+        path = os.path.join(self.cache_dir, entry["file"]) if self.cache_dir else None
+        if path:
+            gallery, _ = load_gallery_file(path)
+            users = dict(zip(gallery.usernames, gallery.matrix))
+        else:
+            from shared_gallery import unpack_gallery
+            usernames, matrix, _ = unpack_gallery(bytearray(data))
+            users = dict(zip(usernames, matrix))
+        for username, vec in changes:
+            if vec is None:
+                users.pop(username, None)
+            else:
+                users[username] = vec
+        self._version = manifest["version"]
+        return manifest["version"], list(users.items())
+
+    def last_seq(self):
+        try:
+            return self.manifest()["version"]
+        except Exception as e:
+            print(f"⚠️ Gallery replica: can't read {self.location}/{MANIFEST}: {e}")
+            self._manifest = None
+            return self._version
+
+    def changes_since(self, seq):
+        """Same contract as GalleryStore.changes_since; None means reload from a snapshot."""
+        manifest = self._manifest or self.manifest()
+        changes = self._deltas(manifest, seq, manifest["version"])
+        if changes is None:
+            return None
+        latest = {}
+        for username, vec in changes:
+            latest.pop(username, None)  # keep each user's last change, in order
+            latest[username] = vec
+        self._version = manifest["version"]
+        return manifest["version"], list(latest.items())
+
+
+def publish(release_dir, db, snapshot_every=50, keep_snapshots=2):
+    """
+    Publish `db` (database.json-style dict) as the next version if it differs
+    from the current one. Returns the new version, or None if unchanged.
+    """
+    os.makedirs(release_dir, exist_ok=True)
+    source = ReplicaSource(release_dir)
+    version, rows = source.snapshot()
+    manifest = source._manifest
+    previous = dict(rows)
+
+    usernames, matrix = build_gallery_matrix(db)
+    current = dict(zip(usernames, matrix))
+    upserts = [(u, v) for u, v in current.items()
+               if u not in previous or not np.array_equal(previous[u], v)]
+    removes = [u for u in previous if u not in current]
+    if version and not upserts and not removes:
+        return None
+
+    new_version = version + 1
+    dim = matrix.shape[1]
+    if version:
+        delta = pack_delta(version, new_version, upserts, removes, dim)
+        name = f"delta-{new_version}.mqd"
+        _write_atomic(os.path.join(release_dir, name), delta)
+        manifest["deltas"].append({"from": version, "to": new_version, "file": name,
+                                   "sha256": _sha256(delta), "bytes": len(delta)})
+
+    last_snapshot = manifest["snapshots"][-1] if manifest["snapshots"] else None
+    since = [d for d in manifest["deltas"] if last_snapshot and d["to"] > last_snapshot["version"]]
+    if last_snapshot is None or len(since) >= snapshot_every or \
+            sum(d["bytes"] for d in since) * 2 > last_snapshot["bytes"]:
+        name = f"snapshot-{new_version}.gal"
+        path = os.path.join(release_dir, name)
+        save_gallery_file(path, usernames, matrix, generation=new_version)
+        with open(path, "rb") as f:
+            data = f.read()
+        manifest["snapshots"].append({"version": new_version, "file": name,
+                                      "sha256": _sha256(data), "bytes": len(data)})
+
+    # Prune: keep the newest snapshots and the deltas from the oldest kept one
+    dropped = manifest["snapshots"][:-keep_snapshots]
+    manifest["snapshots"] = manifest["snapshots"][-keep_snapshots:]
+    oldest = manifest["snapshots"][0]["version"]
+    dropped += [d for d in manifest["deltas"] if d["to"] <= oldest]
+    manifest["deltas"] = [d for d in manifest["deltas"] if d["to"] > oldest]
+
+    manifest.update({"format": 1, "version": new_version, "dim": dim, "users": len(usernames)})
+    _write_atomic(os.path.join(release_dir, MANIFEST), json.dumps(manifest, indent=2).encode())
+    # Only after the manifest no longer points at them
+    for entry in dropped:
+        try:
+            os.remove(os.path.join(release_dir, entry["file"]))
+        except FileNotFoundError:
+            pass
+    print(f"✅ Published version {new_version}: {len(upserts)} upserted, {len(removes)} removed, "
+          f"{len(usernames)} users")
+    return new_version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish and inspect versioned gallery releases")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pub = sub.add_parser("publish", help="publish the current gallery as the next version")
+    pub.add_argument("release_dir")
+    pub.add_argument("--db", default="database.json")
+    pub.add_argument("--store", default=None, help="SQLite gallery store instead of --db")
+    pub.add_argument("--snapshot-every", type=int, default=50)
+    pub.add_argument("--keep-snapshots", type=int, default=2)
+    info = sub.add_parser("info", help="show a release directory or URL")
+    info.add_argument("location")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        if args.store:
+            from gallery_store import GalleryStore
+            db = GalleryStore(args.store).load_db()
+        else:
+            db = load_face_db(args.db)
+        if publish(args.release_dir, db, args.snapshot_every, max(1, args.keep_snapshots)) is None:
+            print("No changes since the current version")
+        return 0
+
+    manifest = ReplicaSource(args.location).manifest()
+    print(f"Version {manifest['version']}: {manifest.get('users', 0)} users")
+    for s in manifest["snapshots"]:
+        print(f"  snapshot {s['version']:>6}  {s['bytes'] / 1024:10.1f} KB  {s['file']}")
+    for d in manifest["deltas"]:
+        print(f"  delta {d['from']:>4} -> {d['to']:<4} {d['bytes'] / 1024:8.1f} KB  {d['file']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
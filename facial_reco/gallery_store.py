@@ -0,0 +1,300 @@
+"""
+Transactional gallery store on SQLite
+
+Replaces rewriting database.json on every enrollment. Each user is one row
+with the embedding as a float32 BLOB and the rest of the record as JSON, so
+inserts, updates and deletes touch one row regardless of gallery size. The
+database runs in WAL mode: writers are serialized by SQLite, readers never
+block, and a crash mid-write leaves the last committed state.
+
+Every write also appends to a `changes` table in the same transaction. Its
+sequence numbers are the change feed: a server remembers the last sequence it
+applied and pulls only newer changes (see GalleryFollower).
+
+CLI:
+    python gallery_store.py import database.json gallery.db
+    python gallery_store.py export gallery.db database.json
+    python gallery_store.py info gallery.db
+    python gallery_store.py delete gallery.db <username>
+    python gallery_store.py compact gallery.db [keep]
+"""
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from utils import Gallery, _to_vec, load_face_db
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username   TEXT PRIMARY KEY,
+    dim        INTEGER NOT NULL,
+    embedding  BLOB NOT NULL,
+    meta       TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    username   TEXT NOT NULL,
+    op         TEXT NOT NULL,
+    at         REAL NOT NULL
+);
+"""
+
+
+class GalleryStore:
+    """Users and their embeddings in a SQLite file, with a change feed."""
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        # One connection per thread; sqlite3 connections aren't shareable
+        self._local = threading.local()
+        self.timeout = timeout
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: committed transactions survive a process crash;
+            # only an OS crash can lose the last few, never corrupt the file
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _put(self, conn, username, record):
+        emb = _to_vec(record["embedding"]).ravel()
+        meta = {k: v for k, v in record.items() if k != "embedding"}
+        conn.execute(
+            "INSERT INTO users (username, dim, embedding, meta) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET dim=excluded.dim, "
+            "embedding=excluded.embedding, meta=excluded.meta",
+            (username, emb.size, emb.astype("<f4").tobytes(), json.dumps(meta)))
+        conn.execute("INSERT INTO changes (username, op, at) VALUES (?, 'put', ?)",
+                     (username, time.time()))
+
+    def put(self, username, record):
+        """Insert or replace one user record (same shape as database.json)."""
+        with self._conn() as conn:
+            self._put(conn, username, record)
+
+    def put_many(self, db):
+        """Insert or replace many records in one transaction."""
+        with self._conn() as conn:
+            for username, record in db.items():
+                if "embedding" in record:
+                    self._put(conn, username, record)
+
+    def delete(self, username):
+        """Remove a user. Returns False if it wasn't enrolled."""
+        with self._conn() as conn:
+            cur = conn.execute("DELETE FROM users WHERE username = ?", (username,))
+            if cur.rowcount == 0:
+                return False
+            conn.execute("INSERT INTO changes (username, op, at) VALUES (?, 'delete', ?)",
+                         (username, time.time()))
+        return True
+
+    def __contains__(self, username):
+        row = self._conn().execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def _record(self, row):
+        _, dim, blob, meta = row
+        record = json.loads(meta)
+        record["embedding"] = np.frombuffer(blob, dtype="<f4", count=dim).tolist()
+        return record
+
+    def get(self, username):
+        row = self._conn().execute(
+            "SELECT username, dim, embedding, meta FROM users WHERE username = ?",
+            (username,)).fetchone()
+        return self._record(row) if row else None
+
+    def load_db(self):
+        """The whole store as a database.json-style dict, in enrollment order."""
+        rows = self._conn().execute(
+            "SELECT username, dim, embedding, meta FROM users ORDER BY rowid")
+        return {row[0]: self._record(row) for row in rows}
+
+    def snapshot(self):
+        """
+        Read all embeddings and the feed position consistently.
+
+        Returns (last_seq, [(username, float32 vector)]) in enrollment order.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            seq = self.last_seq()
+            rows = conn.execute("SELECT username, dim, embedding FROM users ORDER BY rowid").fetchall()
+        return seq, [(u, np.frombuffer(blob, dtype="<f4", count=dim)) for u, dim, blob in rows]
+
+    def iter_embeddings(self):
+        """Yields (username, float32 vector) in enrollment order, without loading all rows."""
+        rows = self._conn().execute("SELECT username, dim, embedding FROM users ORDER BY rowid")
+        for username, dim, blob in rows:
+            yield username, np.frombuffer(blob, dtype="<f4", count=dim)
+
+    def last_seq(self):
+        return self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, seq):
+        """
+        Changes after `seq` as (last_seq, [(username, vector or None)]), with
+        None meaning deleted and only the latest change per user. Returns
+        None if the feed was compacted past `seq` - reload with snapshot().
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            oldest = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            if oldest is not None and seq < oldest - 1:
+                return None
+            last = self.last_seq()
+            rows = conn.execute(
+                "SELECT c.username, u.dim, u.embedding FROM "
+                "(SELECT username, MAX(seq) AS seq FROM changes WHERE seq > ? GROUP BY username) c "
+                "LEFT JOIN users u ON u.username = c.username ORDER BY c.seq", (seq,)).fetchall()
+        return last, [(u, np.frombuffer(blob, dtype="<f4", count=dim) if blob is not None else None)
+                      for u, dim, blob in rows]
+
+    def compact(self, keep=10000):
+        """Drop all but the last `keep` feed entries; followers further behind reload."""
+        with self._conn() as conn:
+            # Always keep the newest entry: it carries the feed position
+            conn.execute("DELETE FROM changes WHERE seq <= ?", (self.last_seq() - max(keep, 1),))
+        self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class GalleryFollower:
+    """
+    Keeps a Gallery in sync with a GalleryStore by following its change feed.
+
+    current() checks the feed at most every `poll_interval` seconds and
+    applies new changes to a fresh Gallery; Galleries already handed out are
+    never modified, so in-flight matches see a consistent snapshot. Appends
+    go into spare matrix capacity without copying existing rows.
+    """
+
+    def __init__(self, store, poll_interval=1.0):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._seq = None
+        self._gallery = None
+        self._buffer = None
+        self._index = {}
+
+    def _normalize(self, vec):
+        norm = np.linalg.norm(vec)
+        if norm == 0 or (self._buffer is not None and vec.size != self._buffer.shape[1]):
+            return None  # same rules as build_gallery_matrix
+        return vec / norm
+
+    def _reload(self):
+        seq, rows = self.store.snapshot()
+        dim = rows[0][1].size if rows else 512
+        self._buffer = np.zeros((max(16, len(rows) * 2), dim), dtype=np.float32)
+        usernames = []
+        for username, vec in rows:
+            vec = self._normalize(vec)
+            if vec is not None:
+                self._buffer[len(usernames)] = vec
+                usernames.append(username)
+        self._publish(usernames)
+        self._seq = seq
+
+    def _publish(self, usernames):
+        self._index = {u: i for i, u in enumerate(usernames)}
+        self._gallery = Gallery(usernames, self._buffer[:len(usernames)])
+
+    def _apply(self, changes):
+        changes = [(u, self._normalize(v) if v is not None else None) for u, v in changes]
+        usernames = list(self._gallery.usernames)
+        n = len(usernames)
+        buffer = self._buffer
+        if any(vec is None or u in self._index for u, vec in changes):
+            # Updates / deletes: copy, so outstanding Galleries stay untouched
+            buffer = buffer.copy()
+
+        for username, vec in changes:
+            row = self._index.get(username)
+            if vec is None:
+                if row is not None:
+                    buffer[row:n - 1] = buffer[row + 1:n]
+                    del usernames[row]
+                    n -= 1
+                    self._index = {u: i for i, u in enumerate(usernames)}
+            elif row is not None:
+                buffer[row] = vec
+            else:
+                if n == len(buffer):
+                    grown = np.zeros((len(buffer) * 2, buffer.shape[1]), dtype=np.float32)
+                    grown[:n] = buffer[:n]
+                    buffer = grown
+                buffer[n] = vec
+                usernames.append(username)
+                self._index[username] = n
+                n += 1
+        self._buffer = buffer
+        self._publish(usernames)
+
+    def current(self):
+        """Up-to-date Gallery (within poll_interval)."""
+        now = time.monotonic()
+        if self._gallery is not None and now - self._checked < self.poll_interval:
+            return self._gallery
+        with self._lock:
+            if self._gallery is not None and now - self._checked < self.poll_interval:
+                return self._gallery
+            if self._gallery is None:
+                self._reload()
+            elif self.store.last_seq() != self._seq:
+                feed = self.store.changes_since(self._seq)
+                if feed is None:
+                    self._reload()
+                else:
+                    self._seq, changes = feed
+                    self._apply(changes)
+            self._checked = time.monotonic()
+            return self._gallery
+
+
+if __name__ == "__main__":
+    commands = ("import", "export", "info", "delete", "compact")
+    if len(sys.argv) < 3 or sys.argv[1] not in commands:
+        print("Usage: python gallery_store.py import database.json gallery.db | "
+              "export gallery.db out.json | info gallery.db | "
+              "delete gallery.db <username> | compact gallery.db [keep]")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "import":
+        db = load_face_db(sys.argv[2])
+        store = GalleryStore(sys.argv[3])
+        store.put_many(db)
+        print(f"✅ Imported {len(db)} users into {sys.argv[3]} ({len(store)} total)")
+    elif command == "export":
+        from register import save_db
+        db = GalleryStore(sys.argv[2]).load_db()
+        save_db(db, sys.argv[3])
+        print(f"✅ Exported {len(db)} users to {sys.argv[3]}")
+    elif command == "info":
+        store = GalleryStore(sys.argv[2])
+        print(f"{len(store)} users, change feed at sequence {store.last_seq()}")
+    elif command == "delete":
+        deleted = GalleryStore(sys.argv[2]).delete(sys.argv[3])
+        print(f"🗑️ Deleted {sys.argv[3]}" if deleted else f"⚠️ {sys.argv[3]} not enrolled")
+    else:
+        keep = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+        GalleryStore(sys.argv[2]).compact(keep)
+        print(f"✅ Compacted change feed (kept last {keep})")
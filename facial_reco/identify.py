@@ -0,0 +1,248 @@
+"""
+Streaming bulk identification over image directories and video files
+
+A reader thread walks a directory (recursively) or decodes a video file,
+optionally sampling frames and skipping near-identical ones. Frames are
+grouped into batches and identified by a process pool; each worker loads its
+own FaceEngine and gallery once. Workers get image paths, or video frames
+re-encoded as JPEG, and decode them themselves, so no raw frames are
+pickled between processes. At most a few batches are in flight at any
+time and results are written in input order as soon as they arrive, so
+memory stays flat however large the input is.
+
+Usage:
+    python identify.py photos/ > results.jsonl
+    python identify.py match.mp4 --fps 2 --scene-threshold 3 -o results.csv
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from utils import Gallery, decode_image, load_face_db, pool_worker_engine
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+# Sampled video frames go to the workers as JPEG at this quality
+VIDEO_JPEG_QUALITY = 95
+FIELDS = ["source", "frame", "time_s", "face", "user", "similarity", "bbox"]
+
+# Per-process state, created by the pool initializer
+_engine = None
+_gallery = None
+
+
+def _init_worker(db_path, detector_path, recognizer_path, ctx_id):
+    global _engine, _gallery
+    _engine = pool_worker_engine(detector_path, recognizer_path, ctx_id)
+    _gallery = Gallery.from_db(load_face_db(db_path) or {})
+
+
+def _decode(source):
+    """
+    Image path or encoded bytes -> (frame or None, scale, full_res), decoded
+    at reduced size when large (see decode_image).
+    """
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        frame, scale = decode_image(source)
+    except (OSError, cv2.error):
+        # Unreadable or empty file
+        return None, 1.0, None
+    return frame, scale, lambda: cv2.imdecode(np.frombuffer(source, np.uint8), cv2.IMREAD_COLOR)
+
+
+def identify_batch(items, threshold=0.45):
+    """
+    Runs in a worker: items are (meta dict, image path or encoded bytes).
+    Aligns the largest face of each frame, embeds all faces in one recognizer
+    call and matches them. Returns one result row per item.
+    """
+    rows, crops, owners = [], [], []
+    for meta, source in items:
+        row = dict(meta, face=False, user=None, similarity=None, bbox=None)
+        frame, scale, full_res = _decode(source)
+        if frame is None:
+            row["error"] = "unreadable"
+        else:
+            crop, bbox = _engine.align_face(frame, scale=scale, full_res=full_res)
+            if crop is not None:
+                row["face"] = True
+                row["bbox"] = [round(float(v), 1) for v in bbox[:4]]
+                crops.append(crop)
+                owners.append(row)
+        rows.append(row)
+
+    for row, emb in zip(owners, _engine.embed_batch(crops)):
+        user, sim = _gallery.match(emb, threshold=threshold)
+        row["user"] = user
+        row["similarity"] = round(sim, 4) if sim is not None else None
+    return rows
+
+
+def _thumbnail(frame):
+    small = cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+
+def iter_images(root):
+    """Yields (meta, path) for every image under root, sorted."""
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(folder, name)
+            yield {"source": path, "frame": None, "time_s": None}, path
+
+
+def iter_video(path, every=1, fps=None, scene_threshold=0.0):
+    """
+    Yields (meta, JPEG bytes) for sampled frames of a video: every Nth frame,
+    or about `fps` frames per second. Frames in between are only grabbed, not
+    decoded. With scene_threshold > 0, a sampled frame whose 32x32 grayscale
+    thumbnail differs from the last emitted one by less than that (mean
+    absolute difference, 0-255) is skipped.
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise OSError(f"Cannot open video: {path}")
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    if fps and video_fps > 0:
+        every = max(1, int(round(video_fps / fps)))
+
+    last = None
+    index = 0
+    try:
+        while cap.grab():
+            if index % every == 0:
+                ok, frame = cap.retrieve()
+                if ok:
+                    thumb = _thumbnail(frame) if scene_threshold > 0 else None
+                    if thumb is None or last is None or \
+                            np.abs(thumb - last).mean() >= scene_threshold:
+                        last = thumb
+                        time_s = round(index / video_fps, 3) if video_fps > 0 else None
+                        jpeg = cv2.imencode(".jpg", frame,
+                                            [cv2.IMWRITE_JPEG_QUALITY, VIDEO_JPEG_QUALITY])[1]
+                        yield {"source": path, "frame": index, "time_s": time_s}, jpeg.tobytes()
+            index += 1
+    finally:
+        cap.release()
+
+
+def read_batches(frames, batch_size, out_queue):
+    """Reader thread: group frames into batches and hand them over."""
+    try:
+        batch = []
+        for item in frames:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                out_queue.put(batch)
+                batch = []
+        if batch:
+            out_queue.put(batch)
+    except Exception as e:
+        out_queue.put(e)
+    out_queue.put(None)
+
+
+class ResultWriter:
+    """Writes result rows as JSON lines or CSV as they arrive."""
+
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == "csv":
+            self.csv = csv.DictWriter(stream, fieldnames=FIELDS + ["error"], extrasaction="ignore")
+            self.csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == "csv":
+                row = dict(row, bbox=" ".join(map(str, row["bbox"])) if row["bbox"] else "")
+                self.csv.writerow(row)
+            else:
+                self.stream.write(json.dumps(row) + "\n")
+        self.stream.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Identify faces in an image directory or video file")
+    parser.add_argument("input", help="directory of images, or a video file")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default=None,
+                        help="default: from the output extension, else jsonl")
+    parser.add_argument("--db", default="database.json")
+    parser.add_argument("--threshold", type=float, default=0.45)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch", type=int, default=8, help="frames per worker task")
+    parser.add_argument("--every", type=int, default=1, help="video: process every Nth frame")
+    parser.add_argument("--fps", type=float, default=None, help="video: sample about this many frames/s")
+    parser.add_argument("--scene-threshold", type=float, default=0.0,
+                        help="video: skip frames this similar to the last processed one")
+    parser.add_argument("--detector", default="models/scrfd_10g_bnkps.onnx")
+    parser.add_argument("--recognizer", default="models/w600k_r50.onnx")
+    parser.add_argument("--ctx-id", type=int, default=0)
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.output.endswith(".csv") else "jsonl")
+    if os.path.isdir(args.input):
+        frames = iter_images(args.input)
+    else:
+        frames = iter_video(args.input, args.every, args.fps, args.scene_threshold)
+
+    # Bounded everywhere: the reader runs at most a couple of batches ahead of
+    # the pool, and the pool holds at most 2 batches per worker
+    batches = queue.Queue(maxsize=2)
+    reader = threading.Thread(target=read_batches, args=(frames, args.batch, batches), daemon=True)
+    max_inflight = 2 * args.workers
+
+    stream = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    writer = ResultWriter(stream, fmt)
+    started = time.perf_counter()
+    counts = {"frames": 0, "faces": 0}
+    pending = deque()
+
+    def drain(limit):
+        # Oldest first, so output keeps input order
+        while len(pending) > limit:
+            rows = pending.popleft().result()
+            writer.write(rows)
+            counts["frames"] += len(rows)
+            counts["faces"] += sum(row["face"] for row in rows)
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                 initargs=(args.db, args.detector, args.recognizer, args.ctx_id)) as pool:
+            reader.start()
+            while True:
+                batch = batches.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                if batch is None:
+                    break
+                pending.append(pool.submit(identify_batch, batch, args.threshold))
+                drain(max_inflight - 1)
+            drain(0)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {counts['frames']} frames, {counts['faces']} faces in {elapsed:.1f}s "
+          f"({counts['frames'] / max(elapsed, 1e-9):.1f} frames/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+HTTP load test for the recognition API
+
+Starts the real server locally (the Procfile's web command by default),
+waits for /ready, then replays a mix of requests at a fixed arrival rate and
+reports throughput, latency percentiles and error rates per request type:
+
+    known      /recognize, face of an enrolled user (checks the username)
+    unknown    /recognize, face of a user who is not enrolled
+    noface     /recognize, frame without a face
+    preflight  OPTIONS /recognize
+    health     GET /health
+
+Requests are sent open-loop: each one is scheduled at its arrival time and its
+latency is measured from that time, so a slow server also shows the time
+requests spent waiting for a free client connection instead of hiding it.
+
+By default the server runs with FACE_ENGINE_STUB=1 (see stub_engine.py) and a
+temporary gallery of synthetic users, so the numbers describe the HTTP and
+serving layer; use --real-engine to include model inference.
+
+Usage:
+    python loadtest.py --rate 50 --duration 30
+    python loadtest.py --rate 20 --mix known=6,noface=2,health=2 --stub-embed-ms 40
+    python loadtest.py --server-cmd "uvicorn async_server:app --port {port}"
+    python loadtest.py --url http://localhost:5000 --rate 5   # existing server
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import requests
+
+from stub_engine import stub_gallery_db, synthetic_face
+
+PROCFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Procfile")
+DEFAULT_MIX = "known=5,unknown=2,noface=1,preflight=1,health=1"
+ENROLLED = 64  # synthetic users user0..user63; identities 64+ are unknown
+
+
+def procfile_command(path=PROCFILE, process="web"):
+    """
+    The command of a Procfile process, so the load test runs what is
+    deployed. $PORT becomes the {port} placeholder of --server-cmd.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            name, sep, command = line.partition(":")
+            if sep and name.strip() == process:
+                command = command.strip().replace("{", "{{").replace("}", "}}")
+                return re.sub(r"\$(\{\{PORT\}\}|PORT\b)", "{port}", command)
+    raise SystemExit(f"No '{process}:' line in {path}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"known", "unknown", "noface", "preflight", "health"}
+    if unknown:
+        raise SystemExit(f"Unknown request types in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def encode_jpeg(frame):
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return "data:image/jpeg;base64," + base64.b64encode(buf.tobytes()).decode()
+
+
+def build_payloads(count, size):
+    """Pre-encoded request bodies, so the client spends no CPU on images."""
+    payloads = {"known": [], "unknown": [], "noface": []}
+    for i in range(count):
+        identity = i % ENROLLED
+        payloads["known"].append((f"user{identity}", json.dumps(
+            {"image": encode_jpeg(synthetic_face(identity, size, seed=i))})))
+        payloads["unknown"].append((None, json.dumps(
+            {"image": encode_jpeg(synthetic_face(ENROLLED + i % 64, size, seed=i))})))
+        payloads["noface"].append((None, json.dumps(
+            {"image": encode_jpeg(synthetic_face(None, size, seed=i))})))
+    return payloads
+
+
+class Recorder:
+    """Thread-safe per-type latency and outcome bookkeeping."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def add(self, kind, latency_s, outcome):
+        with self.lock:
+            self.latencies[kind].append(latency_s)
+            self.outcomes[kind][outcome] += 1
+
+    def report(self, elapsed):
+        rows = []
+        total = sum(len(v) for v in self.latencies.values())
+        for kind in sorted(self.latencies, key=lambda k: -len(self.latencies[k])) + ["all"]:
+            if kind == "all":
+                lat = np.concatenate([np.asarray(v) for v in self.latencies.values()]) \
+                    if total else np.zeros(0)
+                outcomes = defaultdict(int)
+                for o in self.outcomes.values():
+                    for key, n in o.items():
+                        outcomes[key] += n
+            else:
+                lat = np.asarray(self.latencies[kind])
+                outcomes = self.outcomes[kind]
+            if len(lat) == 0:
+                continue
+            p50, p95, p99 = np.percentile(lat * 1000, [50, 95, 99])
+            errors = sum(n for key, n in outcomes.items() if key != "ok")
+            rows.append({
+                "type": kind,
+                "requests": len(lat),
+                "rps": round(len(lat) / elapsed, 2),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+                "max_ms": round(float(lat.max() * 1000), 1),
+                "error_rate": round(errors / len(lat), 4),
+                "outcomes": dict(outcomes),
+            })
+        return rows
+
+
+def send_one(session, base_url, kind, payload, timeout):
+    """Returns the outcome label: 'ok', 'wrong_user', 'http_<status>' or the exception name."""
+    try:
+        if kind == "health":
+            r = session.get(f"{base_url}/health", timeout=timeout)
+            return "ok" if r.status_code == 200 else f"http_{r.status_code}"
+        if kind == "preflight":
+            r = session.options(f"{base_url}/recognize", timeout=timeout, headers={
+                "Origin": "http://localhost:5173",
+                "Access-Control-Request-Method": "POST",
+            })
+            return "ok" if r.status_code in (200, 204) else f"http_{r.status_code}"
+
+        expected, body = payload
+        r = session.post(f"{base_url}/recognize", data=body, timeout=timeout, headers={
+            "Content-Type": "application/json",
+            "X-Request-Timeout-Ms": str(int(timeout * 1000)),
+        })
+        if r.status_code != 200:
+            return f"http_{r.status_code}"
+        if r.json().get("username") != expected:
+            return "wrong_user"
+        return "ok"
+    except requests.RequestException as e:
+        return type(e).__name__
+
+
+def run_load(base_url, payloads, mix, rate, duration, concurrency, timeout, seed=0):
+    rng = np.random.default_rng(seed)
+    kinds = list(mix)
+    weights = np.array([mix[k] for k in kinds], dtype=np.float64)
+    weights /= weights.sum()
+
+    recorder = Recorder()
+    local = threading.local()
+
+    def task(kind, payload, scheduled):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        outcome = send_one(local.session, base_url, kind, payload, timeout)
+        recorder.add(kind, time.perf_counter() - scheduled, outcome)
+
+    # Poisson arrivals at the requested mean rate
+    arrivals = np.cumsum(rng.exponential(1.0 / rate, int(rate * duration)))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, offset in enumerate(arrivals):
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            kind = kinds[rng.choice(len(kinds), p=weights)]
+            pool_items = payloads.get(kind)
+            payload = pool_items[i % len(pool_items)] if pool_items else None
+            pool.submit(task, kind, payload, scheduled)
+    return recorder.report(time.perf_counter() - started)
+
+
+def wait_ready(base_url, timeout, proc=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"Server exited with code {proc.returncode}")
+        try:
+            if requests.get(f"{base_url}/ready", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise SystemExit(f"Server at {base_url} not ready after {timeout}s")
+
+
+def start_server(args, port, workdir):
+    env = dict(os.environ, PORT=str(port))
+    if not args.real_engine:
+        from gallery_store import GalleryStore
+        store_path = os.path.join(workdir, "loadtest_gallery.db")
+        GalleryStore(store_path).put_many(stub_gallery_db(range(ENROLLED)))
+        env.update({
+            "FACE_ENGINE_STUB": "1",
+            "GALLERY_STORE": store_path,
+            "STUB_DETECT_MS": str(args.stub_detect_ms),
+            "STUB_EMBED_MS": str(args.stub_embed_ms),
+        })
+    cmd = shlex.split(args.server_cmd.format(port=port))
+    print(f"🚀 Starting server: {' '.join(cmd)}", file=sys.stderr)
+    return subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL if not args.server_logs else None,
+                            stderr=subprocess.DEVNULL if not args.server_logs else None)
+
+
+def print_table(rows):
+    print(f"{'type':<10}{'requests':>9}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'max ms':>9}{'errors':>8}  outcomes")
+    for row in rows:
+        outcomes = " ".join(f"{k}={v}" for k, v in sorted(row["outcomes"].items()))
+        print(f"{row['type']:<10}{row['requests']:>9}{row['rps']:>8.1f}{row['p50_ms']:>9.1f}"
+              f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}"
+              f"{row['error_rate']:>8.1%}  {outcomes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the recognition API")
+    parser.add_argument("--url", default=None, help="test a running server instead of starting one")
+    parser.add_argument("--server-cmd", default=None,
+                        help="command to start the server; {port} is substituted "
+                             "(default: the Procfile's web command)")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--rate", type=float, default=20.0, help="requests per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of traffic")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="type=weight,...")
+    parser.add_argument("--concurrency", type=int, default=64, help="max open client connections")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout, like the web app")
+    parser.add_argument("--image-size", default="480x640", help="HxW of the synthetic frames")
+    parser.add_argument("--stub-detect-ms", type=float, default=0.0)
+    parser.add_argument("--stub-embed-ms", type=float, default=0.0)
+    parser.add_argument("--real-engine", action="store_true",
+                        help="don't stub the models (needs models/ and a real gallery)")
+    parser.add_argument("--server-logs", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if args.url is None and args.server_cmd is None:
+        args.server_cmd = procfile_command()
+    height, width = (int(v) for v in args.image_size.lower().split("x"))
+    payloads = build_payloads(32, (height, width))
+
+    proc = None
+    with tempfile.TemporaryDirectory() as workdir:
+        base_url = args.url
+        if base_url is None:
+            base_url = f"http://127.0.0.1:{args.port}"
+            proc = start_server(args, args.port, workdir)
+        try:
+            wait_ready(base_url, 120, proc)
+            print(f"📈 {args.rate:g} req/s for {args.duration:g}s against {base_url} "
+                  f"(mix {args.mix})", file=sys.stderr)
+            rows = run_load(base_url, payloads, mix, args.rate, args.duration,
+                            args.concurrency, args.timeout)
+            load = requests.get(f"{base_url}/ready", timeout=5).json().get("load")
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+    if args.json:
+        print(json.dumps({"rows": rows, "server_load": load}, indent=2))
+    else:
+        print_table(rows)
+        if load:
+            print(f"server (last worker polled): {load}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Parallel, resumable, checksummed model downloads
+
+Used by api_server.ensure_models(). Each model is fetched with several ranged
+connections when the server supports `Range` requests, into a `<name>.part`
+file next to the destination. Completed chunks are recorded in a small
+`<name>.part.json` sidecar, so an interrupted download resumes instead of
+starting over. The finished file is checked (size, HTML sniff, optional
+SHA-256) before it is atomically renamed into place.
+
+Everything takes plain URLs and paths, so it can be pointed at a local HTTP
+server for testing.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import requests
+
+CHUNK_SIZE = 8 * 1024 * 1024      # bytes per ranged request
+BUFFER_SIZE = 1024 * 1024         # read/write buffer
+CONNECTIONS = 4                   # ranged connections per file
+MAX_RETRIES = 5
+REQUEST_TIMEOUT = 30              # seconds, connect + between reads
+
+
+def direct_download_url(url):
+    """Make sure a Dropbox share link points at the raw file (dl=1)."""
+    if 'dropbox.com' in url:
+        if '&dl=0' in url:
+            url = url.replace('&dl=0', '&dl=1')
+        elif '&dl=1' not in url and '?dl=1' not in url:
+            url = url + ('&' if '?' in url else '?') + 'dl=1'
+    return url
+
+
+def _backoff(attempt):
+    """Exponential backoff: 1, 2, 4, 8... seconds, capped at 30."""
+    return min(30, 2 ** attempt)
+
+
+class _PartState:
+    """Sidecar file tracking which chunks of a `.part` file are complete."""
+
+    def __init__(self, path, url, total, chunk_size):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {"url": url, "total": total, "chunk_size": chunk_size, "done": []}
+        if path.exists():
+            try:
+                saved = json.loads(path.read_text())
+                if (saved.get("url") == url and saved.get("total") == total
+                        and saved.get("chunk_size") == chunk_size):
+                    self.data = saved
+            except (ValueError, OSError):
+                pass
+        self.done = set(self.data["done"])
+
+    def mark_done(self, index):
+        with self.lock:
+            self.done.add(index)
+            self.data["done"] = sorted(self.done)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.data))
+            os.replace(tmp, self.path)
+
+
+def probe(session, url):
+    """
+    Ask for the first byte to learn the size and whether ranges are supported.
+
+    Returns (total_size or None, supports_ranges).
+    """
+    with session.get(url, headers={"Range": "bytes=0-0"}, stream=True,
+                     timeout=REQUEST_TIMEOUT, allow_redirects=True) as r:
+        r.raise_for_status()
+        content_range = r.headers.get("Content-Range", "")
+        if r.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            if total.isdigit():
+                return int(total), True
+        length = r.headers.get("Content-Length")
+        return (int(length) if length and length.isdigit() else None), False
+
+
+def _fetch_chunk(session, url, part_path, state, index, start, end):
+    """Download bytes [start, end] into part_path at offset start."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            headers = {"Range": f"bytes={start}-{end}"}
+            with session.get(url, headers=headers, stream=True,
+                             timeout=REQUEST_TIMEOUT) as r:
+                if r.status_code != 206:
+                    raise IOError(f"expected 206 for range, got {r.status_code}")
+                offset = start
+                # Own handle per chunk: seek + write works on Windows too (no os.pwrite)
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    for block in r.iter_content(chunk_size=BUFFER_SIZE):
+                        if block:
+                            f.write(block)
+                            offset += len(block)
+                if offset != end + 1:
+                    raise IOError(f"short chunk {index}: {offset - start}/{end - start + 1} bytes")
+            state.mark_done(index)
+            return
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            print(f"🔄 Chunk {index} of {part_path.name} failed ({e}), retrying...")
+            time.sleep(_backoff(attempt))
+
+
+def _download_ranged(session, url, part_path, total, connections):
+    state_path = Path(str(part_path) + ".json")
+    state = _PartState(state_path, url, total, CHUNK_SIZE)
+    if not part_path.exists() or part_path.stat().st_size != total:
+        # Fresh start: preallocate so workers can write at any offset
+        state.done.clear()
+        with open(part_path, "wb") as f:
+            f.truncate(total)
+
+    chunks = [(i, start, min(start + CHUNK_SIZE, total) - 1)
+              for i, start in enumerate(range(0, total, CHUNK_SIZE))]
+    pending = [c for c in chunks if c[0] not in state.done]
+    if len(pending) < len(chunks):
+        print(f"⏩ Resuming {part_path.name}: {len(chunks) - len(pending)}/{len(chunks)} chunks already on disk")
+
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        futures = [pool.submit(_fetch_chunk, session, url, part_path, state, *c)
+                   for c in pending]
+        for future in as_completed(futures):
+            future.result()
+    state_path.unlink(missing_ok=True)
+
+
+def _download_stream(session, url, part_path):
+    """Single connection, resuming from the end of an existing .part file."""
+    for attempt in range(MAX_RETRIES):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, headers=headers, stream=True,
+                             timeout=REQUEST_TIMEOUT) as r:
+                if r.status_code == 416:
+                    return  # already complete
+                r.raise_for_status()
+                mode = "ab" if offset and r.status_code == 206 else "wb"
+                with open(part_path, mode, buffering=BUFFER_SIZE) as f:
+                    for block in r.iter_content(chunk_size=BUFFER_SIZE):
+                        if block:
+                            f.write(block)
+            return
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            print(f"🔄 Stream of {part_path.name} interrupted ({e}), resuming...")
+            time.sleep(_backoff(attempt))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify_file(path, expected_min_size_mb=1, sha256=None):
+    """Return None if the file looks valid, otherwise a reason string."""
+    size_mb = path.stat().st_size / (1024 * 1024)
+    if size_mb < expected_min_size_mb:
+        return f"file too small ({size_mb:.2f} MB < {expected_min_size_mb} MB)"
+    with open(path, "rb") as f:
+        if b"<html" in f.read(100).lower():
+            return "downloaded HTML instead of file"
+    if sha256:
+        actual = file_sha256(path)
+        if actual.lower() != sha256.lower():
+            return f"SHA-256 mismatch (got {actual})"
+    return None
+
+
+def download_model(url, filepath, expected_min_size_mb=1, sha256=None,
+                   connections=CONNECTIONS, session=None):
+    """
+    Download url to filepath. Returns True on success.
+
+    Partial data is kept in `<filepath>.part` between attempts (and between
+    process restarts), and is only discarded if verification fails.
+    """
+    filepath = Path(filepath)
+    part_path = Path(str(filepath) + ".part")
+    url = direct_download_url(url)
+    session = session or requests.Session()
+    started = time.time()
+
+    for attempt in range(2):
+        try:
+            print(f"📥 Downloading {filepath.name} (attempt {attempt + 1}/2)...")
+            total, ranged = probe(session, url)
+            if ranged and total and connections > 1:
+                print(f"🧩 {filepath.name}: {total / (1024 * 1024):.1f} MB over {connections} connections")
+                _download_ranged(session, url, part_path, total, connections)
+            else:
+                _download_stream(session, url, part_path)
+
+            problem = verify_file(part_path, expected_min_size_mb, sha256)
+            if problem is None:
+                os.replace(part_path, filepath)
+                elapsed = time.time() - started
+                size_mb = filepath.stat().st_size / (1024 * 1024)
+                print(f"✅ Downloaded {filepath.name} ({size_mb:.2f} MB in {elapsed:.1f}s)")
+                if not sha256:
+                    print(f"⚠️ No SHA-256 configured for {filepath.name}; "
+                          f"checksum is {file_sha256(filepath)}")
+                return True
+            print(f"❌ {filepath.name}: {problem}")
+        except Exception as e:
+            print(f"❌ Download of {filepath.name} failed: {e}")
+            continue
+        # Verification failed: the partial data is bad, start from scratch
+        part_path.unlink(missing_ok=True)
+        Path(str(part_path) + ".json").unlink(missing_ok=True)
+
+    return False
+
+
+def download_models(specs, max_workers=None):
+    """
+    Download several models concurrently.
+
+    specs: list of dicts with keys url, filepath and optionally
+           expected_min_size_mb, sha256, connections.
+    Returns {path: success}.
+    """
+    results = {}
+    if not specs:
+        return results
+    with ThreadPoolExecutor(max_workers=max_workers or len(specs)) as pool:
+        futures = {pool.submit(download_model, **spec): str(spec["filepath"]) for spec in specs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                print(f"❌ Download of {path} failed: {e}")
+                results[path] = False
+    return results
@@ -0,0 +1,123 @@
+"""
+Gallery namespaces: one index per realm, loaded on demand
+
+With GALLERY_NAMESPACE_DIR set, a /recognize request carrying
+"namespace": "<name>" is matched only against that namespace's users, so a
+query costs as much as the namespace is large, not the whole population.
+Each namespace lives in the directory as either
+
+    <name>.db     a SQLite gallery store (followed through its change feed)
+    <name>.json   a database.json-style file (reloaded when it changes)
+
+Namespaces are loaded the first time they are queried and kept in an LRU:
+beyond GALLERY_NAMESPACES_MAX loaded namespaces, or after
+GALLERY_NAMESPACE_IDLE seconds without a query, the least recently used ones
+are dropped and reloaded on their next query.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+class UnknownNamespace(LookupError):
+    """No gallery file for the namespace (or the name is not a valid one)."""
+
+
+class _JsonSource:
+    """A database.json-style namespace, rebuilt when the file's mtime changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._gallery = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        from utils import Gallery, load_face_db
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._gallery = Gallery.from_db(load_face_db(self.path) or {})
+                    self._mtime = mtime
+        return self._gallery
+
+
+class NamespaceGalleries:
+    """Lazily loaded, LRU-evicted galleries, one per namespace file in `root`."""
+
+    def __init__(self, root, capacity=32, idle_s=600.0, poll_interval=1.0):
+        self.root = root
+        self.capacity = capacity
+        self.idle_s = idle_s
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # name -> [source, last used (time.monotonic)], least recent first
+        self._loaded = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls):
+        root = os.environ.get("GALLERY_NAMESPACE_DIR")
+        if not root:
+            return None
+        return cls(root,
+                   capacity=int(os.environ.get("GALLERY_NAMESPACES_MAX", 32)),
+                   idle_s=float(os.environ.get("GALLERY_NAMESPACE_IDLE", 600)),
+                   poll_interval=float(os.environ.get("GALLERY_STORE_POLL", "1.0")))
+
+    def _open(self, name):
+        if not isinstance(name, str) or not NAME_PATTERN.match(name):
+            raise UnknownNamespace(f"Invalid namespace name: {name!r}")
+        base = os.path.join(self.root, name)
+        if os.path.exists(base + ".db"):
+            from gallery_store import GalleryFollower, GalleryStore
+            return GalleryFollower(GalleryStore(base + ".db"), self.poll_interval)
+        if os.path.exists(base + ".json"):
+            return _JsonSource(base + ".json")
+        raise UnknownNamespace(f"Unknown namespace: {name}")
+
+    def _evict(self, now):
+        # Called with the lock held; the entry just used is the most recent
+        while len(self._loaded) > self.capacity or (
+                self._loaded and now - next(iter(self._loaded.values()))[1] > self.idle_s):
+            name, _ = self._loaded.popitem(last=False)
+            self.evictions += 1
+            print(f"🧹 Unloaded gallery namespace '{name}'")
+
+    def get(self, name):
+        """Current Gallery of a namespace. Raises UnknownNamespace."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                entry[1] = now
+                self._loaded.move_to_end(name)
+        if entry is None:
+            # Open outside the lock: a slow load doesn't stall other namespaces.
+            # Two first queries racing may both open it; one entry wins.
+            source = self._open(name)
+            with self._lock:
+                entry = self._loaded.setdefault(name, [source, now])
+                if entry[0] is source:
+                    self.loads += 1
+                    print(f"📂 Loaded gallery namespace '{name}'")
+                self._loaded.move_to_end(name)
+        gallery = entry[0].current()
+        with self._lock:
+            self._evict(now)
+        return gallery
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "loaded": list(self._loaded),
+                "capacity": self.capacity,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
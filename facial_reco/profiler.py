@@ -0,0 +1,230 @@
+"""
+On-demand sampling profiler for a live worker
+
+GET /admin/profile?seconds=10 (with ADMIN_TOKEN) samples the Python stacks
+of every thread in the worker that receives the request, every interval_ms,
+for the given time, then returns them aggregated:
+
+    format=collapsed   "frame;frame;frame count" lines, for flamegraph.pl /
+                       speedscope (default)
+    format=pstats      a marshal'd pstats file: pstats.Stats("profile.out")
+    format=json        sample counts per pipeline stage + the hottest stacks
+
+Nothing runs until a profile is requested: the sampling loop runs in the
+requesting thread and stops when the time is up. Sampling reads
+sys._current_frames(), so a thread inside a C call (cv2.imdecode, an ONNX
+Runtime session) is seen at the Python line that made the call, and the
+stage table attributes it from there. Threads blocked waiting for work
+(idle pool threads, the server's accept loop) are left out unless idle=1.
+
+With several gunicorn workers, each request profiles only the worker it
+lands on.
+"""
+import hmac
+import json
+import linecache
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_SECONDS = 60.0
+
+# Leaf files of threads that are only waiting for something to do
+_IDLE_FILES = {"threading.py", "queue.py", "selectors.py", "socket.py", "socketserver.py",
+               "connection.py", "base_events.py", "selector_events.py", "ssl.py"}
+_IDLE_FUNCTIONS = {"wait", "get", "select", "accept", "poll", "_worker", "serve_forever",
+                   "_recv", "recv_bytes", "_run_once"}
+
+_lock = threading.Lock()
+
+
+def _stage_matchers():
+    """(stage, test(filename, qualname, source line)) - a sample counts for every stage in its stack."""
+    return [
+        ("cv2.imdecode", lambda f, q, line: "imdecode" in line),
+        # insightface's get_model() loads SCRFD files as model_zoo.retinaface.RetinaFace
+        ("scrfd", lambda f, q, line: f.endswith(("scrfd.py", "scrfd_fast.py", "retinaface.py"))),
+        ("norm_crop", lambda f, q, line: q.endswith("norm_crop")),
+        ("ort_session", lambda f, q, line: "onnxruntime" in f),
+        ("recognizer", lambda f, q, line: f.endswith("arcface_onnx.py") or "get_feat" in q),
+        ("find_best_match", lambda f, q, line: q in ("find_best_match", "Gallery.match",
+                                                     "QuantizedGallery.match",
+                                                     "ShardedGallery.match")),
+    ]
+
+
+STAGES = _stage_matchers()
+
+
+def _thread_label(name):
+    # "inference_3" / "ThreadPoolExecutor-0_1" -> one label per pool
+    return re.sub(r"[-_]?\d+(_\d+)?$", "", name) or name
+
+
+def _frames(frame):
+    """[(filename, first line, qualname, current line)] from the root to `frame`."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_filename, code.co_firstlineno,
+                      getattr(code, "co_qualname", code.co_name), frame.f_lineno))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _is_idle(stack):
+    filename, _, qualname, _ = stack[-1]
+    return os.path.basename(filename) in _IDLE_FILES and \
+        qualname.rsplit(".", 1)[-1] in _IDLE_FUNCTIONS
+
+
+def sample(seconds, interval=0.005, include_idle=False):
+    """
+    Sample all other threads' stacks for `seconds`. Returns
+    (Counter of (thread label, stack tuple) -> samples, number of sampling passes).
+    """
+    me = threading.get_ident()
+    counts = Counter()
+    passes = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = tuple(_frames(frame))
+            if not stack or (not include_idle and _is_idle(stack)):
+                continue
+            counts[(_thread_label(names.get(ident, "thread")), stack)] += 1
+        passes += 1
+        time.sleep(interval)
+    return counts, passes
+
+
+def _label(filename, qualname):
+    module = os.path.splitext(os.path.basename(filename))[0]
+    return f"{module}:{qualname}"
+
+
+def _merged(counts):
+    """Samples per "thread;module:function;..." stack (line numbers dropped)."""
+    merged = Counter()
+    for (thread, stack), n in counts.items():
+        merged[";".join([thread] + [_label(f, q) for f, _, q, _ in stack])] += n
+    return merged
+
+
+def collapsed(counts):
+    """Brendan Gregg's collapsed-stack text, one line per distinct stack."""
+    return "".join(f"{stack} {n}\n" for stack, n in _merged(counts).most_common())
+
+
+def stage_table(counts):
+    """Samples per pipeline stage (inclusive: a stack counts once per stage it contains)."""
+    stages = Counter()
+    for (_, stack), n in counts.items():
+        frames = [(f, q, linecache.getline(f, line)) for f, _, q, line in stack]
+        for stage, test in STAGES:
+            if any(test(f, q, line) for f, q, line in frames):
+                stages[stage] += n
+    return stages
+
+
+def pstats_dump(counts, interval):
+    """
+    Samples as a pstats-compatible dict, marshal'd: call counts are sample
+    counts, times are samples x interval (tottime = leaf, cumtime = on stack).
+    """
+    stats = {}
+    callers = {}
+    for (_, stack), n in counts.items():
+        seen = set()
+        for depth, (filename, firstline, qualname, _) in enumerate(stack):
+            key = (filename, firstline, qualname)
+            cc, nc, tt, ct = stats.get(key, (0, 0, 0.0, 0.0))
+            if depth == len(stack) - 1:
+                tt += n * interval
+            if key not in seen:  # recursion: count each sample once per function
+                ct += n * interval
+                cc += n
+                nc += n
+                seen.add(key)
+            stats[key] = (cc, nc, tt, ct)
+            if depth:
+                parent = stack[depth - 1][:3]
+                edges = callers.setdefault(key, {})
+                pcc, pnc, ptt, pct = edges.get(parent, (0, 0, 0.0, 0.0))
+                edges[parent] = (pcc + n, pnc + n,
+                                 ptt + (n * interval if depth == len(stack) - 1 else 0.0),
+                                 pct + n * interval)
+    return marshal.dumps({key: value + (callers.get(key, {}),) for key, value in stats.items()})
+
+
+def authorized(token):
+    """True if `token` matches ADMIN_TOKEN (never when ADMIN_TOKEN is unset)."""
+    expected = os.environ.get("ADMIN_TOKEN", "")
+    return bool(expected) and hmac.compare_digest(token.encode(), expected.encode())
+
+
+def admin_token(authorization, x_admin_token):
+    """Token from an 'Authorization: Bearer ...' or 'X-Admin-Token' header."""
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return x_admin_token.strip()
+
+
+def profile_response(params, token):
+    """
+    Handle /admin/profile for the Flask and ASGI servers.
+
+    params: query parameters (dict-like). Returns (body bytes, status,
+    content type).
+    """
+    def error(message, status):
+        return json.dumps({"error": message}).encode(), status, "application/json"
+
+    if not os.environ.get("ADMIN_TOKEN"):
+        return error("Not found", 404)
+    if not authorized(token):
+        return error("Unauthorized", 401)
+    try:
+        seconds = min(float(params.get("seconds", 10)), MAX_SECONDS)
+        interval = max(float(params.get("interval_ms", 5)), 1.0) / 1000.0
+    except ValueError:
+        return error("seconds and interval_ms must be numbers", 400)
+    fmt = params.get("format", "collapsed")
+    if fmt not in ("collapsed", "pstats", "json"):
+        return error("format must be collapsed, pstats or json", 400)
+    include_idle = params.get("idle", "0") in ("1", "true", "yes")
+
+    if not _lock.acquire(blocking=False):
+        return error("A profile is already running in this worker", 409)
+    try:
+        print(f"🔬 Profiling for {seconds:g}s every {interval * 1000:g} ms (pid {os.getpid()})")
+        counts, passes = sample(seconds, interval, include_idle)
+    finally:
+        _lock.release()
+
+    if fmt == "collapsed":
+        return collapsed(counts).encode(), 200, "text/plain; charset=utf-8"
+    if fmt == "pstats":
+        return pstats_dump(counts, interval), 200, "application/octet-stream"
+
+    total = sum(counts.values())
+    stacks = _merged(counts)
+    body = {
+        "pid": os.getpid(),
+        "seconds": seconds,
+        "interval_ms": interval * 1000,
+        "passes": passes,
+        "samples": total,
+        "stages": {stage: {"samples": n, "percent": round(100.0 * n / max(total, 1), 1)}
+                   for stage, n in stage_table(counts).most_common()},
+        "top_stacks": [{"stack": s, "samples": n} for s, n in stacks.most_common(20)],
+    }
+    return json.dumps(body).encode(), 200, "application/json"
@@ -1,6 +1,7 @@
 # register.py
 import json
 import os
+import tempfile
 from datetime import datetime
 
 import cv2
@@ -21,8 +22,22 @@ def load_db(path=DB_PATH):
             return {}
 
 def save_db(db, path=DB_PATH):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(db, f, indent=2)
+    # Write to a unique temp file and rename, so neither a crash nor another
+    # writer (register.py and enroll.py at once) can leave a torn database
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".database-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(db, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            # mkstemp creates the file 0600; keep the database's permissions
+            os.chmod(tmp, os.stat(path).st_mode & 0o777)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
 
 def main():
     username = input("Enter new username to register: ").strip()
@@ -93,17 +108,24 @@ def main():
         print("Failed to compute average embedding. Abort.")
         return
 
-    db = load_db()
-    db[username] = {
+    record = {
         "embedding": avg_emb.tolist(),
         "model": "w600k_r50",
         "detector": "scrfd_10g_bnkps",
         "created_at": datetime.utcnow().isoformat() + "Z",
         "samples": len(collected)
     }
-    save_db(db)
-
-    print(f"✅ Registered '{username}' with {len(collected)} samples. Saved to {DB_PATH}.")
+    store_path = os.environ.get("GALLERY_STORE")
+    if store_path:
+        # One-row transaction; running servers pick it up from the change feed
+        from gallery_store import GalleryStore
+        GalleryStore(store_path).put(username, record)
+    else:
+        db = load_db()
+        db[username] = record
+        save_db(db)
+
+    print(f"✅ Registered '{username}' with {len(collected)} samples. Saved to {store_path or DB_PATH}.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,143 @@
+"""
+Faster post-processing for insightface SCRFD detectors
+
+insightface's model_zoo.get_model() loads SCRFD .onnx files (scrfd_10g_bnkps
+and friends) as model_zoo.retinaface.RetinaFace; scrfd.SCRFD is the same
+detector with batched-output support. Both work here. Their detect() scales and decodes a box and 5 landmarks for every
+anchor of every stride (16800 anchors at 640x640) before thresholding, then
+runs NMS, and FaceEngine only keeps the largest face afterwards. FastSCRFD
+runs the same ONNX session with the same preprocessing, but:
+
+- anchor centres for all strides are built once per input size
+- only anchors above det_thresh are scaled and decoded, with array ops
+- detect_largest() skips NMS when every candidate overlaps the best-scoring
+  box (one face, the usual login selfie): NMS would keep exactly that box.
+  With several faces it runs NMS on the candidates and returns the largest
+  survivor, like FaceEngine did with SCRFD.detect.
+
+Results are identical to RetinaFace.detect / SCRFD.detect (see bench_scrfd.py).
+"""
+import cv2
+import numpy as np
+
+
+class FastSCRFD:
+    """Wraps a prepared insightface RetinaFace / SCRFD model; same detect() contract."""
+
+    def __init__(self, scrfd):
+        self.model = scrfd
+        self._centers = {}
+
+    @staticmethod
+    def supports(model):
+        """True for insightface RetinaFace / SCRFD models this wrapper understands."""
+        return all(hasattr(model, attr) for attr in
+                   ("session", "_feat_stride_fpn", "_num_anchors", "fmc", "use_kps"))
+
+    def anchor_centers(self, input_size):
+        """[(stride, (K, 2) float32 centres)] for an input size, cached."""
+        centers = self._centers.get(input_size)
+        if centers is None:
+            width, height = input_size
+            centers = []
+            for stride in self.model._feat_stride_fpn:
+                h, w = height // stride, width // stride
+                grid = np.stack(np.mgrid[:h, :w][::-1], axis=-1).reshape(-1, 2)
+                grid = np.repeat(grid, self.model._num_anchors, axis=0)
+                centers.append((stride, (grid * stride).astype(np.float32)))
+            self._centers[input_size] = centers
+        return centers
+
+    def _preprocess(self, img, input_size):
+        """Resize + pad exactly like SCRFD.detect. Returns (blob, det_scale)."""
+        im_ratio = float(img.shape[0]) / img.shape[1]
+        model_ratio = float(input_size[1]) / input_size[0]
+        if im_ratio > model_ratio:
+            new_height = input_size[1]
+            new_width = int(new_height / im_ratio)
+        else:
+            new_width = input_size[0]
+            new_height = int(new_width * im_ratio)
+        det_scale = float(new_height) / img.shape[0]
+        det_img = np.zeros((input_size[1], input_size[0], 3), dtype=np.uint8)
+        det_img[:new_height, :new_width] = cv2.resize(img, (new_width, new_height))
+        m = self.model
+        blob = cv2.dnn.blobFromImage(det_img, 1.0 / m.input_std, input_size,
+                                     (m.input_mean, m.input_mean, m.input_mean), swapRB=True)
+        return blob, det_scale
+
+    def candidates(self, net_outs, input_size, det_scale):
+        """
+        Decode the anchors scoring at least det_thresh.
+
+        Returns (dets (N, 5) [x1, y1, x2, y2, score], kpss (N, 5, 2) or None)
+        in original image coordinates, sorted by descending score.
+        """
+        m = self.model
+        fmc = m.fmc
+        # Only scrfd.SCRFD handles batched (1, K, C) outputs; RetinaFace has no flag
+        batched = getattr(m, "batched", False)
+        out = (lambda i: net_outs[i][0]) if batched else (lambda i: net_outs[i])
+        dets, kpss = [], []
+        for idx, (stride, centers) in enumerate(self.anchor_centers(input_size)):
+            scores = out(idx).reshape(-1)
+            pos = np.flatnonzero(scores >= m.det_thresh)
+            if pos.size == 0:
+                continue
+            c = centers[pos]
+            dist = out(idx + fmc)[pos] * stride
+            det = np.empty((pos.size, 5), dtype=np.float32)
+            det[:, :2] = c - dist[:, :2]
+            det[:, 2:4] = c + dist[:, 2:4]
+            det[:, 4] = scores[pos]
+            dets.append(det)
+            if m.use_kps:
+                kps = out(idx + fmc * 2)[pos].reshape(-1, 5, 2) * stride + c[:, None, :]
+                kpss.append(kps)
+
+        if not dets:
+            empty_kps = np.zeros((0, 5, 2), np.float32) if m.use_kps else None
+            return np.zeros((0, 5), np.float32), empty_kps
+        dets = np.concatenate(dets)
+        order = np.argsort(-dets[:, 4], kind="stable")
+        dets = dets[order]
+        dets[:, :4] /= det_scale
+        kpss = np.concatenate(kpss)[order] / det_scale if m.use_kps else None
+        return dets, kpss
+
+    def _run(self, img, input_size):
+        input_size = tuple(input_size or self.model.input_size)
+        blob, det_scale = self._preprocess(img, input_size)
+        net_outs = self.model.session.run(self.model.output_names, {self.model.input_name: blob})
+        return self.candidates(net_outs, input_size, det_scale)
+
+    def detect(self, img, input_size=None, max_num=0):
+        """All faces after NMS, like SCRFD.detect (max_num is ignored)."""
+        dets, kpss = self._run(img, input_size)
+        keep = self.model.nms(dets) if len(dets) else []
+        return dets[keep], (kpss[keep] if kpss is not None else None)
+
+    def _single_cluster(self, dets):
+        """True if NMS would keep only dets[0] (IoU as in SCRFD.nms)."""
+        x1, y1, x2, y2 = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3]
+        areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+        w = np.maximum(0.0, np.minimum(x2[0], x2[1:]) - np.maximum(x1[0], x1[1:]) + 1)
+        h = np.maximum(0.0, np.minimum(y2[0], y2[1:]) - np.maximum(y1[0], y1[1:]) + 1)
+        inter = w * h
+        ovr = inter / (areas[0] + areas[1:] - inter)
+        return bool(np.all(ovr > self.model.nms_thresh))
+
+    def detect_largest(self, img, input_size=None):
+        """(bbox [x1, y1, x2, y2, score], kps (5, 2)) of the largest face, or (None, None)."""
+        dets, kpss = self._run(img, input_size)
+        if len(dets) == 0:
+            return None, None
+        if len(dets) > 1 and not self._single_cluster(dets):
+            keep = self.model.nms(dets)
+            dets = dets[keep]
+            kpss = kpss[keep] if kpss is not None else None
+            areas = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+            idx = int(np.argmax(areas))
+        else:
+            idx = 0
+        return dets[idx], (kpss[idx] if kpss is not None else None)
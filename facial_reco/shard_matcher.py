@@ -0,0 +1,458 @@
+"""
+Sharded gallery matching across several matcher processes
+
+For galleries too large for one process to hold or scan, users are
+hash-partitioned (crc32 of the username) across N shard processes. Each
+shard holds only its partition as a normalized matrix and answers "top-k
+for this embedding" over a multiprocessing.connection socket (pickle
+messages, authenticated with SHARD_AUTHKEY). ShardedGallery is the
+coordinator: it sends a query to every shard at once, merges their top-k and
+applies the threshold, with the same (username, similarity) result as
+find_best_match - shards report each user's row in the full gallery, so ties
+go to the earlier-enrolled user as they do there.
+
+A shard that doesn't answer within the timeout is handled by the policy:
+"strict" fails the query (ShardsUnavailable), "partial" answers from the
+shards that did reply as long as at least `min_shards` of them did. A
+partial answer can miss the right user (it lives on the slow shard), so the
+counts are reported in /ready. Each request thread keeps its own connection
+to every shard; a late answer is discarded by its query id.
+
+Shards load their partition at start; restart them to pick up enrollments.
+
+Usage:
+    SHARD_AUTHKEY=secret python shard_matcher.py serve --shard 0 --shards 4 --port 6100 --store gallery.db
+    ...one per shard, then in the API server:
+    MATCHER_SHARDS=127.0.0.1:6100,127.0.0.1:6101,... SHARD_AUTHKEY=secret gunicorn api_server:app
+
+    # Everything locally: N shard processes, checked against a single Gallery
+    python shard_matcher.py local --shards 4 --synthetic 200000 --queries 200
+    python shard_matcher.py local --shards 4 --synthetic 200000 --slow-shard 2 --slow-ms 800
+"""
+import argparse
+import itertools
+import os
+import secrets
+import sys
+import threading
+import time
+import zlib
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+from utils import _to_vec, load_face_db
+
+
+class ShardsUnavailable(RuntimeError):
+    """Too few shards answered in time for the query's policy."""
+
+
+def shard_of(username, shards):
+    """Shard index of a user; stable across processes and restarts."""
+    return zlib.crc32(username.encode("utf-8")) % shards
+
+
+def parse_address(text):
+    host, _, port = text.strip().rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class Shard:
+    """One partition of the gallery: normalized rows plus their global row numbers."""
+
+    def __init__(self, index, shards, usernames, matrix, rows):
+        self.index = index
+        self.shards = shards
+        self.usernames = usernames
+        self.matrix = matrix
+        self.rows = rows
+
+    @classmethod
+    def from_items(cls, index, shards, items, dim=512):
+        """
+        Keep this shard's users from an iterable of (username, embedding) in
+        gallery order, with the same skipping rules as build_gallery_matrix.
+        """
+        usernames, vectors, rows = [], [], []
+        for row, (username, emb) in enumerate(items):
+            if shard_of(username, shards) != index:
+                continue
+            vec = _to_vec(emb).ravel()
+            norm = np.linalg.norm(vec)
+            if vec.size != dim or norm == 0:
+                continue
+            usernames.append(username)
+            vectors.append(vec / norm)
+            rows.append(row)
+        matrix = np.stack(vectors).astype(np.float32) if vectors else np.zeros((0, dim), np.float32)
+        return cls(index, shards, usernames, matrix, np.asarray(rows, dtype=np.int64))
+
+    def top_k(self, q, k):
+        """[(similarity, global row, username)] for the k best users, best first."""
+        n = len(self.usernames)
+        if n == 0 or q.size != self.matrix.shape[1]:
+            return []
+        sims = self.matrix @ q
+        k = min(k, n)
+        best = np.argpartition(-sims, k - 1)[:k] if k < n else np.arange(n)
+        # Ties: the earlier row wins, as in find_best_match
+        best = sorted(best, key=lambda i: (-sims[i], self.rows[i]))
+        return [(float(sims[i]), int(self.rows[i]), self.usernames[i]) for i in best]
+
+
+def _serve_connection(conn, shard, delay_ms):
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            kind = message[0]
+            if kind == "info":
+                reply = ("info", shard.index, shard.shards, len(shard.usernames))
+            elif kind == "topk":
+                _, query_id, q, k = message
+                if delay_ms:
+                    time.sleep(delay_ms / 1000.0)
+                reply = ("topk", query_id, shard.top_k(q, k), len(shard.usernames))
+            else:
+                reply = ("error", f"unknown message {kind!r}")
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                return
+
+
+def serve(shard, address, authkey, delay_ms=0.0):
+    """Accept coordinator connections forever, one thread per connection."""
+    with Listener(address, authkey=authkey) as listener:
+        print(f"🧩 Shard {shard.index}/{shard.shards} serving {len(shard.usernames)} users "
+              f"on {address[0]}:{address[1]}", flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError) as e:
+                # e.g. a client with the wrong authkey
+                print(f"⚠️ Shard {shard.index}: rejected connection ({e})", flush=True)
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, shard, delay_ms),
+                             daemon=True).start()
+
+
+class ShardedGallery:
+    """
+    Coordinator over shard processes; match() has the same contract as
+    find_best_match / Gallery.match.
+    """
+
+    def __init__(self, addresses, authkey, timeout=0.5, policy="partial", min_shards=None,
+                 retry_s=5.0):
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.policy = policy
+        self.min_shards = len(self.addresses) if policy == "strict" else \
+            max(1, min_shards if min_shards is not None else len(self.addresses) - 1)
+        self.retry_s = retry_s
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Don't retry an unreachable shard on every query
+        self._down_until = [0.0] * len(self.addresses)
+        self.sizes = [0] * len(self.addresses)
+        # Whether each shard ever told us its size (0 users is a valid answer)
+        self.reported = [False] * len(self.addresses)
+        self.stats = {"queries": 0, "partial": 0, "failed": 0,
+                      "timeouts": [0] * len(self.addresses),
+                      "unreachable": [0] * len(self.addresses)}
+
+    @classmethod
+    def from_env(cls):
+        spec = os.environ.get("MATCHER_SHARDS")
+        if not spec:
+            return None
+        authkey = os.environ.get("SHARD_AUTHKEY")
+        if not authkey:
+            raise RuntimeError("MATCHER_SHARDS needs SHARD_AUTHKEY")
+        min_shards = os.environ.get("SHARD_MIN")
+        return cls([parse_address(a) for a in spec.split(",") if a.strip()],
+                   authkey.encode(),
+                   timeout=float(os.environ.get("SHARD_TIMEOUT_MS", 500)) / 1000.0,
+                   policy=os.environ.get("SHARD_POLICY", "partial"),
+                   min_shards=int(min_shards) if min_shards else None)
+
+    def _count(self, key, shard=None):
+        with self._lock:
+            if shard is None:
+                self.stats[key] += 1
+            else:
+                self.stats[key][shard] += 1
+
+    def _connection(self, shard):
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            conns = self._local.conns = [None] * len(self.addresses)
+        if conns[shard] is None and time.monotonic() >= self._down_until[shard]:
+            try:
+                conn = Client(self.addresses[shard], authkey=self.authkey)
+                conn.send(("info",))
+                self.sizes[shard] = conn.recv()[3]
+                self.reported[shard] = True
+                conns[shard] = conn
+            except (OSError, EOFError) as e:
+                self._down_until[shard] = time.monotonic() + self.retry_s
+                self._count("unreachable", shard)
+                print(f"⚠️ Shard {shard} at {self.addresses[shard]} unreachable: {e}")
+        return conns[shard]
+
+    def _drop(self, shard):
+        conn = self._local.conns[shard]
+        self._local.conns[shard] = None
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def __len__(self):
+        """
+        Users over all shards, as last reported. Raises ShardsUnavailable if
+        no shard has ever answered: the gallery size is unknown, not zero.
+        """
+        for shard in range(len(self.addresses)):
+            self._connection(shard)
+        if not any(self.reported):
+            raise ShardsUnavailable(f"none of {len(self.addresses)} shards reachable")
+        return sum(self.sizes)
+
+    def top_k(self, query_emb, k=1):
+        """
+        Merged [(similarity, global row, username)] of the k best users over
+        the shards that answered, plus the number that did. Raises
+        ValueError for a zero (or non-finite) embedding.
+        """
+        q = np.asarray(query_emb, dtype=np.float32).ravel()
+        norm = np.linalg.norm(q)
+        if not (np.isfinite(norm) and norm > 0):
+            raise ValueError("query embedding has no direction (zero or non-finite norm)")
+        q = q / norm
+        query_id = next(self._ids)
+        pending = {}
+        for shard in range(len(self.addresses)):
+            conn = self._connection(shard)
+            if conn is None:
+                continue
+            try:
+                conn.send(("topk", query_id, q, k))
+                pending[conn] = shard
+            except (OSError, EOFError):
+                self._drop(shard)
+
+        merged, answered = [], 0
+        deadline = time.monotonic() + self.timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for conn in wait(list(pending), remaining):
+                shard = pending[conn]
+                try:
+                    reply = conn.recv()
+                except (OSError, EOFError):
+                    del pending[conn]
+                    self._drop(shard)
+                    continue
+                if reply[0] != "topk" or reply[1] != query_id:
+                    continue  # late answer to a query that already timed out
+                del pending[conn]
+                merged.extend(reply[2])
+                self.sizes[shard] = reply[3]
+                self.reported[shard] = True
+                answered += 1
+        for shard in pending.values():
+            # Its answer is skipped by query id when this connection is next used
+            self._count("timeouts", shard)
+
+        merged.sort(key=lambda hit: (-hit[0], hit[1]))
+        return merged[:k], answered
+
+    def match(self, query_emb: np.ndarray, threshold: float = 0.45):
+        if query_emb is None:
+            return None, None
+        q = np.asarray(query_emb, dtype=np.float32).ravel()
+        norm = np.linalg.norm(q)
+        if not (np.isfinite(norm) and norm > 0):
+            return None, None
+
+        self._count("queries")
+        hits, answered = self.top_k(q, 1)
+        if answered < self.min_shards:
+            self._count("failed")
+            raise ShardsUnavailable(f"{answered}/{len(self.addresses)} shards answered "
+                                    f"within {self.timeout * 1000:.0f} ms")
+        if answered < len(self.addresses):
+            self._count("partial")
+        if not hits:
+            return None, -1.0
+        best_sim, _, username = hits[0]
+        if best_sim < threshold:
+            return None, best_sim
+        return username, best_sim
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "shards": len(self.addresses),
+                "users": list(self.sizes),
+                "policy": self.policy,
+                "min_shards": self.min_shards,
+                "timeout_ms": round(self.timeout * 1000),
+                "queries": self.stats["queries"],
+                "partial": self.stats["partial"],
+                "failed": self.stats["failed"],
+                "timeouts": list(self.stats["timeouts"]),
+                "unreachable": list(self.stats["unreachable"]),
+            }
+
+
+def _items_from_args(args):
+    if args.store:
+        from gallery_store import GalleryStore
+        return GalleryStore(args.store).iter_embeddings()
+    db = load_face_db(args.db)
+    return ((u, rec["embedding"]) for u, rec in db.items() if "embedding" in rec)
+
+
+def _run_shard(index, shards, usernames, matrix, address, authkey, delay_ms):
+    serve(Shard.from_items(index, shards, zip(usernames, matrix), matrix.shape[1]),
+          address, authkey, delay_ms)
+
+
+def start_local_shards(usernames, matrix, shards, base_port, authkey, delays=None):
+    """Start `shards` local shard processes on consecutive ports; returns (processes, addresses)."""
+    processes, addresses = [], []
+    for index in range(shards):
+        address = ("127.0.0.1", base_port + index)
+        proc = Process(target=_run_shard, daemon=True,
+                       args=(index, shards, usernames, matrix, address, authkey,
+                             (delays or {}).get(index, 0.0)))
+        proc.start()
+        processes.append(proc)
+        addresses.append(address)
+    return processes, addresses
+
+
+def wait_for_shards(addresses, authkey, users, wait_s=120.0, **options):
+    """Return a ShardedGallery once the shards at `addresses` report `users` users in total."""
+    started = time.monotonic()
+    while True:
+        # Fresh coordinator each try: a refused connect marks a shard down for retry_s
+        coordinator = ShardedGallery(addresses, authkey, **options)
+        try:
+            if len(coordinator) == users:
+                return coordinator
+        except ShardsUnavailable:
+            pass
+        if time.monotonic() - started > wait_s:
+            raise ShardsUnavailable(f"shards did not come up within {wait_s:.0f}s")
+        time.sleep(0.2)
+
+
+def run_local(args):
+    """Start local shards, check ShardedGallery against Gallery.match, report latency."""
+    from utils import Gallery, build_gallery_matrix
+    if args.synthetic:
+        from bench_gallery import synthetic_gallery, synthetic_queries
+        usernames, matrix = synthetic_gallery(args.synthetic, 512, 32, 0)
+        queries = synthetic_queries(matrix, args.queries, 0)
+    else:
+        usernames, matrix = build_gallery_matrix(dict(
+            (u, {"embedding": e}) for u, e in _items_from_args(args)))
+        rng = np.random.default_rng(0)
+        picks = matrix[rng.integers(0, len(matrix), args.queries)]
+        queries = picks + rng.normal(0, 0.03, picks.shape).astype(np.float32)
+
+    authkey = secrets.token_bytes(16)
+    delays = {args.slow_shard: args.slow_ms} if args.slow_shard is not None else None
+    processes, addresses = start_local_shards(usernames, matrix, args.shards, args.port,
+                                              authkey, delays)
+    try:
+        try:
+            coordinator = wait_for_shards(addresses, authkey, len(usernames),
+                                          timeout=args.timeout_ms / 1000.0,
+                                          policy=args.policy, min_shards=args.min_shards)
+        except ShardsUnavailable as e:
+            raise SystemExit(f"Shards did not come up: {e}")
+        print(f"🧩 {args.shards} shards up, {coordinator.sizes} users")
+
+        reference = Gallery(usernames, matrix)
+        latencies, mismatches, failed = [], 0, 0
+        for q in queries:
+            expected = reference.match(q, threshold=args.threshold)
+            t0 = time.perf_counter()
+            try:
+                got = coordinator.match(q, threshold=args.threshold)
+            except ShardsUnavailable:
+                failed += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+            if got[0] != expected[0] or abs(got[1] - expected[1]) > 1e-4:
+                mismatches += 1
+        lat = np.asarray(latencies) * 1000
+        reference_ms = []
+        for q in queries[:50]:
+            t0 = time.perf_counter()
+            reference.match(q, threshold=args.threshold)
+            reference_ms.append((time.perf_counter() - t0) * 1000)
+        if len(lat):
+            print(f"sharded: p50 {np.percentile(lat, 50):.2f} ms, p99 {np.percentile(lat, 99):.2f} ms; "
+                  f"single process: p50 {np.median(reference_ms):.2f} ms")
+        print(f"{len(queries)} queries: {mismatches} differ from Gallery.match, {failed} failed; "
+              f"{coordinator.snapshot()}")
+        return 1 if mismatches and args.slow_shard is None else 0
+    finally:
+        for proc in processes:
+            proc.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded gallery matching")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    srv = sub.add_parser("serve", help="run one shard")
+    srv.add_argument("--shard", type=int, required=True)
+    srv.add_argument("--shards", type=int, required=True)
+    srv.add_argument("--host", default="127.0.0.1")
+    srv.add_argument("--port", type=int, default=6100)
+    srv.add_argument("--db", default="database.json")
+    srv.add_argument("--store", default=None, help="SQLite gallery store instead of --db")
+    srv.add_argument("--delay-ms", type=float, default=0.0, help="testing: slow every answer down")
+
+    local = sub.add_parser("local", help="start N local shards and check them against Gallery")
+    local.add_argument("--shards", type=int, default=4)
+    local.add_argument("--port", type=int, default=6100, help="first shard's port")
+    local.add_argument("--db", default="database.json")
+    local.add_argument("--store", default=None)
+    local.add_argument("--synthetic", type=int, default=0, help="use N synthetic users")
+    local.add_argument("--queries", type=int, default=200)
+    local.add_argument("--threshold", type=float, default=0.45)
+    local.add_argument("--timeout-ms", type=float, default=500)
+    local.add_argument("--policy", choices=("partial", "strict"), default="partial")
+    local.add_argument("--min-shards", type=int, default=None)
+    local.add_argument("--slow-shard", type=int, default=None, help="shard to slow down")
+    local.add_argument("--slow-ms", type=float, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "local":
+        return run_local(args)
+
+    authkey = os.environ.get("SHARD_AUTHKEY")
+    if not authkey:
+        raise SystemExit("Set SHARD_AUTHKEY (shared with the coordinator)")
+    shard = Shard.from_items(args.shard, args.shards, _items_from_args(args))
+    serve(shard, (args.host, args.port), authkey.encode(), args.delay_ms)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+Gallery shared across worker processes
+
+The normalized embedding matrix is stored once in a named POSIX shared-memory
+segment; every gunicorn worker attaches to it read-only instead of parsing and
+holding its own copy, so gallery memory does not grow with the worker count.
+
+Layout:
+    <prefix>_ctl       current generation (uint64), then the mtime and a
+                       digest of the source it was published from
+    <prefix>_g<gen>    one gallery blob (see pack_gallery) per generation
+
+Publishing writes a complete new generation segment, then flips the
+generation counter, then unlinks the old segment. Readers check the counter on
+each request and re-attach when it moves; a mapping that is already attached
+stays valid after unlink, so in-flight matches are never torn.
+
+Segments outlive the workers (a restart attaches to what is there), so each
+process compares its database source with the one recorded in the control
+block the first time it attaches: if the source differs and is at least as
+new (e.g. database.json was updated before the restart), it republishes.
+A gallery published from a newer file with the CLI is kept.
+
+The same blob format is used for gallery files on disk (save_gallery_file /
+load_gallery_file), which are opened with mmap. open_quantized keeps the
+int8 scan codes and the exact matrix of a QuantizedGallery in such files.
+
+CLI:
+    python shared_gallery.py publish database.json   # swap in a new gallery
+    python shared_gallery.py info
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from utils import Gallery, QuantizedGallery, build_gallery_matrix, load_face_db, quantize_int8
+
+MAGIC = b"MQGAL001"
+# magic, dim, count, generation, names_len
+HEADER = struct.Struct("<8sIQQQ")
+ALIGN = 64
+# generation, source mtime, source digest
+CTL = struct.Struct("<Qd16s")
+
+DEFAULT_PREFIX = "mq_gallery"
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def lock_exclusive(lock_file):
+    """Block until this process holds an exclusive lock on lock_file (an open file)."""
+    try:
+        import fcntl
+    except ImportError:
+        # Windows (start_api.bat): lock the first byte; LK_LOCK gives up after 10 s
+        import msvcrt
+        lock_file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+
+def gallery_nbytes(usernames, matrix):
+    names = json.dumps(list(usernames)).encode("utf-8")
+    return _align(HEADER.size + len(names)) + matrix.nbytes, names
+
+
+def pack_gallery(buf, usernames, matrix, generation=0):
+    """Write a gallery blob into a writable buffer (bytearray / shm / mmap)."""
+    size, names = gallery_nbytes(usernames, matrix)
+    count, dim = matrix.shape
+    HEADER.pack_into(buf, 0, MAGIC, dim, count, generation, len(names))
+    buf[HEADER.size:HEADER.size + len(names)] = names
+    offset = _align(HEADER.size + len(names))
+    target = np.ndarray((count, dim), dtype=np.float32, buffer=buf, offset=offset)
+    target[:] = matrix
+    return size
+
+
+def unpack_gallery(buf):
+    """
+    Read a gallery blob without copying the matrix.
+
+    Returns (usernames, read-only (N, D) float32 view, generation).
+    """
+    magic, dim, count, generation, names_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a gallery blob (bad magic)")
+    usernames = json.loads(bytes(buf[HEADER.size:HEADER.size + names_len]).decode("utf-8"))
+    offset = _align(HEADER.size + names_len)
+    matrix = np.ndarray((count, dim), dtype=np.float32, buffer=buf, offset=offset)
+    matrix.flags.writeable = False
+    return usernames, matrix, generation
+
+
+def save_gallery_file(path, usernames, matrix, generation=0):
+    """Atomically write a gallery blob file (temp file + rename)."""
+    size, _ = gallery_nbytes(usernames, matrix)
+    buf = bytearray(size)
+    pack_gallery(buf, usernames, matrix, generation)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".gallery-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def load_gallery_file(path):
+    """mmap a gallery blob file. Returns (Gallery, generation)."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    usernames, matrix, generation = unpack_gallery(mm)
+    gallery = Gallery(usernames, matrix)
+    gallery._mmap = mm  # keep the mapping alive as long as the gallery
+    return gallery, generation
+
+
+def gallery_digest(usernames, matrix):
+    """Short content digest of a gallery (names files in open_quantized)."""
+    digest = hashlib.sha256(json.dumps(list(usernames)).encode("utf-8"))
+    digest.update(np.ascontiguousarray(matrix, dtype=np.float32).data)
+    return digest.hexdigest()[:16]
+
+
+def _save_codes(base, matrix):
+    """
+    Write <base>.scales.npy and <base>.codes.npy (int8 codes, see
+    utils.quantize_int8) through memmaps, so no heap copy is made; each is
+    renamed into place, codes last, which marks the set complete.
+    """
+    tmps = {}
+    try:
+        for suffix in (".scales.npy", ".codes.npy"):
+            fd, tmps[suffix] = tempfile.mkstemp(dir=os.path.dirname(base), prefix=".codes-")
+            os.close(fd)
+        open_memmap = np.lib.format.open_memmap
+        scales = open_memmap(tmps[".scales.npy"], mode="w+", dtype=np.float32,
+                             shape=(matrix.shape[0],))
+        codes = open_memmap(tmps[".codes.npy"], mode="w+", dtype=np.int8, shape=matrix.shape)
+        quantize_int8(matrix, codes=codes, scales=scales)
+        scales.flush()
+        codes.flush()
+        for suffix, tmp in tmps.items():
+            os.replace(tmp, base + suffix)
+    finally:
+        for tmp in tmps.values():
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+
+def open_quantized(gallery, cache_dir, candidates=32):
+    """
+    QuantizedGallery whose int8 codes and exact float32 matrix are mmap'd
+    from files in `cache_dir`, so every worker shares one copy through the
+    page cache and only the re-ranked rows of the float32 matrix are paged
+    in. Files are named after gallery_digest; the first process to need them
+    writes them (under a lock), the others just map them. Files of other
+    galleries in the directory are removed then.
+
+    A gallery that is already a shared-memory or file mapping is used for the
+    re-rank as-is instead of being written out again.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    key = gallery_digest(gallery.usernames, gallery.matrix)
+    base = os.path.join(cache_dir, key)
+    mapped = getattr(gallery, "_segment", None) is not None or \
+        getattr(gallery, "_mmap", None) is not None
+    matrix = gallery.matrix
+    with open(os.path.join(cache_dir, ".lock"), "w") as lock_file:
+        lock_exclusive(lock_file)
+        if not mapped and not os.path.exists(base + ".gal"):
+            save_gallery_file(base + ".gal", gallery.usernames, matrix)
+        if not os.path.exists(base + ".codes.npy"):
+            _save_codes(base, matrix)
+            for name in os.listdir(cache_dir):
+                if not name.startswith((key, ".")):
+                    # Processes still mapping an old set keep it until they swap
+                    os.unlink(os.path.join(cache_dir, name))
+
+    exact = gallery if mapped else load_gallery_file(base + ".gal")[0]
+    quantized = QuantizedGallery(exact.usernames, exact.matrix,
+                                 np.load(base + ".codes.npy", mmap_mode="r"),
+                                 np.load(base + ".scales.npy", mmap_mode="r"), candidates)
+    quantized._exact_gallery = exact  # keeps the mapping alive
+    return quantized
+
+
+def source_of_file(path):
+    """(mtime, digest) of a database file, for get_or_publish()."""
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).digest()[:16]
+    return os.path.getmtime(path), digest
+
+
+def source_of_text(text):
+    """(0, digest) of a database given inline (e.g. FACE_DB_JSON): never newer than a file."""
+    return 0.0, hashlib.sha256(text.encode("utf-8")).digest()[:16]
+
+
+def _untrack(shm):
+    # We manage segment lifetime explicitly; without this, the resource
+    # tracker of whichever process exits first would unlink the segment.
+    try:
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+    except Exception:
+        pass
+
+
+def _segment(name, create=False, size=0):
+    """SharedMemory that no resource tracker will unlink (track=False on 3.13+)."""
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        _untrack(shm)
+        return shm
+
+
+class _ReadOnlySegment:
+    """Read-only view of an existing segment; raises FileNotFoundError if absent."""
+
+    def __init__(self, name):
+        if os.path.isdir("/dev/shm"):
+            # Linux: the segment is a file; map it read-only
+            with open(os.path.join("/dev/shm", name), "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buf = memoryview(self._mmap)
+        else:
+            self._shm = _segment(name)
+            self.buf = self._shm.buf.toreadonly()
+
+    def __len__(self):
+        return len(self.buf)
+
+
+def _unlink_segment(name):
+    try:
+        # Attach (and track) just to unlink, which also untracks it again
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+class SharedGallery:
+    """Publish / attach a gallery in named shared memory."""
+
+    def __init__(self, prefix=DEFAULT_PREFIX):
+        self.prefix = prefix
+        self.lock_path = os.path.join(tempfile.gettempdir(), f"{prefix}.lock")
+        self._lock = threading.Lock()
+        self._ctl = None
+        self._generation = None
+        self._gallery = None
+        self._source_checked = False
+
+    def _segment_name(self, generation):
+        return f"{self.prefix}_g{generation}"
+
+    @property
+    def _ctl_name(self):
+        return f"{self.prefix}_ctl"
+
+    def _read_ctl(self):
+        """(generation, source mtime, source digest); generation 0 if nothing was published."""
+        if self._ctl is None:
+            try:
+                self._ctl = _ReadOnlySegment(self._ctl_name)
+            except FileNotFoundError:
+                return 0, 0.0, b""
+        return CTL.unpack_from(self._ctl.buf, 0)
+
+    def generation(self):
+        """Current published generation, or 0 if nothing was published."""
+        return self._read_ctl()[0]
+
+    def _publish_locked(self, usernames, matrix, source=None):
+        """Publish a new generation; caller holds the publisher file lock."""
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        mtime, digest = source or (0.0, b"")
+        try:
+            ctl = _segment(self._ctl_name)
+        except FileNotFoundError:
+            ctl = _segment(self._ctl_name, create=True, size=CTL.size)
+            CTL.pack_into(ctl.buf, 0, 0, 0.0, b"")
+        try:
+            old = struct.unpack_from("<Q", ctl.buf, 0)[0]
+            new = old + 1
+
+            size, _ = gallery_nbytes(usernames, matrix)
+            segment = _segment(self._segment_name(new), create=True, size=size)
+            pack_gallery(segment.buf, usernames, matrix, new)
+            segment.close()
+
+            # Atomic swap: readers pick up the new generation from here on
+            # (source first; it is only compared once the generation moved)
+            struct.pack_into("<d16s", ctl.buf, 8, mtime, digest)
+            struct.pack_into("<Q", ctl.buf, 0, new)
+        finally:
+            ctl.close()
+        self._ctl = None
+
+        if old:
+            # Processes that already mapped the old generation keep it until
+            # they re-attach; the name just goes away.
+            _unlink_segment(self._segment_name(old))
+        return new
+
+    def publish(self, usernames, matrix, source=None):
+        """Publish a new generation. Returns the new generation number."""
+        with open(self.lock_path, "w") as lock_file:
+            lock_exclusive(lock_file)
+            return self._publish_locked(usernames, matrix, source)
+
+    def publish_db(self, db, source=None):
+        return self.publish(*build_gallery_matrix(db), source=source)
+
+    def _outdated(self, source):
+        """True if `source` differs from the published one and is at least as new."""
+        generation, mtime, digest = self._read_ctl()
+        return generation == 0 or (digest != source[1] and source[0] >= mtime)
+
+    def current(self):
+        """
+        Return the Gallery for the current generation, attaching if it moved.
+
+        Returns None if nothing has been published yet.
+        """
+        generation = self.generation()
+        if generation == 0:
+            return None
+        if generation == self._generation:
+            return self._gallery
+        with self._lock:
+            generation = self.generation()
+            if generation != self._generation:
+                try:
+                    segment = _ReadOnlySegment(self._segment_name(generation))
+                except FileNotFoundError:
+                    # Swapped again between reading the counter and attaching
+                    return self._gallery
+                usernames, matrix, _ = unpack_gallery(segment.buf)
+                # The old mapping is released once no request holds the
+                # previous Gallery any more
+                self._gallery = Gallery(usernames, matrix)
+                self._gallery._segment = segment
+                self._generation = generation
+        return self._gallery
+
+    def get_or_publish(self, load_db, source=None):
+        """
+        Attach to the current gallery; if none exists yet, call load_db() and
+        publish it. Only one process publishes, the others wait and attach.
+
+        With a `source` ((mtime, digest), see source_of_file), the first call
+        in a process also republishes if the published gallery came from a
+        different, older source - e.g. a segment left over from before the
+        database was updated and the workers restarted.
+        """
+        gallery = self.current()
+        if gallery is not None and (source is None or self._source_checked):
+            return gallery
+        if gallery is None or self._outdated(source):
+            with open(self.lock_path, "w") as lock_file:
+                lock_exclusive(lock_file)
+                if self.generation() == 0 or (source is not None and self._outdated(source)):
+                    self._publish_locked(*build_gallery_matrix(load_db() or {}), source)
+        self._source_checked = True
+        return self.current()
+
+    def destroy(self):
+        """Unlink the current segment and the control block."""
+        _unlink_segment(self._segment_name(self.generation()))
+        _unlink_segment(self._ctl_name)
+        self._ctl = None
+        self._generation = None
+        self._gallery = None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("publish", "info", "destroy"):
+        print("Usage: python shared_gallery.py publish database.json | info | destroy")
+        sys.exit(1)
+
+    shared = SharedGallery(os.environ.get("SHARED_GALLERY_PREFIX", DEFAULT_PREFIX))
+    if sys.argv[1] == "publish":
+        path = sys.argv[2] if len(sys.argv) > 2 else "database.json"
+        db = load_face_db(path)
+        generation = shared.publish_db(db, source=source_of_file(path))
+        print(f"✅ Published {len(db)} users as generation {generation}")
+    elif sys.argv[1] == "info":
+        gallery = shared.current()
+        if gallery is None:
+            print("No gallery published")
+        else:
+            print(f"Generation {shared.generation()}: {len(gallery)} users, "
+                  f"{gallery.matrix.nbytes / 1024:.1f} KB matrix")
+    else:
+        shared.destroy()
+        print("🗑️ Shared gallery removed")
@@ -0,0 +1,116 @@
+"""
+Stub face engine for benchmarking the serving layer without models
+
+With FACE_ENGINE_STUB=1, api_server uses StubFaceEngine instead of loading the
+ONNX models. It runs the real FaceEngine code paths (ROI handling, decode
+scaling, alignment, batching) over a trivial detector and recognizer that
+understand the synthetic faces drawn by synthetic_face():
+
+- the "face" is the only region whose red channel is above FACE_RED_MIN;
+  the detector returns its bounding box with landmarks at the ArcFace
+  template positions scaled into that box
+- the identity is encoded in the face's blue/green colour; the recognizer
+  turns the mean colour of the aligned crop into a fixed random unit vector,
+  so the same identity always embeds to the same vector
+
+STUB_DETECT_MS and STUB_EMBED_MS add a sleep per call (released GIL, like
+ONNX Runtime) to stand in for model latency.
+"""
+import os
+import time
+
+import numpy as np
+
+from utils import ARCFACE_TEMPLATE, FaceEngine
+
+FACE_RED_MIN = 200
+DIM = 512
+
+
+def identity_color(identity):
+    """(blue, green) of an identity: 16 x 16 distinguishable levels."""
+    return 8 + 16 * (identity % 16), 8 + 16 * ((identity // 16) % 16)
+
+
+def identity_embedding(blue, green):
+    """Fixed unit vector for a (blue, green) colour, snapped to the grid."""
+    level = lambda v: int(np.clip(v, 0, 255)) // 16
+    rng = np.random.default_rng(level(blue) * 16 + level(green))
+    vec = rng.standard_normal(DIM).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def synthetic_face(identity=None, size=(480, 640), face_frac=0.4, seed=0):
+    """
+    A BGR frame with noise background and, unless identity is None, one
+    "face" for that identity (0-255) at a seed-dependent position.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = size
+    frame = rng.integers(0, 120, (height, width, 3), dtype=np.uint8)
+    if identity is None:
+        return frame
+    side = int(min(height, width) * face_frac)
+    y = int(rng.integers(0, height - side))
+    x = int(rng.integers(0, width - side))
+    blue, green = identity_color(identity)
+    frame[y:y + side, x:x + side] = (blue, green, 230)
+    return frame
+
+
+class StubDetector:
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+
+    def detect(self, img, input_size=None, max_num=0):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        ys, xs = np.nonzero(img[:, :, 2] >= FACE_RED_MIN)
+        if len(xs) == 0:
+            return np.zeros((0, 5), np.float32), np.zeros((0, 5, 2), np.float32)
+        x1, y1, x2, y2 = xs.min(), ys.min(), xs.max() + 1, ys.max() + 1
+        kps = ARCFACE_TEMPLATE / 112.0 * np.array([x2 - x1, y2 - y1]) + np.array([x1, y1])
+        bbox = np.array([[x1, y1, x2, y2, 0.99]], dtype=np.float32)
+        return bbox, kps[None].astype(np.float32)
+
+
+class StubRecognizer:
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+
+    def get_feat(self, imgs):
+        if not isinstance(imgs, list):
+            imgs = [imgs]
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        feats = []
+        for img in imgs:
+            # Centre of the crop only: alignment pads the edges with black
+            h, w = img.shape[:2]
+            blue, green, _ = img[h // 4:3 * h // 4, w // 4:3 * w // 4].reshape(-1, 3).mean(axis=0)
+            # Raw ArcFace features have norms around 20; keep the quality check happy
+            feats.append(identity_embedding(blue, green) * 20.0)
+        return np.stack(feats)
+
+
+class StubFaceEngine(FaceEngine):
+    """FaceEngine over StubDetector / StubRecognizer; no model files needed."""
+
+    def __init__(self, det_input_size=(640, 640), roi_input_size=(320, 320),
+                 detect_ms=None, embed_ms=None):
+        self.det_input_size = det_input_size
+        self.roi_input_size = roi_input_size
+        self._init_stats()
+        if detect_ms is None:
+            detect_ms = float(os.environ.get("STUB_DETECT_MS", 0))
+        if embed_ms is None:
+            embed_ms = float(os.environ.get("STUB_EMBED_MS", 0))
+        self.detector = StubDetector(detect_ms)
+        self.recognizer = StubRecognizer(embed_ms)
+        self.light_detector = None
+
+
+def stub_gallery_db(identities):
+    """A database.json-style dict enrolling `identities` as user<N>."""
+    return {f"user{i}": {"embedding": identity_embedding(*identity_color(i)).tolist()}
+            for i in identities}
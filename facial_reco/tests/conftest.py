@@ -0,0 +1,50 @@
+"""
+Shared test setup: the facial_reco modules import each other as top-level
+modules, and api_server / async_server run on the stub engine with a small
+synthetic gallery (no models, no downloads, no background warm-up).
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_engine import stub_gallery_db, synthetic_face  # noqa: E402
+
+os.environ.setdefault("FACE_ENGINE_STUB", "1")
+os.environ.setdefault("WARMUP_ON_START", "0")
+os.environ.setdefault("FACE_DB_JSON", json.dumps(stub_gallery_db(range(8))))
+
+
+def call(method, path, body=b"", headers=(), query=b""):
+    """Run one request through the ASGI app; returns (status, headers, body)."""
+    messages = []
+    chunks = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return chunks.pop(0) if chunks else {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": [(k.lower(), v) for k, v in headers]}
+    import async_server
+    asyncio.run(async_server.app(scope, receive, send))
+    start, body_message = messages
+    return start["status"], dict(start["headers"]), body_message["body"]
+
+
+def jpeg_b64(frame):
+    import cv2
+    return base64.b64encode(cv2.imencode(".jpg", frame)[1].tobytes()).decode("ascii")
+
+
+@pytest.fixture
+def face_b64():
+    """A synthetic face of enrolled identity 3, base64 JPEG."""
+    return jpeg_b64(synthetic_face(3))
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+import api_server
+from admission import AdmissionController, Overloaded
+
+
+def test_queue_full_is_refused_without_blocking():
+    admission = AdmissionController(max_inflight=1, max_queue=1)
+    first = admission.begin(admission.reserve())
+    admission.reserve()  # waits in the queue
+    started = time.monotonic()
+    with pytest.raises(Overloaded) as e:
+        admission.reserve()
+    assert time.monotonic() - started < 0.1
+    assert e.value.reason == "queue full" and 1 <= e.value.retry_after <= 30
+    assert admission.saturated and admission.rejected == 1
+    admission.release(first)
+
+
+def test_cancel_gives_the_place_back():
+    admission = AdmissionController(max_inflight=1, max_queue=0)
+    ticket = admission.reserve()
+    admission.cancel(ticket)
+    admission.release(admission.begin(admission.reserve()))
+    assert admission.snapshot()["queued"] == 0 and admission.admitted == 1
+
+
+def test_waiter_gets_the_freed_slot():
+    admission = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=5)
+    holder = admission.begin(admission.reserve())
+    admitted = threading.Event()
+
+    def waiter():
+        with admission.admit():
+            admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not admitted.wait(0.2)
+    assert admission.queued == 1
+    admission.release(holder)
+    assert admitted.wait(5)
+    thread.join()
+    assert admission.inflight == 0 and admission.queued == 0
+
+
+def test_queue_timeout_sheds_the_waiter():
+    admission = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=0.1)
+    holder = admission.begin(admission.reserve())
+    with pytest.raises(Overloaded) as e:
+        with admission.admit():
+            pass
+    assert e.value.reason == "queue timeout" and admission.timed_out == 1
+    # Non-waiting begin (ASGI): a ticket older than queue_timeout is shed too
+    ticket = admission.reserve()
+    time.sleep(0.15)
+    admission.release(holder)
+    with pytest.raises(Overloaded):
+        admission.begin(ticket)
+    assert admission.inflight == 0 and admission.queued == 0
+
+
+def test_retry_after_follows_service_time():
+    admission = AdmissionController(max_inflight=2, max_queue=4)
+    admission._service_s = 10.0
+    admission.queued = 3
+    assert admission.retry_after() == 20
+    admission._service_s = 1000.0
+    assert admission.retry_after() == 30
+
+
+def test_overloaded_recognize_is_503_with_retry_after(monkeypatch, face_b64):
+    monkeypatch.setattr(api_server, "admission", AdmissionController(max_inflight=0, max_queue=0))
+    response = api_server.app.test_client().post("/recognize", json={"image": face_b64})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.get_json()["reason"] == "queue full"
+
+
+@pytest.fixture
+def async_server_env(monkeypatch):
+    """async_server re-imported with the given environment, restored afterwards."""
+    import importlib
+    import async_server
+
+    def load(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return importlib.reload(async_server)
+
+    yield load
+    monkeypatch.undo()
+    importlib.reload(async_server)
+
+
+def test_async_inference_pool_enforces_max_inflight(async_server_env):
+    server = async_server_env(MAX_INFLIGHT="1", INFERENCE_THREADS="4", MAX_QUEUE="8")
+    assert server.inference_executor._max_workers == 1
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    def handler(deadline):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0], server.admission.inflight)
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return {"ok": True}, 200
+
+    futures = [server.inference_executor.submit(server.run_admitted, server.admission.reserve(),
+                                                None, handler) for _ in range(6)]
+    assert [f.result()[1] for f in futures] == [200] * 6
+    assert peak[0] == 1 and server.admission.inflight == 0
+    server.inference_executor.shutdown()
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+import api_server
+
+FACIAL_RECO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_is_light_and_portable():
+    # fcntl is blocked as on Windows; heavy modules must not load at import
+    code = ("import sys; sys.modules['fcntl'] = None; import api_server; "
+            "print(sorted(m for m in ('numpy', 'cv2', 'insightface', 'onnxruntime', 'requests') "
+            "if m in sys.modules))")
+    env = dict(os.environ, WARMUP_ON_START="0")
+    out = subprocess.run([sys.executable, "-c", code], cwd=FACIAL_RECO, env=env,
+                         capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_warm_up_makes_the_worker_ready():
+    client = api_server.app.test_client()
+    assert client.get("/health").status_code == 200
+    api_server.warm_up()
+    response = client.get("/ready")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["ready"] and {"load_engine", "load_gallery"} <= set(body["timings_ms"])
+
@@ -0,0 +1,45 @@
+import asyncio
+import json
+
+import async_server
+from conftest import call
+
+
+def test_health_and_unknown_path():
+    status, headers, body = call("GET", "/health")
+    assert status == 200
+    assert json.loads(body)["status"] == "ok"
+    assert headers[b"access-control-allow-origin"] == b"*"
+    assert call("GET", "/nope")[0] == 404
+
+
+def test_preflight_and_wrong_method():
+    status, headers, body = call("OPTIONS", "/recognize")
+    assert status == 204
+    assert body == b""
+    assert headers[b"access-control-allow-methods"] == b"POST, OPTIONS"
+    assert call("GET", "/recognize")[0] == 405
+
+
+def test_recognize_runs_on_the_inference_pool(face_b64):
+    status, _, body = call("POST", "/recognize", json.dumps({"image": face_b64}).encode())
+    assert status == 200
+    result = json.loads(body)
+    assert result["success"] and result["username"] == "user3"
+
+
+def test_recognize_rejects_bad_bodies():
+    assert call("POST", "/recognize", b"not json")[0] == 400
+    assert call("POST", "/recognize", b"")[0] == 400
+
+
+def test_read_body_enforces_the_limit():
+    def receiver(*parts):
+        messages = [{"type": "http.request", "body": p, "more_body": i < len(parts) - 1}
+                    for i, p in enumerate(parts)]
+        async def receive():
+            return messages.pop(0)
+        return receive
+
+    assert asyncio.run(async_server.read_body(receiver(b"ab", b"cd"), limit=4)) == b"abcd"
+    assert asyncio.run(async_server.read_body(receiver(b"ab", b"cde"), limit=4)) is None
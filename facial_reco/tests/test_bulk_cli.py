@@ -0,0 +1,71 @@
+import cv2
+import pytest
+
+import enroll
+import identify
+import utils
+from stub_engine import StubFaceEngine, stub_gallery_db, synthetic_face
+from utils import Gallery
+
+
+@pytest.mark.parametrize("module, args", [(enroll, ("det.onnx", "rec.onnx", -1)),
+                                          (identify, ("db.json", "det.onnx", "rec.onnx", -1))])
+def test_workers_run_single_threaded(monkeypatch, module, args):
+    created = {}
+    monkeypatch.setattr(utils, "FaceEngine", lambda **kw: created.update(kw))
+    monkeypatch.setattr(utils.cv2, "setNumThreads", lambda n: created.update(cv2_threads=n))
+    monkeypatch.setattr(identify, "load_face_db", lambda path: {})
+    module._init_worker(*args)
+    assert created["intra_op_threads"] == 1 and created["cv2_threads"] == 1
+
+
+@pytest.fixture
+def stub_worker(monkeypatch):
+    monkeypatch.setattr(identify, "_engine", StubFaceEngine())
+    monkeypatch.setattr(identify, "_gallery", Gallery.from_db(stub_gallery_db(range(8))))
+    monkeypatch.setattr(enroll, "_engine", StubFaceEngine())
+
+
+def test_identify_decodes_paths_and_bytes_in_the_worker(tmp_path, stub_worker):
+    (tmp_path / "b").mkdir()
+    cv2.imwrite(str(tmp_path / "a.jpg"), synthetic_face(3))
+    cv2.imwrite(str(tmp_path / "b" / "c.png"), synthetic_face(None))
+    (tmp_path / "b" / "empty.jpg").write_bytes(b"")
+    items = list(identify.iter_images(str(tmp_path)))
+    assert all(isinstance(source, str) for _, source in items)
+
+    frame_bytes = cv2.imencode(".jpg", synthetic_face(5, seed=1))[1].tobytes()
+    items.append(({"source": "clip.mp4", "frame": 0, "time_s": 0.0}, frame_bytes))
+    rows = identify.identify_batch(items)
+    assert [(r["face"], r["user"]) for r in rows] == \
+        [(True, "user3"), (False, None), (False, None), (True, "user5")]
+    assert rows[2]["error"] == "unreadable"
+
+
+def test_video_frames_are_sent_as_jpeg(tmp_path, stub_worker):
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (640, 480))
+    if not writer.isOpened():
+        pytest.skip("no video encoder")
+    for i in range(6):
+        writer.write(synthetic_face(2 if i < 3 else None, seed=i))
+    writer.release()
+
+    items = list(identify.iter_video(path, every=2))
+    assert [meta["frame"] for meta, _ in items] == [0, 2, 4]
+    assert all(isinstance(source, bytes) for _, source in items)
+    rows = identify.identify_batch(items)
+    assert [r["user"] for r in rows] == ["user2", "user2", None]
+
+
+def test_enroll_embeds_a_users_photos(tmp_path, stub_worker):
+    for i in range(3):
+        cv2.imwrite(str(tmp_path / f"{i}.jpg"), synthetic_face(4, seed=i))
+    (tmp_path / "none.jpg").write_bytes(cv2.imencode(".jpg", synthetic_face(None))[1].tobytes())
+    paths = sorted(str(p) for p in tmp_path.iterdir())
+    username, embeddings, stats = enroll.embed_user("user4", paths, batch_size=2)
+    assert username == "user4" and len(embeddings) == 3
+    assert stats == {"images": 4, "unreadable": 0, "no_face": 1, "low_quality": 0}
+    template, used = enroll.aggregate(embeddings, method="cluster")
+    assert used == 3
+    assert Gallery.from_db(stub_gallery_db(range(8))).match(template)[0] == "user4"
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from stub_engine import StubDetector, StubFaceEngine, synthetic_face
+
+
+class RecordingDetector(StubDetector):
+    """StubDetector that records its input sizes and can degrade its output."""
+
+    def __init__(self, score=0.99, scramble=False, blind=False):
+        super().__init__()
+        self.score, self.scramble, self.blind = score, scramble, blind
+        self.sizes = []
+
+    def detect(self, img, input_size=None, max_num=0):
+        self.sizes.append(tuple(input_size))
+        bboxes, kps = super().detect(img if not self.blind else img * 0, input_size, max_num)
+        bboxes[:, 4] = self.score
+        if self.scramble and len(kps):
+            kps = kps[:, [2, 1, 0, 3, 4]].copy()  # nose and left eye swapped
+        return bboxes, kps
+
+
+def cascade_engine(**light):
+    engine = StubFaceEngine()
+    engine.detector = RecordingDetector()
+    engine.light_detector = RecordingDetector(**light)
+    engine.light_input_size = (480, 480)
+    engine.light_min_score = 0.6
+    return engine
+
+
+def test_light_detector_serves_good_faces():
+    engine = cascade_engine()
+    frame = synthetic_face(3)
+    bbox, kps = engine.detect_largest_face(frame)
+    assert engine.stats["light_served"] == 1 and engine.stats["full_served"] == 0
+    assert engine.detector.sizes == [] and engine.light_detector.sizes == [(480, 480)]
+    full_bbox, full_kps = StubFaceEngine().detect_largest_face(frame)
+    np.testing.assert_allclose(kps, full_kps)
+
+
+@pytest.mark.parametrize("light, reason", [({"blind": True}, "light_no_face"),
+                                           ({"score": 0.3}, "light_low_score"),
+                                           ({"scramble": True}, "light_bad_landmarks")])
+def test_full_detector_takes_over(light, reason):
+    engine = cascade_engine(**light)
+    bbox, kps = engine.detect_largest_face(synthetic_face(3))
+    assert bbox is not None
+    assert engine.stats[reason] == 1 and engine.stats["full_served"] == 1
+    assert engine.stats["light_served"] == 0
+    assert engine.detector.sizes == [(640, 640)]
+
+
+def test_roi_crops_go_through_the_cascade_at_roi_size():
+    engine = cascade_engine()
+    frame = synthetic_face(3)
+    bbox, _ = StubFaceEngine().detect_largest_face(frame)
+    found, _ = engine.detect_largest_face(frame, roi=bbox[:4].tolist())
+    np.testing.assert_allclose(found[:4], bbox[:4])
+    assert engine.stats["roi_hits"] == 1 and engine.stats["light_served"] == 1
+    # min(roi_input_size, light_input_size)
+    assert engine.light_detector.sizes == [(320, 320)]
+
+
+def test_no_face_anywhere():
+    engine = cascade_engine()
+    assert engine.detect_largest_face(synthetic_face(None)) == (None, None)
+    assert engine.stats["light_no_face"] == 1 and engine.stats["full_served"] == 0
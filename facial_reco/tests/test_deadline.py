@@ -0,0 +1,62 @@
+import json
+import time
+
+import pytest
+
+import admission
+import api_server
+from admission import AdmissionController, Deadline, DeadlineExceeded
+from conftest import call
+from stub_engine import StubFaceEngine, synthetic_face
+
+
+@pytest.mark.parametrize("value, expected_ms", [
+    ("1500", 1500), (None, admission.DEFAULT_TIMEOUT_MS), ("soon", admission.DEFAULT_TIMEOUT_MS),
+    ("0", admission.DEFAULT_TIMEOUT_MS), ("-5", admission.DEFAULT_TIMEOUT_MS),
+    ("nan", admission.DEFAULT_TIMEOUT_MS), ("1e12", admission.DEFAULT_TIMEOUT_MS * 10),
+])
+def test_from_header(value, expected_ms):
+    remaining_ms = Deadline.from_header(value).remaining() * 1000
+    assert expected_ms - 50 < remaining_ms <= expected_ms
+
+
+def test_check_counts_expired_stages():
+    before = admission.expired["detect"]
+    Deadline(10000).check("detect")
+    with pytest.raises(DeadlineExceeded) as e:
+        Deadline(0).check("detect")
+    assert e.value.stage == "detect"
+    assert admission.expired["detect"] == before + 1
+
+
+def test_deadline_passing_in_the_queue():
+    controller = AdmissionController(max_inflight=1, max_queue=1, queue_timeout=10)
+    holder = controller.begin(controller.reserve())
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as e:
+        with controller.admit(Deadline(100)):
+            pass
+    # Gave up at the request deadline, not the 10 s queue timeout
+    assert e.value.stage == "queue" and time.monotonic() - started < 2
+    assert controller.queued == 0
+    controller.release(holder)
+
+
+def test_engine_stops_between_stages():
+    engine = StubFaceEngine(detect_ms=100)
+    with pytest.raises(DeadlineExceeded) as e:
+        engine.get_face(synthetic_face(3), checkpoint=Deadline(50).check)
+    assert e.value.stage == "embed"
+
+
+def test_expired_requests_get_504(face_b64):
+    headers = {"X-Request-Timeout-Ms": "0.001"}
+    response = api_server.app.test_client().post("/recognize", json={"image": face_b64},
+                                                 headers=headers)
+    assert response.status_code == 504
+    assert response.get_json()["error"] == "Request deadline exceeded"
+
+    status, _, body = call("POST", "/recognize", json.dumps({"image": face_b64}).encode(),
+                           headers=[(b"x-request-timeout-ms", b"0.001")])
+    assert status == 504 and json.loads(body)["stage"]
+    assert api_server.admission.snapshot()["expired"]
@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+import pytest
+
+from utils import decode_image, jpeg_size
+
+
+def encode(ext, width, height):
+    frame = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(ext, frame)[1].tobytes()
+
+
+def test_jpeg_size_reads_the_header():
+    assert jpeg_size(encode(".jpg", 300, 200)) == (300, 200)
+    assert jpeg_size(encode(".png", 300, 200)) is None
+    assert jpeg_size(b"\xff\xd8\xff") is None
+    assert jpeg_size(b"") is None
+
+
+@pytest.mark.parametrize("width,height,scale", [
+    (4000, 3000, 4.0),   # 1/4 still covers a 640x640 detector input
+    (1400, 1000, 2.0),
+    (1000, 700, 1.0),    # halving would go below the detector input
+    (600, 4000, 4.0),    # the detector fits the long side: 150x1000 still covers 96x640
+])
+def test_large_jpegs_are_decoded_reduced(width, height, scale):
+    img, got = decode_image(encode(".jpg", width, height), (640, 640))
+    assert got == pytest.approx(scale, rel=0.01)
+    assert img.shape[1] == pytest.approx(width / scale, abs=1)
+    assert img.shape[0] == pytest.approx(height / scale, abs=1)
+
+
+def test_full_size_when_asked_or_not_jpeg():
+    img, scale = decode_image(encode(".jpg", 4000, 3000), None)
+    assert img.shape[:2] == (3000, 4000) and scale == 1.0
+    img, scale = decode_image(encode(".png", 2000, 1500), (640, 640))
+    assert img.shape[:2] == (1500, 2000) and scale == 1.0
+    assert decode_image(b"not an image", (640, 640))[0] is None
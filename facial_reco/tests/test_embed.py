@@ -0,0 +1,62 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+import api_server
+from conftest import call, jpeg_b64
+from embedding_codec import CONTENT_TYPE, decode_embeddings, encode_embeddings
+from stub_engine import synthetic_face
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 0), ("float16", 1e-3)])
+def test_codec_round_trip(dtype, tolerance):
+    rng = np.random.default_rng(0)
+    embs = [v / np.linalg.norm(v) for v in rng.standard_normal((3, 512)).astype(np.float32)]
+    blob = encode_embeddings([embs[0], None, embs[1], embs[2], None], dtype=dtype)
+    matrix, present = decode_embeddings(blob)
+    assert present.tolist() == [True, False, True, True, False]
+    assert matrix.dtype == np.float32 and matrix.shape == (5, 512)
+    np.testing.assert_allclose(matrix[present], np.stack(embs), atol=tolerance)
+    assert not matrix[~present].any()
+
+
+def test_codec_rejects_foreign_blobs():
+    with pytest.raises(ValueError):
+        encode_embeddings([None], dtype="int8")
+    with pytest.raises(ValueError):
+        decode_embeddings(b"NOPE" + bytes(12))
+
+
+def test_embed_json_marks_faces():
+    client = api_server.app.test_client()
+    images = [jpeg_b64(synthetic_face(3)), jpeg_b64(synthetic_face(None))]
+    response = client.post("/embed", json={"images": images, "dtype": "float16"})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["faces"] == [True, False]
+    matrix, present = decode_embeddings(base64.b64decode(body["embeddings"]))
+    assert present.tolist() == [True, False]
+    assert abs(float(np.linalg.norm(matrix[0])) - 1) < 1e-2
+
+
+@pytest.mark.parametrize("bad", ["not base64 !!", base64.b64encode(b"not an image").decode(), 7])
+def test_embed_rejects_undecodable_items(bad):
+    client = api_server.app.test_client()
+    response = client.post("/embed", json={"images": [jpeg_b64(synthetic_face(3)), bad]})
+    assert response.status_code == 400
+    assert response.get_json()["index"] == 1
+    response = client.post("/embed", json={"aligned": [bad]})
+    assert response.status_code == 400
+
+
+def test_async_binary_embed_uses_codec_content_type(face_b64):
+    status, headers, body = call("POST", "/embed", json.dumps({"images": [face_b64]}).encode(),
+                                 headers=[(b"accept", CONTENT_TYPE.encode())])
+    assert status == 200
+    assert headers[b"content-type"] == CONTENT_TYPE.encode()
+    assert decode_embeddings(body)[1].tolist() == [True]
+
+    status, _, body = call("POST", "/embed", json.dumps({"images": ["%%%"]}).encode())
+    assert status == 400 and json.loads(body)["index"] == 0
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+import api_server
+import utils
+from admission import Deadline, DeadlineExceeded, Overloaded
+from engine_pool import EnginePool
+
+
+class CountingEngine:
+    def __init__(self, threads):
+        self.threads = threads
+        self.stats = {"detections": 1, "embeddings": 2}
+
+
+def test_from_env_splits_the_cores(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    for name in ("ENGINE_POOL_SIZE", "ENGINE_SLOTS", "ENGINE_INTRA_OP_THREADS",
+                 "ENGINE_CHECKOUT_TIMEOUT"):
+        monkeypatch.delenv(name, raising=False)
+    # One engine: ORT's default pool, one slot per core (the old behaviour)
+    pool = EnginePool.from_env(CountingEngine)
+    assert (pool.size, pool.slots, pool.intra_op_threads) == (1, 8, 0)
+    assert pool.engines[0].threads == 0
+
+    monkeypatch.setenv("ENGINE_POOL_SIZE", "4")
+    pool = EnginePool.from_env(CountingEngine)
+    assert (pool.size, pool.slots, pool.intra_op_threads) == (4, 1, 2)
+    assert [e.threads for e in pool.engines] == [2, 2, 2, 2]
+
+    monkeypatch.setenv("ENGINE_SLOTS", "2")
+    monkeypatch.setenv("ENGINE_INTRA_OP_THREADS", "3")
+    monkeypatch.setenv("ENGINE_CHECKOUT_TIMEOUT", "0.5")
+    pool = EnginePool.from_env(CountingEngine)
+    assert (pool.slots, pool.intra_op_threads, pool.checkout_timeout) == (2, 3, 0.5)
+
+
+def test_checkout_spreads_over_engines_up_to_the_slots():
+    pool = EnginePool(CountingEngine, size=2, slots=2, checkout_timeout=0)
+    assert [pool.checkout() for _ in range(4)] == [0, 1, 0, 1]
+    with pytest.raises(Overloaded) as e:
+        pool.checkout()
+    assert e.value.retry_after == 1 and e.value.reason == "no free engine"
+    pool.checkin(1)
+    assert pool.checkout() == 1
+    snapshot = pool.snapshot()
+    assert snapshot["active"] == [2, 2] and snapshot["checkouts"] == 5
+    assert snapshot["waited"] == 1 and snapshot["timed_out"] == 1 and snapshot["waiting"] == 0
+
+
+def test_waiter_gets_the_checked_in_engine():
+    pool = EnginePool(CountingEngine, size=1, slots=1, checkout_timeout=5)
+    holder = pool.checkout()
+    got = threading.Event()
+
+    def waiter():
+        with pool.engine() as engine:
+            assert engine is pool.engines[0]
+            got.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not got.wait(0.2)
+    assert pool.snapshot()["waiting"] == 1
+    pool.checkin(holder)
+    assert got.wait(5)
+    thread.join()
+    assert pool.snapshot()["active"] == [0] and pool.waited == 1
+
+
+def test_deadline_bounds_the_wait():
+    pool = EnginePool(CountingEngine, size=1, slots=1, checkout_timeout=30)
+    pool.checkout()
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as e:
+        pool.checkout(Deadline(100))
+    assert time.monotonic() - started < 1.0
+    assert e.value.stage == "engine"
+
+
+def test_engine_is_checked_in_when_the_block_raises():
+    pool = EnginePool(CountingEngine, size=1, slots=1, checkout_timeout=0)
+    with pytest.raises(RuntimeError):
+        with pool.engine():
+            raise RuntimeError("inference failed")
+    with pool.engine():
+        pass
+    assert pool.snapshot()["active"] == [0]
+
+
+def test_concurrency_never_exceeds_the_slots():
+    pool = EnginePool(CountingEngine, size=2, slots=1, checkout_timeout=10)
+    active = [0, 0]
+    peak = [0, 0]
+    lock = threading.Lock()
+
+    def request():
+        with pool.engine() as engine:
+            index = pool.engines.index(engine)
+            with lock:
+                active[index] += 1
+                peak[index] = max(peak[index], active[index])
+            time.sleep(0.005)
+            with lock:
+                active[index] -= 1
+
+    threads = [threading.Thread(target=request) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == [1, 1] and pool.checkouts == 16
+    assert pool.stats() == {"detections": 2, "embeddings": 4}
+
+
+def test_load_model_limits_ort_threads(monkeypatch):
+    import insightface.model_zoo.model_zoo as model_zoo
+    created = {}
+
+    class Router:
+        def __init__(self, path):
+            created["path"] = path
+
+        def get_model(self, **kwargs):
+            created.update(kwargs)
+            return "model"
+
+    monkeypatch.setattr(model_zoo, "ModelRouter", Router)
+    assert utils._load_model("det.onnx", intra_op_threads=2) == "model"
+    options = created["sess_options"]
+    assert created["path"] == "det.onnx"
+    assert options.intra_op_num_threads == 2 and options.inter_op_num_threads == 1
+    assert options.get_session_config_entry("session.intra_op.allow_spinning") == "0"
+
+
+def test_recognize_with_no_free_engine_is_503(monkeypatch, face_b64):
+    pool = EnginePool(CountingEngine, size=1, slots=1, checkout_timeout=0)
+    monkeypatch.setattr(api_server, "engine_pool", pool)
+    pool.checkout()
+    response = api_server.app.test_client().post("/recognize", json={"image": face_b64})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json()["reason"] == "no free engine"
+    assert pool.timed_out == 1
@@ -0,0 +1,67 @@
+import pytest
+
+import api_server
+from conftest import jpeg_b64
+from stub_engine import StubFaceEngine, synthetic_face
+from utils import aligned_crop_problem, landmarks_problem, pad_roi, parse_roi
+
+
+@pytest.fixture
+def client():
+    return api_server.app.test_client()
+
+
+@pytest.mark.parametrize("roi", ["garbage", "1234", {"x": 1}, 5, [1, 2], [1, 2, "a", 4],
+                                 [0, 0, float("inf"), 10], None])
+def test_parse_roi_rejects_malformed_hints(roi):
+    assert parse_roi(roi) is None
+    assert pad_roi(roi, (480, 640)) is None
+
+
+def test_pad_roi_grows_and_clips():
+    assert parse_roi([10, 20, 110, 220, 0.9]) == [10.0, 20.0, 110.0, 220.0]
+    assert pad_roi([100, 100, 200, 200], (480, 640)) == (50, 50, 250, 250)
+    assert pad_roi([0, 0, 100, 100], (80, 80)) == (0, 0, 80, 80)
+    assert pad_roi([5000, 5000, 5100, 5100], (480, 640)) is None
+
+
+@pytest.mark.parametrize("roi", ["garbage", {"x": 1}, 5, [1, 2, "a", 4]])
+def test_malformed_roi_falls_back_to_full_frame(client, roi):
+    # Large enough to be decoded at reduced size, where the roi is rescaled
+    image = jpeg_b64(synthetic_face(3, size=(3000, 4000)))
+    response = client.post("/recognize", json={"image": image, "roi": roi})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["success"] and body["username"] == "user3"
+
+
+@pytest.mark.parametrize("kps", ["x", [[1, 2], [3]], {"a": 1}, None, [[1, 2]] * 4,
+                                 [[1, "a"]] * 5, [[float("nan"), 1]] * 5])
+def test_landmarks_problem_reports_malformed_points(kps):
+    assert landmarks_problem(kps, (480, 640)) == "landmarks must be 5 [x, y] points"
+
+
+def test_landmarks_and_aligned_crop_checks():
+    frame = synthetic_face(3)
+    _, kps = StubFaceEngine().detect_largest_face(frame)
+    assert landmarks_problem(kps.tolist(), frame.shape) is None
+    assert "outside" in landmarks_problem((kps + 2000).tolist(), frame.shape)
+    assert "too close" in landmarks_problem([[100, 100]] * 5, frame.shape)
+    assert aligned_crop_problem(frame) is not None
+    assert aligned_crop_problem(frame[:112, :112] * 0) == "aligned crop is blank"
+
+
+def test_recognize_with_landmarks(client):
+    frame = synthetic_face(3)
+    _, kps = StubFaceEngine().detect_largest_face(frame)
+    response = client.post("/recognize", json={"image": jpeg_b64(frame),
+                                               "landmarks": kps.tolist()})
+    assert response.status_code == 200
+    assert response.get_json()["username"] == "user3"
+
+
+@pytest.mark.parametrize("kps", ["x", [[1, 2], [3]], {"a": 1}, [[1, "a"]] * 5])
+def test_malformed_landmarks_are_a_client_error(client, face_b64, kps):
+    response = client.post("/recognize", json={"image": face_b64, "landmarks": kps})
+    assert response.status_code == 400
+    assert "landmarks must be 5" in response.get_json()["error"]
@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+import pytest
+
+import gallery_audit
+from gallery_audit import audit, summarize
+
+
+def planted_matrix(n, seed=0):
+    """Random unit vectors, with a few near-duplicates of earlier rows."""
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((n, 64)).astype(np.float32)
+    for i, j in ((3, n - 1), (10, 11), (20, n - 2)):
+        if i >= n or j <= i:
+            continue
+        matrix[j] = matrix[i] + 0.3 * rng.standard_normal(64)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def brute_force(matrix, threshold):
+    sims = matrix @ matrix.T
+    np.fill_diagonal(sims, -np.inf)
+    order = np.argsort(-sims, axis=1)
+    rows = np.arange(len(matrix))
+    pairs = [(i, j, sims[i, j]) for i in range(len(matrix)) for j in range(i + 1, len(matrix))
+             if sims[i, j] >= threshold]
+    return sims[rows, order[:, 0]], order[:, 0], sims[rows, order[:, 1]], pairs
+
+
+@pytest.mark.parametrize("n, block, workers", [(97, 16, 1), (97, 16, 4), (130, 64, 3),
+                                                (40, 128, 2), (2, 1, 2)])
+def test_audit_matches_brute_force(n, block, workers):
+    matrix = planted_matrix(n)
+    nn_sim, nn_idx, second, pairs, found = audit(matrix, 0.45, block=block, workers=workers)
+    ref_sim, ref_idx, ref_second, ref_pairs = brute_force(matrix, 0.45)
+    np.testing.assert_allclose(nn_sim, ref_sim, atol=1e-5)
+    np.testing.assert_array_equal(nn_idx, ref_idx)
+    if n > 2:
+        np.testing.assert_allclose(second, ref_second, atol=1e-5)
+    assert found == len(ref_pairs) == len(pairs)
+    assert sorted((i, j) for i, j, _ in pairs) == sorted((i, j) for i, j, _ in ref_pairs)
+    assert [p[2] for p in pairs] == sorted((p[2] for p in pairs), reverse=True)
+
+
+def test_pairs_are_capped_to_the_most_similar_but_all_counted():
+    matrix = planted_matrix(60)
+    _, _, _, pairs, found = audit(matrix, -1.0, block=16, workers=2, max_pairs=100)
+    assert len(pairs) == 100 and found == 60 * 59 // 2
+    ref = sorted(brute_force(matrix, -1.0)[3], key=lambda p: -p[2])[:100]
+    assert [(i, j) for i, j, _ in pairs] == [(i, j) for i, j, _ in ref]
+    # The planted near-duplicates survive any cap
+    _, _, _, pairs, found = audit(matrix, -1.0, block=16, workers=3, max_pairs=3)
+    assert sorted((i, j) for i, j, _ in pairs) == [(3, 59), (10, 11), (20, 58)]
+    assert audit(matrix, 0.45, block=16, workers=2, max_pairs=0)[3:] == ([], 3)
+
+
+def test_workers_merge_each_block_as_they_go(monkeypatch):
+    merged, lock = [], threading.Lock()
+    real_merge = gallery_audit.merge_top2
+
+    def recording_merge(vals, idx, new_vals, new_idx):
+        with lock:
+            merged.append((threading.current_thread().name, len(new_vals)))
+        return real_merge(vals, idx, new_vals, new_idx)
+
+    monkeypatch.setattr(gallery_audit, "merge_top2", recording_merge)
+    result = audit(planted_matrix(256), block=8, workers=2)
+    # One block of rows at a time, merged on the worker threads, never batched
+    # up for the caller: the row blocks themselves return nothing
+    assert merged and all(rows <= 8 for _, rows in merged)
+    assert threading.current_thread().name not in {name for name, _ in merged}
+    assert len(merged) == sum(1 + 2 * (32 - 1 - b) for b in range(32))
+    assert gallery_audit.audit_row_block(planted_matrix(16), 0, 8, 0.45,
+                                         gallery_audit.AuditResults(16, 10)) is None
+    assert len(result[0]) == 256
+
+
+def test_summary_lists_each_close_pair_once():
+    matrix = planted_matrix(30)
+    usernames = [f"u{i}" for i in range(30)]
+    result = audit(matrix, 0.45, block=8, workers=2)
+    summary = summarize(usernames, *result, threshold=0.45, margin=0.05, top=5)
+    assert summary["users"] == 30 and summary["pairs_above_threshold"] == 3
+    closest = {frozenset((row["user"], row["neighbour"])) for row in summary["closest"][:3]}
+    assert closest == {frozenset(p) for p in (("u3", "u29"), ("u10", "u11"), ("u20", "u28"))}
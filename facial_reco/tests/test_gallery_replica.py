@@ -0,0 +1,163 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from gallery_replica import MANIFEST, ReplicaSource, pack_delta, publish, unpack_delta
+from gallery_store import GalleryFollower
+from utils import Gallery
+
+
+def record(seed):
+    return {"embedding": np.random.default_rng(seed).standard_normal(512).tolist()}
+
+
+def unit(seed):
+    vec = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def assert_same(gallery, db):
+    expected = Gallery.from_db(db)
+    assert sorted(gallery.usernames) == sorted(expected.usernames)
+    rows = dict(zip(gallery.usernames, gallery.matrix))
+    for username, row in zip(expected.usernames, expected.matrix):
+        np.testing.assert_allclose(rows[username], row, atol=1e-6)
+
+
+class NoReload(ReplicaSource):
+    """A source that fails the test if the follower falls back to a snapshot."""
+
+    allow_snapshot = True
+
+    def snapshot(self):
+        assert self.allow_snapshot, "expected deltas, not a snapshot reload"
+        return super().snapshot()
+
+
+def test_delta_round_trip():
+    upserts = [("a", unit(1)), ("b", unit(2))]
+    blob = pack_delta(4, 5, upserts, ["gone"], 512)
+    from_version, to_version, changes = unpack_delta(blob)
+    assert (from_version, to_version) == (4, 5)
+    assert [u for u, _ in changes] == ["a", "b", "gone"]
+    np.testing.assert_array_equal(changes[0][1], upserts[0][1])
+    np.testing.assert_array_equal(changes[1][1], upserts[1][1])
+    assert changes[2][1] is None
+
+    # Removes only
+    assert unpack_delta(pack_delta(5, 6, [], ["a"], 512))[2] == [("a", None)]
+    with pytest.raises(ValueError):
+        unpack_delta(b"NOTADELT" + blob[8:])
+
+
+def test_publish_writes_versions_and_skips_no_op(tmp_path):
+    releases = str(tmp_path / "releases")
+    db = {f"u{i}": record(i) for i in range(10)}
+    assert publish(releases, db) == 1
+    assert publish(releases, db) is None
+
+    db["u3"] = record(103)
+    del db["u4"]
+    db["new"] = record(200)
+    assert publish(releases, db) == 2
+    manifest = json.loads((tmp_path / "releases" / MANIFEST).read_text())
+    assert manifest["version"] == 2 and manifest["users"] == 10
+    assert [(d["from"], d["to"]) for d in manifest["deltas"]] == [(1, 2)]
+    _, _, changes = unpack_delta((tmp_path / "releases" / "delta-2.mqd").read_bytes())
+    assert sorted((u, v is None) for u, v in changes) == \
+        [("new", False), ("u3", False), ("u4", True)]
+
+    version, rows = ReplicaSource(releases).snapshot()
+    assert version == 2
+    assert_same(Gallery([u for u, _ in rows], np.stack([v for _, v in rows])), db)
+
+
+def test_follower_applies_deltas_in_place(tmp_path):
+    releases = str(tmp_path / "releases")
+    db = {f"u{i}": record(i) for i in range(20)}
+    publish(releases, db)
+    source = NoReload(releases, str(tmp_path / "cache"))
+    follower = GalleryFollower(source, poll_interval=0)
+    first = follower.current()
+    assert_same(first, db)
+    before = first.matrix.copy()
+    source.allow_snapshot = False
+
+    # Adds, an update and a removal, in one version
+    db.update({f"n{i}": record(100 + i) for i in range(5)})
+    db["u2"] = record(999)
+    del db["u7"]
+    publish(releases, db)
+    assert_same(follower.current(), db)
+    # The Gallery handed out before the delta is untouched
+    np.testing.assert_array_equal(first.matrix, before)
+
+
+def test_lagging_node_replays_every_delta(tmp_path):
+    releases = str(tmp_path / "releases")
+    db = {f"u{i}": record(i) for i in range(20)}
+    publish(releases, db)
+    source = NoReload(releases)
+    follower = GalleryFollower(source, poll_interval=0)
+    follower.current()
+    source.allow_snapshot = False
+
+    # Several versions while the node isn't polling, touching the same user twice
+    for step in range(4):
+        db[f"n{step}"] = record(300 + step)
+        db["u0"] = record(400 + step)
+        publish(releases, db, snapshot_every=100)
+    db.pop("n1")
+    publish(releases, db, snapshot_every=100)
+    assert source.last_seq() == 6
+    assert_same(follower.current(), db)
+
+
+def test_pruned_deltas_force_a_snapshot_reload(tmp_path):
+    releases = str(tmp_path / "releases")
+    db = {f"u{i}": record(i) for i in range(10)}
+    publish(releases, db, snapshot_every=1, keep_snapshots=1)
+    follower = GalleryFollower(ReplicaSource(releases), poll_interval=0)
+    follower.current()
+
+    for step in range(3):
+        db[f"n{step}"] = record(500 + step)
+        publish(releases, db, snapshot_every=1, keep_snapshots=1)
+    manifest = json.loads((tmp_path / "releases" / MANIFEST).read_text())
+    assert [s["version"] for s in manifest["snapshots"]] == [4] and manifest["deltas"] == []
+    assert sorted(os.listdir(releases)) == [MANIFEST, "snapshot-4.gal"]
+    # As the follower asks: latest version, then the deltas since its own
+    assert follower.store.last_seq() == 4 and follower.store.changes_since(1) is None
+    assert_same(follower.current(), db)
+
+
+def test_restart_uses_the_cache_and_checks_sums(tmp_path):
+    releases = tmp_path / "releases"
+    cache = str(tmp_path / "cache")
+    db = {f"u{i}": record(i) for i in range(10)}
+    publish(str(releases), db)
+    db["n"] = record(42)
+    publish(str(releases), db, snapshot_every=100)
+    assert_same(GalleryFollower(ReplicaSource(str(releases), cache)).current(), db)
+
+    # The release copies go bad; a restarted node serves from its cache
+    (releases / "snapshot-1.gal").write_bytes(b"corrupt")
+    (releases / "delta-2.mqd").write_bytes(b"corrupt")
+    assert_same(GalleryFollower(ReplicaSource(str(releases), cache)).current(), db)
+    # Without a cache the checksum catches it
+    with pytest.raises(ValueError, match="Checksum"):
+        ReplicaSource(str(releases)).snapshot()
+
+
+def test_unreadable_manifest_keeps_serving(tmp_path):
+    releases = tmp_path / "releases"
+    db = {f"u{i}": record(i) for i in range(5)}
+    publish(str(releases), db)
+    follower = GalleryFollower(ReplicaSource(str(releases)), poll_interval=0)
+    gallery = follower.current()
+
+    (releases / MANIFEST).write_text("{not json")
+    assert follower.current() is gallery
+    assert follower.store.last_seq() == 1
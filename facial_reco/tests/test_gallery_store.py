@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from gallery_store import GalleryFollower, GalleryStore
+from utils import Gallery
+
+
+def record(seed, **meta):
+    return dict(meta, embedding=np.random.default_rng(seed).standard_normal(512).tolist())
+
+
+@pytest.fixture
+def store(tmp_path):
+    return GalleryStore(str(tmp_path / "gallery.db"))
+
+
+def assert_same(gallery, store):
+    expected = Gallery.from_db(store.load_db())
+    assert sorted(gallery.usernames) == sorted(expected.usernames)
+    rows = {u: row for u, row in zip(gallery.usernames, gallery.matrix)}
+    for username, row in zip(expected.usernames, expected.matrix):
+        np.testing.assert_allclose(rows[username], row, atol=1e-6)
+
+
+def test_store_round_trip_and_feed(store):
+    store.put_many({"a": record(1, name="A"), "b": record(2), "skip": {"name": "no embedding"}})
+    store.put("c", record(3))
+    assert len(store) == 3 and "a" in store and "skip" not in store
+    assert store.get("a")["name"] == "A"
+    assert list(store.load_db()) == ["a", "b", "c"]
+    seq = store.last_seq()
+
+    store.put("a", record(4))
+    store.put("a", record(5))
+    assert store.delete("b") and not store.delete("b")
+    last, changes = store.changes_since(seq)
+    assert last == store.last_seq()
+    # Latest change per user only; deletes come back as None
+    assert [(u, v is None) for u, v in changes] == [("a", False), ("b", True)]
+    np.testing.assert_allclose(changes[0][1], record(5)["embedding"], rtol=1e-6)
+
+
+def test_compaction_forces_a_reload(store):
+    for i in range(5):
+        store.put(f"u{i}", record(i))
+    store.compact(keep=2)
+    assert store.changes_since(0) is None
+    assert store.changes_since(store.last_seq() - 1) is not None
+
+
+def test_follower_applies_the_feed(store):
+    store.put_many({f"u{i}": record(i) for i in range(20)})
+    follower = GalleryFollower(store, poll_interval=0)
+    first = follower.current()
+    assert_same(first, store)
+    before = first.matrix.copy()
+
+    # Appends (beyond the initial spare capacity), an update, a delete
+    store.put_many({f"n{i}": record(100 + i) for i in range(30)})
+    store.put("u3", record(999))
+    store.delete("u7")
+    store.put("zero", {"embedding": [0.0] * 512})
+    second = follower.current()
+    assert_same(second, store)
+    assert "zero" not in second.usernames
+    # Galleries already handed out are never modified
+    np.testing.assert_array_equal(first.matrix, before)
+    assert len(first) == 20
+
+    # Further behind than the compacted feed: the follower reloads
+    store.put("late", record(7))
+    store.delete("u0")
+    store.put("later", record(8))
+    store.compact(keep=1)
+    assert store.changes_since(follower._seq) is None
+    assert_same(follower.current(), store)
+
+
+def test_follower_polls_at_most_every_interval(store):
+    store.put("a", record(1))
+    follower = GalleryFollower(store, poll_interval=3600)
+    gallery = follower.current()
+    store.put("b", record(2))
+    assert follower.current() is gallery
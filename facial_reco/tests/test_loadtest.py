@@ -0,0 +1,27 @@
+import pytest
+
+import loadtest
+
+
+def test_default_server_command_is_the_procfile_web_line():
+    command = loadtest.procfile_command()
+    assert command.startswith("gunicorn api_server:app")
+    assert "--bind 0.0.0.0:{port}" in command
+    assert "--bind 0.0.0.0:5055" in command.format(port=5055)
+
+
+def test_procfile_parsing(tmp_path):
+    procfile = tmp_path / "Procfile"
+    procfile.write_text("release: python migrate.py\n"
+                        "web: uvicorn async_server:app --port ${PORT} --header x:{a}\n")
+    command = loadtest.procfile_command(str(procfile))
+    assert command.format(port=80) == "uvicorn async_server:app --port 80 --header x:{a}"
+    assert loadtest.procfile_command(str(procfile), "release") == "python migrate.py"
+    with pytest.raises(SystemExit):
+        loadtest.procfile_command(str(procfile), "worker")
+
+
+def test_parse_mix():
+    assert loadtest.parse_mix("known=5,health") == {"known": 5.0, "health": 1.0}
+    with pytest.raises(SystemExit):
+        loadtest.parse_mix("known=1,bogus=2")
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import model_download
+
+CHUNK = 64 * 1024
+PAYLOAD = os.urandom(5 * CHUNK + 123)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD with Range support; drops the connection on request."""
+
+    def do_GET(self):
+        server = self.server
+        start, end = 0, len(PAYLOAD) - 1
+        ranged = "Range" in self.headers and server.ranges
+        if ranged:
+            first, last = self.headers["Range"].split("=")[1].split("-")
+            start, end = int(first), int(last) if last else len(PAYLOAD) - 1
+        with server.lock:
+            server.requests[(start, end)] += 1
+            drop = (start, end) in server.drop_once and server.requests[(start, end)] == 1
+        body = PAYLOAD[start:end + 1]
+        self.send_response(206 if ranged else 200)
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if drop:
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(model_download, "CHUNK_SIZE", CHUNK)
+    monkeypatch.setattr(model_download, "_backoff", lambda attempt: 0)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.lock = threading.Lock()
+    httpd.requests = Counter()
+    httpd.drop_once = set()
+    httpd.ranges = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/model.onnx"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def chunk_range(index):
+    return index * CHUNK, min((index + 1) * CHUNK, len(PAYLOAD)) - 1
+
+
+def test_ranged_download_resumes_from_the_part_file(server, tmp_path):
+    target = tmp_path / "model.onnx"
+    part = tmp_path / "model.onnx.part"
+    # An earlier run finished chunks 0 and 2
+    data = bytearray(len(PAYLOAD))
+    for index in (0, 2):
+        start, end = chunk_range(index)
+        data[start:end + 1] = PAYLOAD[start:end + 1]
+    part.write_bytes(bytes(data))
+    (tmp_path / "model.onnx.part.json").write_text(json.dumps(
+        {"url": server.url, "total": len(PAYLOAD), "chunk_size": CHUNK, "done": [0, 2]}))
+
+    assert model_download.download_model(server.url, target, expected_min_size_mb=0,
+                                         sha256=hashlib.sha256(PAYLOAD).hexdigest())
+    assert target.read_bytes() == PAYLOAD
+    assert not part.exists()
+    assert server.requests[chunk_range(0)] == 0
+    assert server.requests[chunk_range(2)] == 0
+    assert all(server.requests[chunk_range(i)] == 1 for i in (1, 3, 4, 5))
+
+
+def test_dropped_chunk_is_retried(server, tmp_path):
+    server.drop_once.add(chunk_range(3))
+    target = tmp_path / "model.onnx"
+    assert model_download.download_model(server.url, target, expected_min_size_mb=0,
+                                         sha256=hashlib.sha256(PAYLOAD).hexdigest())
+    assert target.read_bytes() == PAYLOAD
+    assert server.requests[chunk_range(3)] == 2
+
+
+def test_stream_download_resumes_after_a_drop(server, tmp_path):
+    server.ranges = False
+    server.drop_once.add((0, len(PAYLOAD) - 1))
+    target = tmp_path / "model.onnx"
+    assert model_download.download_model(server.url, target, expected_min_size_mb=0)
+    assert target.read_bytes() == PAYLOAD
+
+
+def test_hash_mismatch_is_rejected(server, tmp_path):
+    target = tmp_path / "model.onnx"
+    assert not model_download.download_model(server.url, target, expected_min_size_mb=0,
+                                             sha256="0" * 64)
+    assert not target.exists()
+    assert not (tmp_path / "model.onnx.part").exists()
+
+
+def test_ranged_download_without_pwrite(server, tmp_path, monkeypatch):
+    # Windows has no os.pwrite
+    monkeypatch.delattr(os, "pwrite", raising=False)
+    target = tmp_path / "model.onnx"
+    assert model_download.download_model(server.url, target, expected_min_size_mb=0,
+                                         sha256=hashlib.sha256(PAYLOAD).hexdigest())
+    assert target.read_bytes() == PAYLOAD
@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+import api_server
+import namespaces
+from gallery_store import GalleryStore
+from namespaces import NamespaceGalleries, UnknownNamespace
+from stub_engine import stub_gallery_db
+
+
+@pytest.fixture
+def root(tmp_path):
+    for name, ids in (("a", [0, 1]), ("b", [2]), ("c", [3, 4, 5])):
+        (tmp_path / f"{name}.json").write_text(json.dumps(stub_gallery_db(ids)))
+    GalleryStore(str(tmp_path / "venue.db")).put_many(stub_gallery_db([6, 7]))
+    return tmp_path
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(namespaces.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_loads_json_and_store_namespaces(root):
+    galleries = NamespaceGalleries(str(root))
+    assert galleries.get("a").usernames == ["user0", "user1"]
+    assert galleries.get("venue").usernames == ["user6", "user7"]
+    for name in ("missing", "../a", "", None, "a/b"):
+        with pytest.raises(UnknownNamespace):
+            galleries.get(name)
+
+
+def test_least_recently_used_is_evicted(root, clock):
+    galleries = NamespaceGalleries(str(root), capacity=2)
+    galleries.get("a")
+    galleries.get("b")
+    galleries.get("a")  # b is now the least recent
+    galleries.get("c")
+    assert galleries.snapshot()["loaded"] == ["a", "c"]
+    assert galleries.evictions == 1
+    galleries.get("b")
+    assert galleries.snapshot()["loaded"] == ["c", "b"] and galleries.loads == 4
+
+
+def test_idle_namespaces_are_dropped(root, clock):
+    galleries = NamespaceGalleries(str(root), idle_s=60)
+    galleries.get("a")
+    clock[0] += 30
+    galleries.get("b")
+    clock[0] += 40  # a idle for 70 s, b for 40 s
+    galleries.get("c")
+    assert galleries.snapshot()["loaded"] == ["b", "c"]
+
+
+def test_json_namespace_reloads_when_the_file_changes(root):
+    galleries = NamespaceGalleries(str(root))
+    first = galleries.get("b")
+    assert galleries.get("b") is first
+    path = root / "b.json"
+    path.write_text(json.dumps(stub_gallery_db([2, 3])))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert galleries.get("b").usernames == ["user2", "user3"]
+
+
+def test_recognize_in_a_namespace(root, monkeypatch, face_b64):
+    monkeypatch.setenv("GALLERY_NAMESPACE_DIR", str(root))
+    monkeypatch.setattr(api_server, "namespace_galleries", None)
+    client = api_server.app.test_client()
+    # identity 3 is only enrolled in namespace c
+    body = client.post("/recognize", json={"image": face_b64, "namespace": "c"}).get_json()
+    assert body["username"] == "user3"
+    body = client.post("/recognize", json={"image": face_b64, "namespace": "a"}).get_json()
+    assert not body["success"]
+    response = client.post("/recognize", json={"image": face_b64, "namespace": "nope"})
+    assert response.status_code == 404
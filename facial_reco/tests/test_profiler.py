@@ -0,0 +1,157 @@
+import json
+import marshal
+import pstats
+import threading
+from collections import Counter
+
+import cv2
+import numpy as np
+import pytest
+
+import api_server
+import profiler
+from conftest import call
+from utils import Gallery
+
+
+@pytest.fixture
+def busy_threads():
+    """A matcher thread and a decoder thread working until the test ends, plus an idle one."""
+    stop = threading.Event()
+    gallery = Gallery([f"u{i}" for i in range(20000)],
+                      np.random.default_rng(0).standard_normal((20000, 512)).astype(np.float32))
+    query = np.ones(512, np.float32)
+    jpeg = cv2.imencode(".jpg", np.zeros((480, 640, 3), np.uint8))[1]
+
+    def match():
+        while not stop.is_set():
+            gallery.match(query)
+
+    def decode():
+        while not stop.is_set():
+            cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+
+    threads = [threading.Thread(target=match, name="matcher", daemon=True),
+               threading.Thread(target=decode, name="decoder", daemon=True),
+               threading.Thread(target=stop.wait, name="idle", daemon=True)]
+    for thread in threads:
+        thread.start()
+    yield
+    stop.set()
+    for thread in threads:
+        thread.join(5)
+
+
+def fake_stack(*frames):
+    """Stack tuple from (filename, qualname) pairs, root first."""
+    return tuple((filename, 1, qualname, 1) for filename, qualname in frames)
+
+
+def test_sampling_sees_busy_threads_and_skips_idle_ones(busy_threads):
+    counts, passes = profiler.sample(0.5, interval=0.005)
+    assert passes > 0
+    threads = {thread for thread, _ in counts}
+    assert {"matcher", "decoder"} <= threads and "idle" not in threads
+
+    stages = profiler.stage_table(counts)
+    assert stages["find_best_match"] > 0 and stages["cv2.imdecode"] > 0
+    lines = profiler.collapsed(counts).splitlines()
+    assert any(line.startswith("matcher;") and "utils:Gallery.match" in line for line in lines)
+    _, n = lines[0].rsplit(" ", 1)
+    assert int(n) > 0
+
+    counts, _ = profiler.sample(0.1, interval=0.005, include_idle=True)
+    assert "idle" in {thread for thread, _ in counts}
+
+
+def test_stage_table_attributes_each_stage():
+    counts = Counter({
+        ("inference", fake_stack(("api_server.py", "recognize_payload"),
+                                 ("scrfd_fast.py", "FastSCRFD.detect"),
+                                 ("/site-packages/onnxruntime/session.py", "InferenceSession.run"))): 5,
+        # SCRFD_FAST_POSTPROCESS=0: insightface's own RetinaFace.detect
+        ("inference", fake_stack(("api_server.py", "recognize_payload"),
+                                 ("/site-packages/insightface/model_zoo/retinaface.py",
+                                  "RetinaFace.forward"))): 6,
+        ("inference", fake_stack(("api_server.py", "recognize_payload"),
+                                 ("face_align.py", "norm_crop"))): 2,
+        ("inference", fake_stack(("api_server.py", "recognize_payload"),
+                                 ("arcface_onnx.py", "ArcFaceONNX.get_feat"))): 3,
+        ("inference", fake_stack(("api_server.py", "recognize_payload"),
+                                 ("utils.py", "find_best_match"))): 1,
+        ("other", fake_stack(("worker.py", "loop"))): 4,
+    })
+    assert profiler.stage_table(counts) == {"scrfd": 11, "ort_session": 5, "norm_crop": 2,
+                                            "recognizer": 3, "find_best_match": 1}
+
+
+def test_pstats_dump_loads_in_pstats(tmp_path):
+    counts = Counter({
+        ("t", fake_stack(("a.py", "main"), ("b.py", "work"))): 3,
+        # Recursion: each function once per sample in cumulative time
+        ("t", fake_stack(("a.py", "main"), ("b.py", "work"), ("b.py", "work"))): 1,
+    })
+    path = tmp_path / "profile.out"
+    path.write_bytes(profiler.pstats_dump(counts, 0.01))
+    stats = pstats.Stats(str(path)).stats
+    main = stats[("a.py", 1, "main")]
+    work = stats[("b.py", 1, "work")]
+    assert main[3] == pytest.approx(0.04) and main[2] == 0
+    assert work[3] == pytest.approx(0.04) and work[2] == pytest.approx(0.04)
+    assert work[0] == 4
+    assert ("a.py", 1, "main") in work[4]
+    assert marshal.loads(path.read_bytes()) == stats
+
+
+def test_admin_token_headers():
+    assert profiler.admin_token("Bearer secret ", "") == "secret"
+    assert profiler.admin_token("", " secret") == "secret"
+    assert profiler.admin_token("Basic xyz", "") == ""
+
+
+def test_profile_response_guards(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert profiler.profile_response({}, "")[1] == 404
+    assert profiler.profile_response({}, "anything")[1] == 404
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert profiler.profile_response({"seconds": "0"}, "wrong")[1] == 401
+    assert profiler.profile_response({"seconds": "soon"}, "secret")[1] == 400
+    assert profiler.profile_response({"seconds": "0", "format": "svg"}, "secret")[1] == 400
+
+    profiler._lock.acquire()
+    try:
+        body, status, _ = profiler.profile_response({"seconds": "0"}, "secret")
+    finally:
+        profiler._lock.release()
+    assert status == 409 and "already running" in json.loads(body)["error"]
+
+
+def test_flask_endpoint(monkeypatch, busy_threads):
+    client = api_server.app.test_client()
+    assert client.get("/admin/profile").status_code == 404
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/admin/profile?seconds=0").status_code == 401
+    response = client.get("/admin/profile?seconds=0.3&format=json",
+                          headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["samples"] > 0 and "find_best_match" in body["stages"]
+    assert body["top_stacks"][0]["samples"] > 0
+
+    response = client.get("/admin/profile?seconds=0.1&format=pstats",
+                          headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.content_type == "application/octet-stream"
+    assert isinstance(marshal.loads(response.data), dict)
+
+
+def test_async_endpoint(monkeypatch, busy_threads):
+    assert call("GET", "/admin/profile")[0] == 404
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    status, headers, body = call("GET", "/admin/profile", query=b"seconds=0.3",
+                                 headers=[(b"authorization", b"Bearer secret")])
+    assert status == 200 and headers[b"content-type"].startswith(b"text/plain")
+    assert b"matcher;" in body
+    assert call("POST", "/admin/profile", headers=[(b"x-admin-token", b"secret")])[0] == 405
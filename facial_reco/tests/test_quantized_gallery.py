@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+import api_server
+import shared_gallery
+from bench_gallery import synthetic_gallery, synthetic_queries
+from shared_gallery import SharedGallery, open_quantized
+from utils import Gallery, QuantizedGallery
+
+
+@pytest.fixture(scope="module")
+def gallery():
+    return Gallery(*synthetic_gallery(5000, 512, 32, 0))
+
+
+def test_rerank_matches_the_exact_gallery(gallery):
+    quantized = QuantizedGallery.from_gallery(gallery)
+    assert quantized.nbytes == gallery.matrix.nbytes // 4 + 4 * len(gallery)
+    for q in synthetic_queries(gallery.matrix, 40, 0):
+        assert quantized.match(q, threshold=0.45) == gallery.match(q, threshold=0.45)
+    assert quantized.match(np.zeros(512)) == (None, None)
+
+
+def test_open_quantized_maps_shared_files(gallery, tmp_path, monkeypatch):
+    quantized = open_quantized(gallery, tmp_path)
+    assert isinstance(quantized.codes, np.memmap) and isinstance(quantized.scales, np.memmap)
+    # The exact matrix is re-read from the mmap'd gallery file, not the heap copy
+    assert not np.shares_memory(quantized.exact, gallery.matrix)
+    assert quantized._exact_gallery._mmap is not None
+    q = synthetic_queries(gallery.matrix, 1, 1)[0]
+    assert quantized.match(q) == gallery.match(q)
+
+    # Another worker maps the same files without quantizing again
+    monkeypatch.setattr(shared_gallery, "_save_codes", lambda *a: pytest.fail("rebuilt"))
+    monkeypatch.setattr(shared_gallery, "save_gallery_file", lambda *a: pytest.fail("rewritten"))
+    assert open_quantized(Gallery(gallery.usernames, gallery.matrix.copy()),
+                          tmp_path).match(q) == gallery.match(q)
+
+
+def test_new_gallery_replaces_old_files(gallery, tmp_path):
+    open_quantized(gallery, tmp_path)
+    smaller = Gallery(gallery.usernames[:10], gallery.matrix[:10].copy())
+    open_quantized(smaller, tmp_path)
+    key = shared_gallery.gallery_digest(smaller.usernames, smaller.matrix)
+    assert sorted(n for n in os.listdir(tmp_path) if not n.startswith(".")) == \
+        [f"{key}.codes.npy", f"{key}.gal", f"{key}.scales.npy"]
+
+
+def test_shared_memory_gallery_is_not_written_out(gallery, tmp_path):
+    shared = SharedGallery(f"mq_test_q{os.getpid()}")
+    try:
+        shared.publish(gallery.usernames[:100], gallery.matrix[:100])
+        current = shared.current()
+        quantized = open_quantized(current, tmp_path)
+        assert quantized.exact is current.matrix
+        assert not any(n.endswith(".gal") for n in os.listdir(tmp_path))
+    finally:
+        shared.destroy()
+        if os.path.exists(shared.lock_path):
+            os.remove(shared.lock_path)
+
+
+@pytest.mark.parametrize("precision, expected", [("int8", QuantizedGallery),
+                                                 ("float16", Gallery)])
+def test_api_gallery_precision(monkeypatch, tmp_path, face_b64, precision, expected):
+    monkeypatch.setenv("GALLERY_PRECISION", precision)
+    monkeypatch.setenv("GALLERY_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(api_server, "face_gallery", None)
+    assert type(api_server.get_gallery()) is expected
+    response = api_server.app.test_client().post("/recognize", json={"image": face_b64})
+    assert response.get_json()["username"] == "user3"
@@ -0,0 +1,49 @@
+import json
+import os
+import threading
+
+import pytest
+
+import register
+
+
+def test_concurrent_saves_never_tear_the_database(tmp_path):
+    path = tmp_path / "database.json"
+    dbs = [{f"w{writer}_{i}": {"embedding": [float(writer)] * 512} for i in range(20)}
+           for writer in range(4)]
+    errors = []
+
+    def writer(db):
+        try:
+            for _ in range(10):
+                register.save_db(db, str(path))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(db,)) for db in dbs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert json.loads(path.read_text()) in dbs
+    assert os.listdir(tmp_path) == ["database.json"]
+
+
+def test_failed_save_keeps_the_old_file_and_no_temp(tmp_path, monkeypatch):
+    path = tmp_path / "database.json"
+    register.save_db({"a": {"embedding": [1.0]}}, str(path))
+    os.chmod(path, 0o644)
+
+    def broken_dump(*args, **kwargs):
+        raise ValueError("not serializable")
+
+    monkeypatch.setattr(register.json, "dump", broken_dump)
+    with pytest.raises(ValueError):
+        register.save_db({"b": {}}, str(path))
+    monkeypatch.undo()
+    assert json.loads(path.read_text()) == {"a": {"embedding": [1.0]}}
+    assert os.listdir(tmp_path) == ["database.json"]
+
+    register.save_db({"c": {}}, str(path))
+    assert os.stat(path).st_mode & 0o777 == 0o644
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from bench_scrfd import FakeSession, face_layout, insightface_detector, largest
+from scrfd_fast import FastSCRFD
+
+pytest.importorskip("insightface.model_zoo.retinaface")
+
+# model_zoo.get_model() loads scrfd_10g_bnkps.onnx as RetinaFace
+DETECTORS = ["retinaface", "scrfd"]
+
+
+def models(faces, input_size, seed, detector="retinaface"):
+    model = insightface_detector(detector, FakeSession(face_layout(faces), seed))
+    model.prepare(-1, input_size=(input_size, input_size), det_thresh=0.5)
+    return model, FastSCRFD(model)
+
+
+@pytest.mark.parametrize("detector", DETECTORS)
+@pytest.mark.parametrize("faces", [0, 1, 3])
+@pytest.mark.parametrize("input_size", [320, 640])
+@pytest.mark.parametrize("frame_size", [(480, 640), (640, 480), (1080, 1920)])
+def test_fast_postprocess_matches_insightface(detector, faces, input_size, frame_size):
+    model, fast = models(faces, input_size, seed=faces + input_size, detector=detector)
+    frame = np.random.default_rng(0).integers(0, 255, frame_size + (3,), dtype=np.uint8)
+    size = (input_size, input_size)
+
+    ref_dets, ref_kpss = model.detect(frame, input_size=size, max_num=0)
+    dets, kpss = fast.detect(frame, input_size=size)
+    assert len(dets) == len(ref_dets) == faces
+    np.testing.assert_allclose(dets, ref_dets, atol=1e-3)
+    np.testing.assert_allclose(kpss, ref_kpss.reshape(kpss.shape), atol=1e-3)
+
+    ref_box, ref_kps = largest(ref_dets, ref_kpss)
+    box, kps = fast.detect_largest(frame, input_size=size)
+    if ref_box is None:
+        assert box is None and kps is None
+    else:
+        np.testing.assert_allclose(box, ref_box, atol=1e-3)
+        np.testing.assert_allclose(kps, ref_kps, atol=1e-3)
+
+
+@pytest.mark.parametrize("detector", DETECTORS)
+def test_supports_and_anchor_cache(detector):
+    model, fast = models(1, 640, 0, detector)
+    assert FastSCRFD.supports(model) and not FastSCRFD.supports(object())
+    centers = fast.anchor_centers((640, 640))
+    assert fast.anchor_centers((640, 640)) is centers
+    assert sum(len(c) for _, c in centers) == 16800
+
+
+def test_get_model_loads_retinaface(tmp_path, monkeypatch):
+    """The class FaceEngine actually wraps, via insightface's model router."""
+    from insightface.model_zoo import model_zoo
+    from insightface.model_zoo.retinaface import RetinaFace
+    session = FakeSession(face_layout(1))
+    session._providers, session._provider_options = ["CPUExecutionProvider"], [{}]
+    monkeypatch.setattr(model_zoo, "PickableInferenceSession", lambda *args, **kwargs: session)
+    path = tmp_path / "scrfd_10g_bnkps.onnx"
+    path.write_bytes(b"")
+    model = model_zoo.ModelRouter(str(path)).get_model()
+    assert isinstance(model, RetinaFace) and not hasattr(model, "batched")
+    model.prepare(-1, input_size=(640, 640), det_thresh=0.5)
+    box, kps = FastSCRFD(model).detect_largest(
+        np.zeros((480, 640, 3), np.uint8), input_size=(640, 640))
+    assert box is not None and kps.shape == (5, 2)
@@ -0,0 +1,126 @@
+import secrets
+import socket
+import zlib
+
+import numpy as np
+import pytest
+
+import api_server
+from bench_gallery import synthetic_gallery, synthetic_queries
+from shard_matcher import (Shard, ShardedGallery, ShardsUnavailable, shard_of,
+                           start_local_shards, wait_for_shards)
+from utils import Gallery
+
+
+def free_base_port(count):
+    """A port p such that p .. p+count-1 are all free right now."""
+    for _ in range(50):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            base = probe.getsockname()[1]
+        if base + count > 65535:
+            continue
+        sockets = []
+        try:
+            for port in range(base, base + count):
+                s = socket.socket()
+                sockets.append(s)
+                s.bind(("127.0.0.1", port))
+            return base
+        except OSError:
+            continue
+        finally:
+            for s in sockets:
+                s.close()
+    pytest.skip("no run of free local ports")
+
+
+def dead_address():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()
+
+
+@pytest.fixture(scope="module")
+def local_shards():
+    usernames, matrix = synthetic_gallery(3000, 512, 32, 0)
+    authkey = secrets.token_bytes(16)
+    processes, addresses = start_local_shards(usernames, matrix, 3, free_base_port(3), authkey)
+    try:
+        coordinator = wait_for_shards(addresses, authkey, len(usernames), wait_s=60,
+                                      timeout=5.0, retry_s=0.0)
+        yield usernames, matrix, coordinator
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            proc.join(5)
+
+
+def test_shard_of_is_stable_and_covers_every_shard():
+    names = [f"user{i}" for i in range(200)]
+    assert [shard_of(n, 4) for n in names] == [shard_of(n, 4) for n in names]
+    assert set(shard_of(n, 4) for n in names) == {0, 1, 2, 3}
+    assert shard_of("user0", 4) == zlib.crc32(b"user0") % 4  # not the per-process hash()
+
+
+def test_shards_partition_the_gallery_in_row_order():
+    usernames, matrix = synthetic_gallery(50, 512, 8, 1)
+    items = list(zip(usernames, matrix))
+    shards = [Shard.from_items(i, 3, items) for i in range(3)]
+    assert sorted(r for s in shards for r in s.rows) == list(range(50))
+    for shard in shards:
+        assert all(shard_of(u, 3) == shard.index for u in shard.usernames)
+        assert list(shard.rows) == sorted(shard.rows)
+
+
+def test_sharded_match_equals_gallery_match(local_shards):
+    usernames, matrix, coordinator = local_shards
+    reference = Gallery(usernames, matrix)
+    for q in synthetic_queries(matrix, 60, 0):
+        expected = reference.match(q, threshold=0.45)
+        user, sim = coordinator.match(q, threshold=0.45)
+        assert user == expected[0]
+        assert sim == pytest.approx(expected[1], abs=1e-4)
+    assert coordinator.sizes and sum(coordinator.sizes) == len(usernames)
+    snapshot = coordinator.snapshot()
+    assert snapshot["partial"] == 0 and snapshot["failed"] == 0
+
+
+def test_top_k_merges_shards_like_a_full_scan(local_shards):
+    usernames, matrix, coordinator = local_shards
+    q = synthetic_queries(matrix, 1, 5)[0]
+    hits, answered = coordinator.top_k(q, k=10)
+    assert answered == 3
+    sims = matrix @ (q / np.linalg.norm(q))
+    assert [row for _, row, _ in hits] == list(np.argsort(-sims, kind="stable")[:10])
+    assert [user for _, _, user in hits] == [usernames[row] for _, row, _ in hits]
+
+
+def test_zero_query_is_rejected_before_the_shards(local_shards):
+    _, _, coordinator = local_shards
+    with pytest.raises(ValueError):
+        coordinator.top_k(np.zeros(512, np.float32))
+    with pytest.raises(ValueError):
+        coordinator.top_k(np.full(512, np.nan, np.float32))
+    queries = coordinator.stats["queries"]
+    assert coordinator.match(np.zeros(512, np.float32)) == (None, None)
+    assert coordinator.stats["queries"] == queries
+
+
+def test_len_raises_until_a_shard_has_reported():
+    coordinator = ShardedGallery([dead_address(), dead_address()], b"key", retry_s=0.0)
+    with pytest.raises(ShardsUnavailable):
+        len(coordinator)
+    assert coordinator.stats["unreachable"] == [1, 1]
+    with pytest.raises(ShardsUnavailable):
+        coordinator.match(np.ones(512, np.float32))
+
+
+def test_recognize_with_no_reachable_shard_is_503(monkeypatch, face_b64):
+    monkeypatch.setenv("MATCHER_SHARDS", "%s:%d" % dead_address())
+    monkeypatch.setattr(api_server, "sharded_gallery",
+                        ShardedGallery([dead_address()], b"key", retry_s=0.0))
+    body, status = api_server.recognize_payload({"image": face_b64})
+    assert status == 503
+    assert "Matching unavailable" in body["error"]
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import threading
+import uuid
+
+import numpy as np
+import pytest
+
+from shared_gallery import (SharedGallery, load_gallery_file, lock_exclusive, pack_gallery,
+                            save_gallery_file, source_of_file, source_of_text, unpack_gallery)
+from utils import build_gallery_matrix
+
+
+def random_db(n, seed):
+    rng = np.random.default_rng(seed)
+    return {f"u{seed}_{i}": {"embedding": rng.standard_normal(512).tolist()} for i in range(n)}
+
+
+@pytest.fixture
+def shared():
+    gallery = SharedGallery(f"mq_test_{uuid.uuid4().hex[:8]}")
+    yield gallery
+    gallery.destroy()
+    if os.path.exists(gallery.lock_path):
+        os.remove(gallery.lock_path)
+
+
+def test_blob_and_file_round_trip(tmp_path):
+    usernames, matrix = build_gallery_matrix(random_db(5, 0))
+    buf = bytearray(4096 * 4)
+    pack_gallery(buf, usernames, matrix, generation=7)
+    names, view, generation = unpack_gallery(buf)
+    assert names == usernames and generation == 7
+    np.testing.assert_array_equal(view, matrix)
+    assert not view.flags.writeable
+
+    save_gallery_file(tmp_path / "g.gal", usernames, matrix, generation=3)
+    gallery, generation = load_gallery_file(tmp_path / "g.gal")
+    assert generation == 3 and gallery.usernames == usernames
+    np.testing.assert_array_equal(gallery.matrix, matrix)
+
+
+def test_publish_attach_and_swap(shared):
+    assert shared.current() is None
+    first = shared.get_or_publish(lambda: random_db(3, 1))
+    assert shared.generation() == 1 and len(first) == 3
+
+    other = SharedGallery(shared.prefix)  # another worker
+    assert other.get_or_publish(lambda: pytest.fail("must attach, not load")).usernames \
+        == first.usernames
+
+    shared.publish_db(random_db(4, 2))
+    assert other.generation() == 2 and len(other.current()) == 4
+    # The Gallery handed out before the swap is still readable
+    assert np.isfinite(first.matrix).all()
+
+
+def test_restart_republishes_a_newer_source(shared, tmp_path):
+    db_path = tmp_path / "database.json"
+    db_path.write_text("{}")
+    old = source_of_file(db_path)
+    shared.get_or_publish(lambda: random_db(3, 1), old)
+
+    # Database updated, then the workers restart
+    db_path.write_text('{"changed": true}')
+    os.utime(db_path, (old[0] + 10, old[0] + 10))
+    restarted = SharedGallery(shared.prefix)
+    gallery = restarted.get_or_publish(lambda: random_db(6, 3), source_of_file(db_path))
+    assert len(gallery) == 6 and restarted.generation() == 2
+
+    # Same source again: attaches without reloading
+    again = SharedGallery(shared.prefix)
+    assert len(again.get_or_publish(lambda: pytest.fail("up to date"),
+                                    source_of_file(db_path))) == 6
+
+
+def test_older_source_keeps_a_newer_publish(shared, tmp_path):
+    newer = tmp_path / "new.json"
+    newer.write_text('{"new": 1}')
+    shared.publish_db(random_db(4, 4), source=source_of_file(newer))
+    # A worker configured with inline JSON (never newer than a file)
+    worker = SharedGallery(shared.prefix)
+    gallery = worker.get_or_publish(lambda: pytest.fail("must keep the publish"),
+                                    source_of_text('{"old": 1}'))
+    assert len(gallery) == 4 and worker.generation() == 1
+
+
+def test_lock_exclusive_serializes_holders(tmp_path):
+    path = tmp_path / ".download.lock"
+    acquired = threading.Event()
+
+    def contender():
+        with open(path, "w") as f:
+            lock_exclusive(f)
+            acquired.set()
+
+    with open(path, "w") as f:
+        lock_exclusive(f)
+        thread = threading.Thread(target=contender)
+        thread.start()
+        assert not acquired.wait(0.3)
+    assert acquired.wait(5)
+    thread.join()
+
+
+def test_publish_and_quantize_without_fcntl(tmp_path):
+    # As on Windows: no fcntl, locks go through msvcrt (faked here)
+    code = f"""
+import subprocess, sys, types  # subprocess itself needs fcntl on Linux
+sys.modules["fcntl"] = None
+msvcrt = types.ModuleType("msvcrt")
+msvcrt.LK_LOCK, msvcrt.calls = 1, []
+msvcrt.locking = lambda fd, mode, n: msvcrt.calls.append(mode)
+sys.modules["msvcrt"] = msvcrt
+import numpy as np
+import shared_gallery
+gallery = shared_gallery.SharedGallery("mq_test_{uuid.uuid4().hex[:8]}")
+try:
+    rng = np.random.default_rng(0)
+    db = {{f"u{{i}}": {{"embedding": rng.standard_normal(512).tolist()}} for i in range(5)}}
+    gallery.publish_db(db)
+    quantized = shared_gallery.open_quantized(gallery.current(), {str(tmp_path)!r})
+    print(len(gallery.current()), len(quantized), len(msvcrt.calls))
+finally:
+    gallery.destroy()
+"""
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=60,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.split() == ["5", "5", "2"]
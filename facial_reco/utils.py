@@ -3,50 +3,301 @@ import os
 import numpy as np
 import cv2
 
-from insightface.model_zoo import get_model
-from insightface.utils.face_align import norm_crop
-
 import json  # if you put them in utils.py
 
 
+def norm_crop(img, landmark, image_size=112):
+    """insightface's norm_crop, imported on first use (see FaceEngine)."""
+    from insightface.utils.face_align import norm_crop as _norm_crop
+    return _norm_crop(img, landmark, image_size=image_size)
+
+
+# 5-point landmark template of the 112x112 ArcFace crop
+# (left eye, right eye, nose, left mouth, right mouth)
+ARCFACE_TEMPLATE = np.array([
+    [38.2946, 51.6963],
+    [73.5318, 51.5014],
+    [56.0252, 71.7366],
+    [41.5493, 92.3655],
+    [70.7299, 92.2041]], dtype=np.float32)
+
+# Distance between the eye landmarks in the 112x112 ArcFace template
+ARCFACE_EYE_DISTANCE = 35.0
+
+# Client-supplied crops / landmarks are rejected if the raw (pre-normalization)
+# ArcFace feature norm is below this; non-face input gives low-norm features
+MIN_FEATURE_NORM = float(os.environ.get("MIN_FEATURE_NORM", 8.0))
+# Max RMS distance (in 112x112 crop pixels) between landmarks mapped by the
+# best similarity transform and the ArcFace template
+MAX_LANDMARK_RESIDUAL = 10.0
+
+# SOF markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) don't
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+             0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def eye_distance(kps):
+    """Pixel distance between the two eye landmarks."""
+    return float(np.linalg.norm(np.asarray(kps[1]) - np.asarray(kps[0])))
+
+
+class FaceInputError(ValueError):
+    """Client-supplied aligned crop or landmarks failed the sanity checks."""
+
+
+def landmarks_problem(kps, shape, max_residual=MAX_LANDMARK_RESIDUAL):
+    """
+    Sanity-check 5 face landmarks against an image of the given shape.
+    Returns None if they look like a face, otherwise the reason.
+    """
+    try:
+        kps = np.asarray(kps, dtype=np.float32)
+    except (TypeError, ValueError):
+        # Not numbers, or ragged lists from a client
+        return "landmarks must be 5 [x, y] points"
+    if kps.shape != (5, 2) or not np.all(np.isfinite(kps)):
+        return "landmarks must be 5 [x, y] points"
+    height, width = shape[:2]
+    eye_dist = eye_distance(kps)
+    if eye_dist < 6:
+        return f"eyes too close ({eye_dist:.1f} px)"
+    margin = 0.5 * eye_dist
+    if (kps[:, 0].min() < -margin or kps[:, 1].min() < -margin
+            or kps[:, 0].max() > width + margin or kps[:, 1].max() > height + margin):
+        return "landmarks outside the image"
+
+    # Fit the best similarity transform onto the template (complex-number
+    # least squares: w ~ a * z) and measure how far off the points are
+    z = kps[:, 0] + 1j * kps[:, 1]
+    w = ARCFACE_TEMPLATE[:, 0] + 1j * ARCFACE_TEMPLATE[:, 1]
+    z = z - z.mean()
+    w = w - w.mean()
+    a = np.vdot(z, w) / np.vdot(z, z).real
+    residual = float(np.sqrt(np.mean(np.abs(w - a * z) ** 2)))
+    if residual > max_residual:
+        return f"landmarks don't match a face layout (residual {residual:.1f} px)"
+    return None
+
+
+def aligned_crop_problem(crop):
+    """Return None if crop looks like a 112x112 BGR aligned face, else the reason."""
+    if crop is None or crop.ndim != 3 or crop.shape[:2] != (112, 112):
+        shape = None if crop is None else crop.shape
+        return f"aligned crop must be 112x112 (got {shape})"
+    if float(crop.std()) < 8.0:
+        return "aligned crop is blank"
+    return None
+
+
+def jpeg_size(data: bytes):
+    """
+    Read (width, height) from a JPEG header without decoding it.
+    Returns None if data isn't a JPEG or the header can't be parsed.
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    n = len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:           # fill byte
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2                   # standalone markers have no length
+            continue
+        if marker in (0xD9, 0xDA):   # end of image / start of scan
+            return None
+        length = (data[i + 2] << 8) | data[i + 3]
+        if marker in _JPEG_SOF:
+            if i + 9 > n:
+                return None
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + length
+    return None
+
+
+def decode_image(data: bytes, target_size=(640, 640)):
+    """
+    Decode image bytes, letting libjpeg scale JPEGs down in the DCT domain
+    (IMREAD_REDUCED_COLOR_2/4/8) when the image is larger than needed.
+
+    The reduction is the largest one that still leaves the image at least as
+    large as what the detector would resize it to for target_size, so the
+    detector input is unchanged. target_size=None always decodes full size.
+
+    Returns: (bgr image or None, scale) where scale maps decoded pixel
+    coordinates back to the original image (1.0 when decoded at full size).
+    """
+    buf = np.frombuffer(data, np.uint8)
+    size = jpeg_size(data) if target_size is not None else None
+    if size is None:
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR), 1.0
+
+    width, height = size
+    tw, th = target_size
+    # Largest factor keeping the decoded image >= detector input, in either
+    # orientation (EXIF rotation is applied after the header is read)
+    max_factor = min(max(width / tw, height / th), max(height / tw, width / th))
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                                 (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                 (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if factor <= max_factor:
+            flag = reduced_flag
+            break
+
+    img = cv2.imdecode(buf, flag)
+    if img is None:
+        return None, 1.0
+    scale = max(width, height) / max(img.shape[:2])
+    return img, scale
+
+
+def parse_roi(roi):
+    """
+    Validate a client [x1, y1, x2, y2] hint (extra items such as a score are
+    ignored). Returns four finite floats, or None if the hint is malformed.
+    """
+    if not isinstance(roi, (list, tuple, np.ndarray)):
+        return None
+    try:
+        box = [float(v) for v in roi[:4]]
+    except (TypeError, ValueError):
+        return None
+    if len(box) != 4 or not all(np.isfinite(box)):
+        return None
+    return box
+
+
+def pad_roi(roi, shape, padding=0.5, min_size=16):
+    """
+    Grow an [x1, y1, x2, y2] region by `padding` x its size on every side and
+    clip it to an image of the given shape.
+
+    Returns integer (x1, y1, x2, y2), or None if the hint is malformed or
+    doesn't overlap the image.
+    """
+    box = parse_roi(roi)
+    if box is None:
+        return None
+    x1, y1, x2, y2 = box
+    w, h = x2 - x1, y2 - y1
+    if not (w > 0 and h > 0):
+        return None
+    height, width = shape[:2]
+    x1 = max(0, int(x1 - padding * w))
+    y1 = max(0, int(y1 - padding * h))
+    x2 = min(width, int(np.ceil(x2 + padding * w)))
+    y2 = min(height, int(np.ceil(y2 + padding * h)))
+    if x2 - x1 < min_size or y2 - y1 < min_size:
+        return None
+    return x1, y1, x2, y2
+
+
+def _fast_detector(model):
+    """Wrap an SCRFD model (RetinaFace or SCRFD class) in FastSCRFD; others are returned as is."""
+    from scrfd_fast import FastSCRFD
+    return FastSCRFD(model) if FastSCRFD.supports(model) else model
+
+
+def _load_model(path, intra_op_threads=0):
+    """
+    insightface's get_model, with ONNX Runtime's intra-op pool limited to
+    `intra_op_threads` (0 = ORT default, one thread per core). Limited
+    pools don't spin while idle, so engines sharing the cores don't burn
+    each other's time.
+    """
+    if not intra_op_threads:
+        from insightface.model_zoo import get_model
+        return get_model(path)
+    import onnxruntime
+    from insightface.model_zoo.model_zoo import (ModelRouter, get_default_provider_options,
+                                                 get_default_providers)
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = 1
+    options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return ModelRouter(path).get_model(providers=get_default_providers(),
+                                       provider_options=get_default_provider_options(),
+                                       sess_options=options)
+
+
 class FaceEngine:
     def __init__(self,
                  detector_path: str = "models/scrfd_10g_bnkps.onnx",
                  recognizer_path: str = "models/w600k_r50.onnx",
                  ctx_id: int = 0,
-                 det_input_size=(640, 640)
+                 det_input_size=(640, 640),
+                 roi_input_size=(320, 320),
+                 light_detector_path: str = None,
+                 light_input_size=(320, 320),
+                 light_min_score: float = 0.6,
+                 fast_postprocess: bool = True,
+                 intra_op_threads: int = 0
                  ):
-        # remember the detector input size for later
+        # insightface pulls in onnxruntime, scikit-image etc.; only pay for it
+        # when an engine is built, not for gallery-only imports of this module
+        # (_load_model imports it)
+
+        # remember the detector input sizes for later
         self.det_input_size = det_input_size
+        self.roi_input_size = roi_input_size
+        self.light_input_size = light_input_size
+        self.light_min_score = light_min_score
+        self._init_stats()
 
         # --- load detector (SCRFD / RetinaFace) ---
         if not os.path.exists(detector_path):
             raise FileNotFoundError(f"Face detector ONNX not found at {detector_path}")
-        self.detector = get_model(detector_path)
+        self.detector = _load_model(detector_path, intra_op_threads)
         # set detection size and threshold here
         self.detector.prepare(
             ctx_id=ctx_id,
             input_size=det_input_size,
             det_thresh=0.5  # this replaces the 'threshold' you were passing to detect()
         )
+        if fast_postprocess:
+            self.detector = _fast_detector(self.detector)
 
         # --- load recognizer (ArcFace R50) ---
         if not os.path.exists(recognizer_path):
             raise FileNotFoundError(f"Recognizer ONNX not found at {recognizer_path}")
-        self.recognizer = get_model(recognizer_path)
+        self.recognizer = _load_model(recognizer_path, intra_op_threads)
         self.recognizer.prepare(ctx_id=ctx_id)
 
-
-    def detect_largest_face(self, bgr_frame):
-        """
-        Returns (bbox, kps) for the largest face.
-        bbox: [x1, y1, x2, y2, score]
-        kps: 5x2 landmarks (left eye, right eye, nose, left mouth, right mouth)
-        """
+        # --- optional cascade: a small SCRFD (e.g. 2.5G / 500M) tried first ---
+        self.light_detector = None
+        if light_detector_path:
+            if not os.path.exists(light_detector_path):
+                raise FileNotFoundError(f"Light detector ONNX not found at {light_detector_path}")
+            self.light_detector = _load_model(light_detector_path, intra_op_threads)
+            self.light_detector.prepare(ctx_id=ctx_id, input_size=light_input_size,
+                                        det_thresh=0.5)
+            if fast_postprocess:
+                self.light_detector = _fast_detector(self.light_detector)
+
+    def _init_stats(self):
+        # how often an ROI hint was enough to find the face, and which
+        # cascade stage served each detection (and why the light one didn't)
+        self.stats = {"roi_hits": 0, "roi_misses": 0,
+                      "light_served": 0, "full_served": 0,
+                      "light_no_face": 0, "light_low_score": 0, "light_bad_landmarks": 0}
+
+
+    def _detect_largest(self, bgr_frame, input_size, detector=None):
+        detector = detector or self.detector
+        if hasattr(detector, "detect_largest"):
+            # FastSCRFD: no NMS when there is only one face
+            return detector.detect_largest(bgr_frame, input_size)
         # SCRFD expects BGR numpy image
-        dets = self.detector.detect(
+        dets = detector.detect(
         bgr_frame,
-        input_size=self.det_input_size,
+        input_size=input_size,
         max_num=0
     )   
         if dets is None or len(dets) == 0:
@@ -61,26 +312,217 @@ class FaceEngine:
         idx = int(np.argmax(areas))
         return bboxes[idx], kpss[idx]
 
-    def get_face_embedding(self, bgr_frame):
+    def _detect_cascade(self, bgr_frame, input_size):
         """
-        Detects + aligns the largest face and returns a 512-D L2-normalized embedding (np.ndarray).
-        Returns None if no face.
+        Largest face, trying the light detector first when one is configured.
+
+        The light detector's answer is used only if its score reaches
+        light_min_score and its landmarks pass landmarks_problem (so the crop
+        handed to norm_crop is as good as the full detector's); otherwise the
+        full detector runs at input_size.
         """
-        bbox, kps = self.detect_largest_face(bgr_frame)
-        if bbox is None or kps is None:
-            return None
+        if self.light_detector is not None:
+            light_size = (min(input_size[0], self.light_input_size[0]),
+                          min(input_size[1], self.light_input_size[1]))
+            bbox, kps = self._detect_largest(bgr_frame, light_size, self.light_detector)
+            if bbox is None or kps is None:
+                self.stats["light_no_face"] += 1
+            elif bbox[4] < self.light_min_score:
+                self.stats["light_low_score"] += 1
+            elif landmarks_problem(kps, bgr_frame.shape):
+                self.stats["light_bad_landmarks"] += 1
+            else:
+                self.stats["light_served"] += 1
+                return bbox, kps
+        bbox, kps = self._detect_largest(bgr_frame, input_size)
+        if bbox is not None:
+            self.stats["full_served"] += 1
+        return bbox, kps
+
+    def detect_largest_face(self, bgr_frame, roi=None):
+        """
+        Returns (bbox, kps) for the largest face.
+        bbox: [x1, y1, x2, y2, score]
+        kps: 5x2 landmarks (left eye, right eye, nose, left mouth, right mouth)
 
-        # Align/crop to ArcFace input (112x112 by default)
-        aligned = norm_crop(bgr_frame, landmark=kps)  # returns BGR 112x112
+        roi: optional [x1, y1, x2, y2] hint (e.g. the previous frame's bbox).
+        SCRFD then only runs on a padded crop around it at roi_input_size,
+        falling back to the full frame if no face is found there.
 
+        With a light detector configured, each detection goes through the
+        cascade in _detect_cascade.
+        """
+        if roi is not None:
+            box = pad_roi(roi, bgr_frame.shape)
+            if box is not None:
+                x1, y1, x2, y2 = box
+                bbox, kps = self._detect_cascade(bgr_frame[y1:y2, x1:x2], self.roi_input_size)
+                if bbox is not None:
+                    self.stats["roi_hits"] += 1
+                    offset = np.array([x1, y1], dtype=np.float32)
+                    bbox = bbox.copy()
+                    bbox[:4] += np.tile(offset, 2)
+                    return bbox, kps + offset
+            self.stats["roi_misses"] += 1
+
+        return self._detect_cascade(bgr_frame, self.det_input_size)
+
+    def _embed_aligned(self, aligned):
+        """Returns (L2-normalized embedding, raw feature norm) for a 112x112 crop."""
         # ArcFace expects RGB float32 normalized to [-1,1] inside insightface get_feat
         # get_feat handles preproc internally, so just pass aligned (BGR is fine)
         feat = self.recognizer.get_feat(aligned)
         # Ensure L2-normalized (most ArcFace models already return normalized; still safe)
-        norm = np.linalg.norm(feat)
+        norm = float(np.linalg.norm(feat))
         if norm > 0:
             feat = feat / norm
-        return feat.astype(np.float32)
+        return feat.astype(np.float32), norm
+
+    def embed_face(self, bgr_frame, kps):
+        """
+        Aligns the face given its 5 landmarks and returns a 512-D L2-normalized
+        embedding (np.ndarray).
+        """
+        # Align/crop to ArcFace input (112x112 by default)
+        aligned = norm_crop(bgr_frame, landmark=kps)  # returns BGR 112x112
+        return self._embed_aligned(aligned)[0]
+
+    def embed_aligned_crop(self, crop, min_feature_norm: float = MIN_FEATURE_NORM):
+        """
+        Embeds a 112x112 BGR crop the client already aligned to the ArcFace
+        template; no detection or alignment runs. Raises FaceInputError if the
+        crop doesn't look like an aligned face.
+        """
+        problem = aligned_crop_problem(crop)
+        if problem:
+            raise FaceInputError(problem)
+        emb, norm = self._embed_aligned(crop)
+        if norm < min_feature_norm:
+            raise FaceInputError(f"crop doesn't look like an aligned face (feature norm {norm:.1f})")
+        return emb
+
+    def embed_with_landmarks(self, bgr_frame, kps, scale: float = 1.0, full_res=None,
+                             min_feature_norm: float = MIN_FEATURE_NORM):
+        """
+        Embeds the face at client-supplied 5-point landmarks (original image
+        coordinates), skipping detection. `scale` / `full_res` work as in
+        get_face. Raises FaceInputError for implausible landmarks.
+        """
+        height, width = bgr_frame.shape[:2]
+        problem = landmarks_problem(kps, (height * scale, width * scale))
+        if problem:
+            raise FaceInputError(problem)
+        kps = np.asarray(kps, dtype=np.float32)
+
+        if scale > 1.0 and (full_res is None or eye_distance(kps) >= scale * ARCFACE_EYE_DISTANCE):
+            # Reduced frame still has enough pixels for the alignment
+            kps = kps / scale
+        elif scale > 1.0:
+            bgr_frame = full_res()
+
+        emb, norm = self._embed_aligned(norm_crop(bgr_frame, landmark=kps))
+        if norm < min_feature_norm:
+            raise FaceInputError(f"landmarks don't frame a face (feature norm {norm:.1f})")
+        return emb
+
+    def align_face(self, bgr_frame, scale: float = 1.0, full_res=None, roi=None):
+        """
+        Detects the largest face and aligns it to a 112x112 ArcFace crop.
+
+        Returns (aligned crop, bbox) with bbox [x1, y1, x2, y2, score] in
+        original image coordinates, or (None, None) if no face.
+
+        If bgr_frame was decoded at reduced size (see decode_image), pass the
+        `scale` back to original pixels and a `full_res` callable returning the
+        full-size frame. Detection always runs on the reduced frame; the
+        full-size frame is only decoded when the face is too small there for a
+        lossless 112x112 alignment, and the landmarks are mapped back to it.
+        `roi` is in original image coordinates; a malformed one is ignored
+        (full-frame detection).
+        """
+        if roi is not None:
+            roi = parse_roi(roi)
+            if roi is not None and scale != 1.0:
+                roi = [v / scale for v in roi]
+        bbox, kps = self.detect_largest_face(bgr_frame, roi=roi)
+        if bbox is None or kps is None:
+            return None, None
+
+        if scale > 1.0 and full_res is not None and eye_distance(kps) < ARCFACE_EYE_DISTANCE:
+            bgr_frame = full_res()
+            kps = kps * scale
+
+        if scale != 1.0:
+            bbox = bbox.copy()
+            bbox[:4] *= scale
+        return norm_crop(bgr_frame, landmark=kps), bbox
+
+    def get_face(self, bgr_frame, scale: float = 1.0, full_res=None, roi=None,
+                 checkpoint=None):
+        """
+        Detects + aligns the largest face and embeds it.
+
+        Returns (embedding, bbox), or (None, None) if no face. See align_face
+        for the arguments. `checkpoint`, if given, is called with the name of
+        the next stage ("embed") once detection is done, and may raise to
+        abandon the request (see admission.Deadline.check).
+        """
+        aligned, bbox = self.align_face(bgr_frame, scale=scale, full_res=full_res, roi=roi)
+        if aligned is None:
+            return None, None
+        if checkpoint is not None:
+            checkpoint("embed")
+        return self._embed_aligned(aligned)[0], bbox
+
+    def get_face_embedding(self, bgr_frame, scale: float = 1.0, full_res=None, roi=None):
+        """
+        Detects + aligns the largest face and returns a 512-D L2-normalized embedding (np.ndarray).
+        Returns None if no face. See align_face for the optional arguments.
+        """
+        return self.get_face(bgr_frame, scale=scale, full_res=full_res, roi=roi)[0]
+
+    def embed_batch(self, aligned_crops, return_norms: bool = False):
+        """
+        Embeds several aligned 112x112 crops with a single recognizer call.
+        Returns an (N, 512) float32 matrix of L2-normalized embeddings, and
+        with return_norms also the (N,) raw feature norms.
+        """
+        if len(aligned_crops) == 0:
+            empty = np.zeros((0, 512), dtype=np.float32)
+            return (empty, np.zeros(0, dtype=np.float32)) if return_norms else empty
+        feats = np.asarray(self.recognizer.get_feat(list(aligned_crops)), dtype=np.float32)
+        norms = np.linalg.norm(feats, axis=1)
+        embs = feats / np.where(norms > 0, norms, 1.0)[:, None]
+        return (embs, norms) if return_norms else embs
+
+    def get_face_embeddings(self, bgr_frames):
+        """
+        Batched get_face_embedding: detects + aligns the largest face in each
+        frame, then embeds all faces in one recognizer call.
+
+        Returns a list with a (512,) embedding or None (no face) per frame.
+        """
+        crops = [self.align_face(frame)[0] for frame in bgr_frames]
+        found = [i for i, crop in enumerate(crops) if crop is not None]
+        embs = self.embed_batch([crops[i] for i in found])
+        results = [None] * len(crops)
+        for row, i in enumerate(found):
+            results[i] = embs[row]
+        return results
+
+
+def pool_worker_engine(detector_path, recognizer_path, ctx_id):
+    """
+    FaceEngine for a ProcessPoolExecutor worker (enroll.py, identify.py).
+    """
+    # One process per core already: keep OpenCV and ONNX Runtime to one
+    # thread each, or every worker spawns a thread per core
+    cv2.setNumThreads(1)
+    return FaceEngine(detector_path=detector_path,
+                      recognizer_path=recognizer_path,
+                      ctx_id=ctx_id,
+                      det_input_size=(640, 640),
+                      intra_op_threads=1)
 
 def average_embeddings(emb_list):
     """
@@ -163,3 +605,174 @@ def find_best_match(query_emb: np.ndarray,
         return None, best_sim
 
     return best_user, best_sim
+
+
+def build_gallery_matrix(db: dict):
+    """
+    Stack the DB embeddings into a single L2-normalized float32 matrix.
+
+    Applies the same rules as find_best_match: records without an embedding,
+    with a different dimension than the first usable record, or with a zero
+    norm are skipped.
+
+    Returns: (usernames list, (N, D) float32 matrix)
+    """
+    usernames = []
+    rows = []
+    dim = None
+    for username, record in db.items():
+        if "embedding" not in record:
+            continue
+        ref = _to_vec(record["embedding"]).ravel()
+        if dim is None:
+            dim = ref.size
+        if ref.size != dim:
+            continue
+        r_norm = np.linalg.norm(ref)
+        if r_norm == 0:
+            continue
+        usernames.append(username)
+        rows.append(ref / r_norm)
+
+    if not rows:
+        return [], np.zeros((0, dim or 512), dtype=np.float32)
+    return usernames, np.ascontiguousarray(np.stack(rows, axis=0), dtype=np.float32)
+
+
+class Gallery:
+    """
+    Enrolled users as a normalized (N, D) matrix for vectorized matching.
+
+    The matrix is used as-is (no copy), so it can be a view onto shared
+    memory or an mmap.
+    """
+
+    def __init__(self, usernames, matrix):
+        self.usernames = list(usernames)
+        self.matrix = matrix
+
+    @classmethod
+    def from_db(cls, db: dict):
+        return cls(*build_gallery_matrix(db))
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def match(self, query_emb: np.ndarray, threshold: float = 0.45):
+        """
+        Same contract as find_best_match: (username, similarity) or
+        (None, best_similarity).
+        """
+        if query_emb is None:
+            return None, None
+
+        q = np.asarray(query_emb, dtype=np.float32).ravel()
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return None, None
+        q = q / q_norm
+
+        if len(self.usernames) == 0 or q.size != self.matrix.shape[1]:
+            return None, -1.0
+
+        sims = self.matrix @ q
+        idx = int(np.argmax(sims))
+        best_sim = float(sims[idx])
+        if best_sim < threshold:
+            return None, best_sim
+        return self.usernames[idx], best_sim
+
+
+def quantize_int8(matrix, codes=None, scales=None, block_rows=256):
+    """
+    int8 codes of a normalized (N, D) matrix with one float32 scale per row
+    (row ~ codes * scale). Works block by block, so `matrix` can be an mmap
+    and `codes` / `scales` preallocated arrays (e.g. np.lib.format.open_memmap)
+    without the whole float32 matrix ever being copied to the heap.
+    """
+    if codes is None:
+        codes = np.empty(matrix.shape, dtype=np.int8)
+    if scales is None:
+        scales = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        scale = np.abs(block).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        codes[start:start + len(block)] = np.rint(block / scale[:, None])
+        scales[start:start + len(block)] = scale
+    return codes, scales
+
+
+class QuantizedGallery:
+    """
+    Gallery scanned through int8 codes, with an exact float32 re-rank.
+
+    The codes (one float32 scale per vector) are a quarter of the float32
+    matrix. The `candidates` best coarse scores are re-scored against the
+    exact matrix, which should be an mmap (see shared_gallery.open_quantized)
+    or a shared-memory view: only those rows are ever paged in, so the
+    float32 matrix doesn't have to stay resident. The scan itself runs at
+    about the speed of the float32 product; the saving is memory.
+
+    match() has the same contract as find_best_match / Gallery.match.
+    """
+
+    # Rows converted to float32 per block: small enough for the temporary to
+    # stay in L2
+    BLOCK_ROWS = 256
+
+    def __init__(self, usernames, exact_matrix, codes=None, scales=None, candidates=32):
+        self.usernames = list(usernames)
+        self.exact = exact_matrix
+        self.candidates = candidates
+        if codes is None or scales is None:
+            codes, scales = quantize_int8(exact_matrix, block_rows=self.BLOCK_ROWS)
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def from_gallery(cls, gallery, candidates=32):
+        return cls(gallery.usernames, gallery.matrix, candidates=candidates)
+
+    def __len__(self):
+        return len(self.usernames)
+
+    @property
+    def nbytes(self):
+        """Size of the scan representation (excludes the exact matrix)."""
+        return self.codes.nbytes + self.scales.nbytes
+
+    def coarse_scores(self, q):
+        """Approximate similarities of a normalized (D,) query to every row."""
+        scores = np.empty(len(self.usernames), dtype=np.float32)
+        for start in range(0, len(self.usernames), self.BLOCK_ROWS):
+            block = self.codes[start:start + self.BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ q
+        scores *= self.scales
+        return scores
+
+    def match(self, query_emb: np.ndarray, threshold: float = 0.45):
+        if query_emb is None:
+            return None, None
+
+        q = np.asarray(query_emb, dtype=np.float32).ravel()
+        q_norm = np.linalg.norm(q)
+        if q_norm == 0:
+            return None, None
+        q = q / q_norm
+
+        n = len(self.usernames)
+        if n == 0 or q.size != self.codes.shape[1]:
+            return None, -1.0
+
+        coarse = self.coarse_scores(q)
+        k = min(self.candidates, n)
+        cand = np.argpartition(coarse, n - k)[n - k:] if k < n else np.arange(n)
+        cand.sort()  # ascending rows: sequential mmap reads, first-index ties
+
+        exact = np.asarray(self.exact[cand], dtype=np.float32) @ q
+        best = int(np.argmax(exact))
+        best_sim = float(exact[best])
+        if best_sim < threshold:
+            return None, best_sim
+        return self.usernames[int(cand[best])], best_sim
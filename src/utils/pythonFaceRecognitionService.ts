@@ -14,6 +14,7 @@ export interface RecognitionResult {
   success: boolean;
   username?: string;
   similarity?: number;
+  bbox?: number[];
   message?: string;
   error?: string;
 }
@@ -22,6 +23,8 @@ class PythonFaceRecognitionService {
   private apiUrl: string;
   private healthCheckCache: { healthy: boolean; timestamp: number } | null = null;
   private readonly HEALTH_CHECK_CACHE_MS = 30000; // 30 seconds
+  // Face box from the last response, sent back as a detection hint
+  private lastFaceBox: number[] | null = null;
 
   constructor(apiUrl: string = API_BASE_URL) {
     this.apiUrl = apiUrl;
@@ -96,7 +99,8 @@ class PythonFaceRecognitionService {
    */
   async recognizeFace(
     video: HTMLVideoElement,
-    threshold: number = 0.45
+    threshold: number = 0.45,
+    namespace?: string
   ): Promise<RecognitionResult> {
     try {
       console.log('🔍 Starting face recognition...');
@@ -119,8 +123,9 @@ class PythonFaceRecognitionService {
       // Call the Python API with CORS configuration and timeout
       console.log('📡 Sending recognition request to:', `${this.apiUrl}/recognize`);
       
+      const timeoutMs = 30000; // 30 second timeout
       const controller = new AbortController();
-      const timeoutId = setTimeout(() => controller.abort(), 30000); // 30 second timeout
+      const timeoutId = setTimeout(() => controller.abort(), timeoutMs);
 
       const response = await fetch(`${this.apiUrl}/recognize`, {
         method: 'POST',
@@ -129,22 +134,39 @@ class PythonFaceRecognitionService {
         headers: {
           'Content-Type': 'application/json',
           'Accept': 'application/json',
+          // Lets the server drop the request once we've stopped waiting
+          'X-Request-Timeout-Ms': String(timeoutMs),
         },
         body: JSON.stringify({
           image: base64Image,
-          threshold: threshold
+          threshold: threshold,
+          // Only search this realm's users (e.g. one venue or guild)
+          ...(namespace ? { namespace } : {}),
+          ...(this.lastFaceBox ? { roi: this.lastFaceBox } : {})
         }),
         signal: controller.signal,
       });
 
       clearTimeout(timeoutId);
 
+      if (response.status === 503) {
+        // Server is shedding load; it tells us when to come back
+        const retryAfter = Number(response.headers.get('Retry-After')) || 1;
+        console.warn(`⏳ API busy, retry in ${retryAfter}s`);
+        return {
+          success: false,
+          message: `The recognition server is busy. Please try again in ${retryAfter} seconds.`,
+          error: 'SERVER_BUSY'
+        };
+      }
+
       if (!response.ok) {
         console.error('❌ API request failed with status:', response.status, response.statusText);
         throw new Error(`API request failed: ${response.status} ${response.statusText}`);
       }
 
       const data: RecognitionResult = await response.json();
+      this.lastFaceBox = data.bbox ?? null;
       console.log('🔍 API Response:', data);
       console.log('📊 Similarity:', data.similarity);
       console.log('✅ Success:', data.success);